@@ -11,7 +11,9 @@ __all__ = (
     "native_readfile",
 )
 
+import codecs
 import errno
+import io
 import itertools
 import mmap
 import os
@@ -71,6 +73,7 @@ def native_readlines(
     swallow_missing=False,
     none_on_missing=False,
     encoding=None,
+    batched=False,
 ):
     """Read a file, yielding each line.
 
@@ -79,6 +82,8 @@ def native_readlines(
     :param swallow_missing: throw an IOError if missing, or swallow it?
     :param none_on_missing: if the file is missing, return None, else
         if the file is missing return an empty iterable
+    :param batched: if True, the file is read in large chunks and lists of lines
+        are yielded rather than individual lines.  This is far faster for huge files.
     """
     handle = iterable = None
     try:
@@ -91,6 +96,10 @@ def native_readlines(
         return readlines_iter(iter([]), None, close=False)
 
     mtime = os.fstat(handle.fileno()).st_mtime
+    if batched:
+        return readlines_iter(
+            _iter_line_batches(handle, strip_whitespace), mtime, source=handle
+        )
     if not iterable:
         iterable = iter(handle)
     if not strip_whitespace:
@@ -103,6 +112,67 @@ def _strip_whitespace_filter(iterable):
         yield line.strip()
 
 
+# characters str.splitlines breaks on beyond \n; \r is absent after translation.
+_extra_str_line_breaks = "\v\f\x1c\x1d\x1e\x85\u2028\u2029"
+
+
+def _iter_line_batches(handle, strip_whitespace, chunk_size=(1024 * 1024)):
+    if isinstance(handle, io.TextIOBase):
+        # decoding and newline translation of large chunks is far cheaper than
+        # what TextIOWrapper does; thus read the binary handle underneath.
+        decode = codecs.getincrementaldecoder(handle.encoding)(handle.errors).decode
+        read = handle.buffer.read
+        newline = "\n"
+        extra_line_breaks = _extra_str_line_breaks
+    else:
+        decode = None
+        read = handle.read
+        newline = b"\n"
+        extra_line_breaks = (b"\r",)
+    empty = newline[:0]
+    pending = []
+    carry = empty
+    eof = False
+    while not eof:
+        data = read(chunk_size)
+        eof = not data
+        if decode is not None:
+            chunk = carry + decode(data, eof)
+            carry = empty
+            if "\r" in chunk:
+                if not eof and chunk[-1] == "\r":
+                    # potentially the first half of a \r\n
+                    chunk, carry = chunk[:-1], "\r"
+                # stripping drops the \r of \r\n; only lone \r need translation then.
+                if not strip_whitespace or chunk.count("\r") != chunk.count("\r\n"):
+                    chunk = chunk.replace("\r\n", "\n").replace("\r", "\n")
+        else:
+            chunk = data
+        end = chunk.rfind(newline) + 1
+        if not end:
+            if chunk:
+                pending.append(chunk)
+            continue
+        body = chunk[:end]
+        if pending:
+            pending.append(body)
+            body = empty.join(pending)
+            pending = []
+        if end != len(chunk):
+            pending.append(chunk[end:])
+        if strip_whitespace:
+            lines = body.split(newline)
+            lines.pop()
+            yield [x.strip() for x in lines]
+        elif not any(x in body for x in extra_line_breaks):
+            yield body.splitlines(True)
+        else:
+            yield [x + newline for x in body.split(newline)[:-1]]
+    if pending:
+        tail = empty.join(pending)
+        yield [tail.strip() if strip_whitespace else tail]
+
+
 def native_readfile(mode, mypath, none_on_missing=False, encoding=None):
     """Read a file, returning the contents.
 
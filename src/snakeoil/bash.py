@@ -8,12 +8,23 @@ Its primary usage is for reading things like gentoo make.conf's, or
 libtool .la files that are bash compatible, but non-executable.
 """
 
+import json
+import mmap
+import os
+import re
+from bisect import bisect_left
+from collections import ChainMap, deque, namedtuple
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from io import StringIO
+from itertools import islice
 from shlex import shlex
 
 from snakeoil._internals import deprecated
 
 from .delayed import regexp
-from .fileutils import readlines
+from .fileutils import AtomicWriteFile, mmap_or_open_for_read, readlines
 from .log import logger
 from .mappings import ProtectedDict
 
@@ -23,11 +34,34 @@ var_find = regexp(r"\\?(\${\w+}|\$\w+)")
 backslash_find = regexp(r"\\.")
 ansi_escape_re = regexp(r"(\x9B|\x1B\[)[0-?]*[ -/]*[@-~]")
 
+# characters bash_parser adds to shlex's posix word characters
+_extra_wordchars = "@${}/.-+/:~^*"
+_wordchars_class = re.escape(shlex(posix=True).wordchars + _extra_wordchars)
+# Pieces of a word for the read_bash_dict fast path: unquoted runs, double
+# quoted strings with no escapes other than line continuations, and single
+# quoted strings.  Any other backslash usage requires the full parser.
+_word_pieces = (
+    rf"([{_wordchars_class}]+)"
+    r'|"((?:[^"\\]|\\\n)*)"'
+    r"|'([^']*)'"
+)
+_fast_word_piece_re = regexp(_word_pieces)
+_fast_token_re = regexp(
+    r"(?P<ws>[ \t\r\n]+)"
+    r"|(?P<comment>#[^\n]*\n?)"
+    rf"|(?P<word>(?:{_word_pieces})+)"
+    r"""|(?P<other>[^\\"'])"""
+)
+
 __all__ = (
     "iter_read_bash",
     "read_bash",
     "read_dict",
     "read_bash_dict",
+    "read_bash_dicts",
+    "BashDictCache",
+    "BashAssignment",
+    "IncrementalBashDict",
     "BashParseError",
 )
 
@@ -40,7 +74,11 @@ iter_read_bash = deprecated(
 
 
 def read_bash(
-    bash_source, allow_inline_comments=True, allow_line_cont=False, enum_line=False
+    bash_source,
+    allow_inline_comments=True,
+    allow_line_cont=False,
+    enum_line=False,
+    batched=False,
 ):
     """Iterate over a file honoring bash commenting rules and line continuations.
 
@@ -55,8 +93,17 @@ def read_bash(
     :param allow_inline_comments: whether or not to prune characters
         after a # that isn't at the start of a line.
     :param allow_line_cont: whether or not to respect line continuations
+    :param batched: if True, lists of lines are yielded rather than individual
+        lines.  Files are then mmap'd and, as with byte buffers (e.g. bytes or
+        mmaps) passed as `bash_source`, decoded and split as a whole rather
+        than read line by line; this is far faster for huge files.
     :return: yields lines w/ commenting stripped out
     """
+    if batched:
+        yield from _read_bash_batched(
+            bash_source, allow_inline_comments, allow_line_cont, enum_line
+        )
+        return
     if isinstance(bash_source, str):
         bash_source = readlines(bash_source, True)
     s = ""
@@ -88,6 +135,100 @@ def read_bash(
             yield s
 
 
+def _read_bash_batched(
+    bash_source, allow_inline_comments, allow_line_cont, enum_line, batch_size=1024
+):
+    if isinstance(bash_source, str):
+        m, _ = mmap_or_open_for_read(bash_source)
+        if m is None:
+            # files stat'ing as empty may still have content, e.g. within /proc
+            with open(bash_source, "rb") as f:
+                data = f.read()
+        else:
+            data = m
+        try:
+            yield from _read_bash_buffer(
+                data,
+                allow_inline_comments,
+                allow_line_cont,
+                enum_line,
+                batch_size,
+            )
+        finally:
+            if m is not None:
+                m.close()
+        return
+    if isinstance(bash_source, (bytes, bytearray, memoryview, mmap.mmap)):
+        yield from _read_bash_buffer(
+            bash_source, allow_inline_comments, allow_line_cont, enum_line, batch_size
+        )
+        return
+    # file objects and iterables of lines are scanned line by line regardless
+    lines = read_bash(bash_source, allow_inline_comments, allow_line_cont, enum_line)
+    while batch := list(islice(lines, batch_size)):
+        yield batch
+
+
+def _read_bash_buffer(data, allow_inline_comments, allow_line_cont, enum_line, size):
+    # Equivalent to read_bash over readlines(path, True) of the data, but
+    # decoding and line splitting is done for the whole buffer at once, and
+    # lines are filtered a batch at a time.
+    text = str(data, "utf8")
+    if "\r" in text:
+        # universal newlines, as text mode reading does
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    lines = text.split("\n")
+    if not lines[-1]:
+        # trailing newline rather than a trailing empty line
+        lines.pop()
+
+    if not allow_line_cont:
+        inline = allow_inline_comments
+        for start in range(0, len(lines), size):
+            chunk = map(str.strip, lines[start : start + size])
+            if enum_line:
+                batch = [
+                    (i, s.split("#", 1)[0].rstrip() if inline and "#" in s else s)
+                    for i, s in enumerate(chunk, start + 1)
+                    if s and s[0] != "#"
+                ]
+            else:
+                batch = [
+                    s.split("#", 1)[0].rstrip() if inline and "#" in s else s
+                    for s in chunk
+                    if s and s[0] != "#"
+                ]
+            if batch:
+                yield batch
+        return
+
+    inline_comment = inline_comment_regexp.match
+    line_cont = line_cont_regexp.match
+    batch = []
+    s = ""
+    lineno = 0
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        s = s + line if s else line
+        if s:
+            if s[0] != "#":
+                if allow_inline_comments and inline_comment(line):
+                    s = s.split("#", 1)[0].rstrip()
+                if line_cont(line):
+                    s = s.rstrip("\\\n")
+                    continue
+                s = s.rstrip()
+                batch.append((lineno, s) if enum_line else s)
+                if len(batch) >= size:
+                    yield batch
+                    batch = []
+            s = ""
+    if s:
+        batch.append((lineno, s) if enum_line else s)
+    if batch:
+        yield batch
+
+
 def read_bash_dict(bash_source, vars_dict=None, sourcing_command=None):
     """Read bash source, yielding a dict of vars.
 
@@ -103,69 +244,301 @@ def read_bash_dict(bash_source, vars_dict=None, sourcing_command=None):
     :return: dict representing the resultant env if bash executed the source.
     """
 
+    return _read_bash_dict(bash_source, vars_dict, sourcing_command)[0]
+
+
+def _read_bash_dict(bash_source, vars_dict, sourcing_command):
+    """:return: the resultant env and a list of the files sourced, paired with
+    their stat results as of opening them
+    """
+
     # quite possibly I'm missing something here, but the original
     # portage_util getconfig/varexpand seemed like it only went
     # halfway. The shlex posix mode *should* cover everything.
 
-    if vars_dict is not None:
-        d, protected = ProtectedDict(vars_dict), True
-    else:
-        d, protected = {}, False
-
-    close = False
     infile = None
     if isinstance(bash_source, str):
-        f = open(bash_source, "r")
-        close = True
         infile = bash_source
+        with open(bash_source, "r") as f:
+            data = f.read()
     else:
-        f = bash_source
-    s = bash_parser(f, sourcing_command=sourcing_command, env=d, infile=infile)
+        data = bash_source.read()
 
+    # the common subset of syntax is handled by a regex based tokenizer,
+    # anything else is reparsed from scratch via bash_parser.
+    d = _new_env(vars_dict)
+    sourced = []
     try:
-        tok = ""
+        _parse_assignments(_fast_lexer(data, d, sourcing_command), d, bash_source)
+    except (_FastPathUnsupported, BashParseError):
+        d = None
+    if d is None:
+        d = _new_env(vars_dict)
+        s = bash_parser(
+            StringIO(data), sourcing_command=sourcing_command, env=d, infile=infile
+        )
+        _parse_assignments(s, d, bash_source)
+        sourced = s.sourced
+    if vars_dict is not None:
+        d = d.new
+    return d, sourced
+
+
+def read_bash_dicts(
+    paths, vars_dict=None, sourcing_command=None, workers=None, chunksize=32
+):
+    """Parse many files via :py:func:`read_bash_dict` across a process pool.
+
+    Parsing is CPU bound, thus processes rather than threads are used.  Files
+    are sent to the workers in chunks, with results yielded in the order of
+    `paths` as they become available.
+
+    :param paths: iterable of file paths to parse
+    :param vars_dict: initial 'env' for each file, see :py:func:`read_bash_dict`
+    :param sourcing_command: see :py:func:`read_bash_dict`
+    :param workers: number of worker processes; defaults to the cpu count.  If 1,
+        files are parsed in process.
+    :param chunksize: number of files sent to a worker at a time
+    :return: iterator of (path, result) tuples, where result is either the
+        parsed dict or the :py:class:`BashParseError` or :py:class:`OSError`
+        raised for the file
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunksize <= 0:
+        raise ValueError(f"chunksize must be positive: {chunksize!r}")
+    paths = iter(paths)
+    chunks = iter(lambda: list(islice(paths, chunksize)), [])
+
+    if workers == 1:
+        for chunk in chunks:
+            yield from _read_bash_dicts_chunk(chunk, vars_dict, sourcing_command)
+        return
+
+    pool = ProcessPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        # keep every worker busy while bounding results held in memory.
+        for chunk in islice(chunks, workers * 2):
+            pending.append(
+                pool.submit(_read_bash_dicts_chunk, chunk, vars_dict, sourcing_command)
+            )
+        while pending:
+            results = pending.popleft().result()
+            if (chunk := next(chunks, None)) is not None:
+                pending.append(
+                    pool.submit(
+                        _read_bash_dicts_chunk, chunk, vars_dict, sourcing_command
+                    )
+                )
+            yield from results
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _read_bash_dicts_chunk(paths, vars_dict, sourcing_command):
+    results = []
+    for path in paths:
         try:
-            while tok is not None:
+            result = read_bash_dict(path, vars_dict, sourcing_command)
+        except (BashParseError, OSError) as e:
+            # tracebacks reference frames that can't be pickled
+            result = e.with_traceback(None)
+        results.append((path, result))
+    return results
+
+
+def _new_env(vars_dict):
+    if vars_dict is not None:
+        return ProtectedDict(vars_dict)
+    return {}
+
+
+def _parse_assignments(s, d, bash_source):
+    """Populate d with the assignments read from a bash_parser like token source"""
+    tok = ""
+    try:
+        while tok is not None:
+            key = s.get_token()
+            if key == "export":
+                # discard 'export' token from "export VAR=VALUE" lines
                 key = s.get_token()
-                if key == "export":
-                    # discard 'export' token from "export VAR=VALUE" lines
-                    key = s.get_token()
-                if key is None:
-                    break
-                elif key.isspace():
-                    # we specifically have to check this, since we're
-                    # screwing with the whitespace filters below to
-                    # detect empty assigns
-                    continue
-                eq = s.get_token()
-                if eq != "=":
-                    raise BashParseError(
-                        bash_source, s.lineno, "got token %r, was expecting '='" % eq
-                    )
+            if key is None:
+                break
+            elif key.isspace():
+                # we specifically have to check this, since we're
+                # screwing with the whitespace filters below to
+                # detect empty assigns
+                continue
+            eq = s.get_token()
+            if eq != "=":
+                raise BashParseError(
+                    bash_source, s.lineno, "got token %r, was expecting '='" % eq
+                )
+            val = s.get_token()
+            if val is None:
+                val = ""
+            elif val == "export":
                 val = s.get_token()
-                if val is None:
-                    val = ""
-                elif val == "export":
-                    val = s.get_token()
-                # look ahead to see if we just got an empty assign.
-                next_tok = s.get_token()
-                if next_tok == "=":
-                    # ... we did.
-                    # leftmost insertions, thus reversed ordering
-                    s.push_token(next_tok)
-                    s.push_token(val)
-                    val = ""
-                else:
-                    s.push_token(next_tok)
-                d[key] = val
-        except ValueError as e:
-            raise BashParseError(bash_source, s.lineno, str(e)) from e
-    finally:
-        if close and f is not None:
-            f.close()
-    if protected:
-        d = d.new
-    return d
+            # look ahead to see if we just got an empty assign.
+            next_tok = s.get_token()
+            if next_tok == "=":
+                # ... we did.
+                # leftmost insertions, thus reversed ordering
+                s.push_token(next_tok)
+                s.push_token(val)
+                val = ""
+            else:
+                s.push_token(next_tok)
+            d[key] = val
+    except ValueError as e:
+        raise BashParseError(bash_source, s.lineno, str(e)) from e
+
+
+class _FastPathUnsupported(Exception):
+    """Source uses syntax the fast path doesn't handle"""
+
+
+class _fast_lexer:
+    """Regex based tokenizer producing the same tokens as :py:class:`bash_parser`
+
+    Only a subset of syntax is supported; :py:class:`_FastPathUnsupported` is
+    raised for anything else.  Tokens are expanded as they're read, mirroring
+    bash_parser, since assignments affect the expansion of later tokens.
+    """
+
+    __slots__ = ("_tokens", "_pushback", "_source")
+
+    # line numbers aren't tracked; errors are reported via the full parser.
+    lineno = 0
+
+    def __init__(self, data, env, sourcing_command=None):
+        self._tokens = self._iter_tokens(data, env)
+        self._pushback = []
+        self._source = sourcing_command
+
+    def get_token(self):
+        if self._pushback:
+            return self._pushback.pop()
+        tok = next(self._tokens, None)
+        if tok is not None and tok == self._source:
+            raise _FastPathUnsupported("sourcing")
+        return tok
+
+    def push_token(self, tok):
+        self._pushback.append(tok)
+
+    @staticmethod
+    def _iter_tokens(data, env):
+        match = _fast_token_re.match
+        finditer = _fast_word_piece_re.finditer
+        end = len(data)
+        pos = 0
+        while pos < end:
+            if (m := match(data, pos)) is None:
+                raise _FastPathUnsupported(pos)
+            pos = m.end()
+            kind = m.lastgroup
+            if kind == "word":
+                yield _fast_expand(m.group(), env, pos == end, finditer)
+                if pos != end and data[pos] not in " \t\r\n#\\\"'":
+                    # shlex returns the character ending a word as its own token
+                    yield data[pos]
+                    pos += 1
+            elif kind == "other":
+                # shlex discards non-word characters leading a token
+                yield ""
+
+
+class _span_lexer(_fast_lexer):
+    """:py:class:`_fast_lexer` tracking the source spans of the tokens read
+
+    Sourcing isn't supported.  The spans of the tokens returned since the last
+    assignment are in ``read``, and ``scan_end`` is the end of the furthest
+    token lexed.
+    """
+
+    __slots__ = ("_data", "_env", "read", "scan_end")
+
+    def __init__(self, data, env, pos=0):
+        self._data, self._env = data, env
+        self._pushback = []
+        self._source = None
+        self.read = []
+        self.seek(pos)
+
+    def seek(self, pos):
+        """continue lexing from pos, which must be the start of a token"""
+        self._tokens = self._iter_tokens(self._data, self._env, pos)
+        self._pushback.clear()
+        self.scan_end = pos
+
+    def get_token(self):
+        if self._pushback:
+            span = self._pushback.pop()
+        else:
+            end = len(self._data)
+            span = next(self._tokens, (None, end, end))
+            self.scan_end = span[2]
+        self.read.append(span)
+        return span[0]
+
+    def push_token(self, tok):
+        self._pushback.append(self.read.pop())
+
+    @property
+    def next_start(self):
+        """start of the next token to be returned"""
+        return self._pushback[-1][1]
+
+    @property
+    def lookahead(self):
+        """spans of the tokens lexed but pushed back"""
+        return self._pushback
+
+    @staticmethod
+    def _iter_tokens(data, env, pos=0):
+        # mirrors _fast_lexer._iter_tokens, yielding (token, start, end) tuples
+        match = _fast_token_re.match
+        finditer = _fast_word_piece_re.finditer
+        end = len(data)
+        while pos < end:
+            if (m := match(data, pos)) is None:
+                raise _FastPathUnsupported(pos)
+            start, pos = m.span()
+            kind = m.lastgroup
+            if kind == "word":
+                yield _fast_expand(m.group(), env, pos == end, finditer), start, pos
+                if pos != end and data[pos] not in " \t\r\n#\\\"'":
+                    yield data[pos], pos, pos + 1
+                    pos += 1
+            elif kind == "other":
+                yield "", start, pos
+
+
+def _fast_expand(word, env, at_eof, finditer):
+    # Mirror bash_parser's expansion: double quoted and unquoted segments are
+    # expanded separately, while unquoted text preceding a single quoted
+    # string, or ending the source, is left as is.
+    if '"' not in word and "'" not in word:
+        return word if at_eof else _var_expand(word, env)
+    result = []
+    pending = ""
+    for m in finditer(word):
+        kind = m.lastindex
+        if kind == 1:
+            pending += m.group(1)
+        elif kind == 2:
+            if pending:
+                result.append(_var_expand(pending, env))
+                pending = ""
+            result.append(_var_expand(m.group(2), env).replace("\\\n", ""))
+        else:
+            result.append(pending + m.group(3))
+            pending = ""
+    if pending:
+        result.append(pending if at_eof else _var_expand(pending, env))
+    return "".join(result)
 
 
 def read_dict(
@@ -252,13 +625,16 @@ class bash_parser(shlex):
         """
         self.__dict__["state"] = " "
         super().__init__(source, posix=True, infile=infile)
-        self.wordchars += "@${}/.-+/:~^*"
+        self.wordchars += _extra_wordchars
         self.wordchars = frozenset(self.wordchars)
         if sourcing_command is not None:
             self.source = sourcing_command
         if env is None:
             env = {}
         self.env = env
+        # (path, stat result prior to reading) of files pulled in via the
+        # sourcing command
+        self.sourced = []
         self.__pos = 0
 
     def __setattr__(self, attr, val):
@@ -272,9 +648,11 @@ class bash_parser(shlex):
 
     def sourcehook(self, newfile):
         try:
-            return super().sourcehook(newfile)
+            newfile, f = super().sourcehook(newfile)
         except IOError as e:
             raise BashParseError(newfile, 0, str(e)) from e
+        self.sourced.append((newfile, os.fstat(f.fileno())))
+        return newfile, f
 
     def read_token(self):
         self.changed_state = []
@@ -296,32 +674,488 @@ class bash_parser(shlex):
         return tok
 
     def var_expand(self, val):
-        prev, pos = 0, 0
-        l = []
-        while match := var_find.search(val, pos):
-            pos = match.start()
-            if val[pos] == "\\":
-                # it's escaped. either it's \\$ or \\${ , either way,
-                # skipping two ahead handles it.
-                pos += 2
-            else:
-                var = val[match.start() : match.end()].strip("${}")
-                if prev != pos:
-                    l.append(val[prev:pos])
-                if var in self.env:
-                    if not isinstance(self.env[var], str):
-                        raise ValueError(
-                            "env key %r must be a string, not %s: %r"
-                            % (var, type(self.env[var]), self.env[var])
-                        )
-                    l.append(self.env[var])
-                else:
-                    l.append("")
-                prev = pos = match.end()
+        return _var_expand(val, self.env)
+
 
-        # do \\ cleansing, collapsing val down also.
-        val = backslash_find.sub(_nuke_backslash, "".join(l) + val[prev:])
+def _var_expand(val, env):
+    if "$" not in val and "\\" not in val:
         return val
+    if len(val) > _VAR_TEMPLATE_CACHE_LEN:
+        literals, names, raw = _parse_var_template(val)
+    else:
+        literals, names, raw = _compile_var_template(val)
+    if not names:
+        return literals[0]
+    values = []
+    for var in names:
+        if var in env:
+            if not isinstance(value := env[var], str):
+                raise ValueError(
+                    "env key %r must be a string, not %s: %r"
+                    % (var, type(value), value)
+                )
+            values.append(value)
+        else:
+            values.append("")
+    # backslashes in substituted values are collapsed too, potentially
+    # escaping the following literal; rare, so do it the slow way.
+    unescaped = any("\\" in x for x in values)
+    if unescaped:
+        literals = raw
+    parts = [literals[0]]
+    for value, literal in zip(values, literals[1:]):
+        parts += (value, literal)
+    if unescaped:
+        return backslash_find.sub(_nuke_backslash, "".join(parts))
+    return "".join(parts)
+
+
+def _parse_var_template(val):
+    # Split val into literals interleaved with the variable names referenced,
+    # returning (literals, names, raw literals).  Literals have backslash escapes
+    # collapsed already; a literal preceding a variable can't end in an
+    # unpaired backslash since var_find matches the escaped form instead, so
+    # collapsing per literal is equivalent to collapsing the expanded string.
+    prev, pos = 0, 0
+    raw, names = [], []
+    while match := var_find.search(val, pos):
+        pos = match.start()
+        if val[pos] == "\\":
+            # it's escaped. either it's \\$ or \\${ , either way,
+            # skipping two ahead handles it.
+            pos += 2
+        else:
+            raw.append(val[prev:pos])
+            names.append(match.group().strip("${}"))
+            prev = pos = match.end()
+    raw.append(val[prev:])
+    literals = tuple(backslash_find.sub(_nuke_backslash, x) for x in raw)
+    return literals, tuple(names), tuple(raw)
+
+
+# Templates repeat across assignments and files, thus are cached; only short
+# values are so that the cache is bounded to roughly
+# maxsize * _VAR_TEMPLATE_CACHE_LEN * 3 characters (the key plus both sets of
+# literals), ~3MiB, rather than pinning arbitrarily large values.
+_VAR_TEMPLATE_CACHE_LEN = 2048
+_compile_var_template = lru_cache(maxsize=512)(_parse_var_template)
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return _st_key(st)
+
+
+def _st_key(st):
+    return [st.st_mtime_ns, st.st_size]
+
+
+class _recording_env(Mapping):
+    """Mapping wrapper recording which keys were consulted"""
+
+    __slots__ = ("_env", "used")
+
+    def __init__(self, env):
+        self._env = env
+        self.used = set()
+
+    def __getitem__(self, key):
+        self.used.add(key)
+        return self._env[key]
+
+    def __contains__(self, key):
+        self.used.add(key)
+        return key in self._env
+
+    def __iter__(self):
+        return iter(self._env)
+
+    def __len__(self):
+        return len(self._env)
+
+
+class BashDictCache:
+    """Memoizing cache for :py:func:`read_bash_dict`.
+
+    Results are keyed by the file's path, ``st_mtime_ns``, and ``st_size``,
+    along with the values of the `vars_dict` keys consulted during the parse;
+    entries thus remain valid across differing envs that only vary in keys the
+    file doesn't reference.  Files pulled in via `sourcing_command` are tracked
+    as dependencies, with any change to them invalidating the entry.  At most
+    :py:attr:`max_variants` entries are kept per path and sourcing command,
+    evicting the least recently used.
+
+    If given a path, entries are loaded from and persisted to it as json,
+    allowing reuse across invocations; persistence happens on :py:meth:`save`
+    or exiting the context manager.
+
+    >>> with BashDictCache("~/.cache/tool/bash.json") as cache: # doctest: +SKIP
+    ...     env = cache.read_bash_dict("/etc/portage/make.conf")
+    """
+
+    __slots__ = ("path", "hits", "misses", "_entries", "_dirty")
+
+    _version = 1
+
+    #: entries kept per path and sourcing command, e.g. for differing envs
+    max_variants = 8
+
+    def __init__(self, path=None):
+        """
+        :param path: optional file to persist entries to
+        """
+        self.path = None if path is None else os.path.expanduser(path)
+        self.hits = self.misses = 0
+        # (path, sourcing command) -> entries of
+        # [stat key, [[dependency, stat key], ...], [[env key, value], ...], result]
+        self._entries = {}
+        self._dirty = False
+        if self.path is not None:
+            self._load()
+
+    def read_bash_dict(self, bash_source, vars_dict=None, sourcing_command=None):
+        """Cached :py:func:`read_bash_dict`.
+
+        Only paths are cached, file objects are passed through as is.  The
+        returned dict may be freely modified.
+        """
+        if not isinstance(bash_source, str):
+            return read_bash_dict(bash_source, vars_dict, sourcing_command)
+        key = (os.path.abspath(bash_source), sourcing_command)
+        # stat prior to parsing so modifications during it aren't missed
+        st_key = _stat_key(bash_source)
+        entries = self._entries.get(key, [])
+        for i, entry in enumerate(entries):
+            if self._valid(entry, st_key, vars_dict):
+                self.hits += 1
+                if i != len(entries) - 1:
+                    # keep entries in least to most recently used order
+                    entries.append(entries.pop(i))
+                    self._dirty = True
+                return dict(entry[3])
+        self.misses += 1
+
+        env = None if vars_dict is None else _recording_env(vars_dict)
+        result, sourced = _read_bash_dict(bash_source, env, sourcing_command)
+        if st_key is not None:
+            deps = [[os.path.abspath(x), _st_key(st)] for x, st in sourced]
+            env_values = []
+            if env is not None:
+                env_values = [[x, vars_dict.get(x)] for x in sorted(env.used)]
+            # drop entries for prior versions of the file
+            entries = [x for x in entries if x[0] == st_key]
+            entries.append([st_key, deps, env_values, dict(result)])
+            self._entries[key] = entries[-self.max_variants :]
+            self._dirty = True
+        return result
+
+    @staticmethod
+    def _valid(entry, st_key, vars_dict):
+        if entry[0] != st_key:
+            return False
+        for path, dep_key in entry[1]:
+            if _stat_key(path) != dep_key:
+                return False
+        if vars_dict is None:
+            return not entry[2]
+        return all(vars_dict.get(k) == v for k, v in entry[2])
+
+    def invalidate(self, path=None):
+        """drop entries for path, or all entries if path is None"""
+        if path is None:
+            self._entries.clear()
+        else:
+            path = os.path.abspath(path)
+            for key in [x for x in self._entries if x[0] == path]:
+                del self._entries[key]
+        self._dirty = True
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data["version"] != self._version:
+                return
+            for path, sourcing_command, entries in data["entries"]:
+                self._entries[(path, sourcing_command)] = entries
+        except (OSError, ValueError, KeyError, TypeError):
+            # missing or corrupt; start afresh
+            self._entries.clear()
+
+    def save(self):
+        """persist entries to the cache path, if one was given"""
+        if self.path is None or not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        data = {
+            "version": self._version,
+            "entries": [[*k, v] for k, v in self._entries.items()],
+        }
+        with AtomicWriteFile(self.path) as f:
+            json.dump(data, f)
+        self._dirty = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.save()
+
+
+BashAssignment = namedtuple("BashAssignment", ("key", "value", "start", "end", "deps"))
+BashAssignment.__doc__ = """assignment parsed by :py:class:`IncrementalBashDict`
+
+:ivar key: variable assigned
+:ivar value: expanded value
+:ivar start: offset of the assignment in the source
+:ivar end: offset of the end of the assignment in the source
+:ivar deps: mapping of the variables the value's expansion referenced to their
+    values at the time, None for those unset
+"""
+
+
+class IncrementalBashDict:
+    """Position aware :py:func:`read_bash_dict` result, supporting cheap reparsing
+
+    Each assignment is recorded with its span in the source and the variables it
+    depends on.  When the source is edited, assignments preceding the edit are
+    kept, and those following it are reevaluated only if a variable they depend
+    on changed.  Thus only the edit, and what depends on it, is reparsed; what
+    remains is cheap bookkeeping linear in the number of assignments.
+
+    Positions are only tracked for the syntax :py:func:`read_bash_dict`'s fast
+    path handles, and for variable names that aren't themselves expanded; other
+    sources are reparsed in full on each update.  Sourcing isn't supported.
+
+    :ivar data: the source text
+    :ivar vars_dict: initial 'env' for the source, see :py:func:`read_bash_dict`
+    :ivar env: dict representing the resultant env, as
+        :py:func:`read_bash_dict` returns
+    """
+
+    __slots__ = ("data", "vars_dict", "env", "_parsed", "_assignments")
+
+    def __init__(self, data, vars_dict=None):
+        self.vars_dict = vars_dict
+        self._parsed = None
+        self.update(data)
+
+    @property
+    def assignments(self):
+        """list of :py:class:`BashAssignment` in source order, or None if
+        positions aren't tracked for the source"""
+        if (parsed := self._parsed) is None:
+            return None
+        if self._assignments is None:
+            self._assignments = list(
+                map(
+                    BashAssignment,
+                    parsed.keys,
+                    parsed.values,
+                    parsed.starts,
+                    parsed.ends,
+                    parsed.deps,
+                )
+            )
+        return self._assignments
+
+    def update(self, data):
+        """Update for a new version of the source
+
+        :raise BashParseError: thrown if invalid syntax is encountered, leaving
+            the instance as it was.
+        :return: list of the assignments reevaluated, or None if positions
+            aren't tracked for the source.
+        """
+        old = self._parsed
+        if old is not None and data == old.data:
+            return []
+        state = _incremental_parse(data, self.vars_dict, old)
+        try:
+            _parse_assignments(state.lexer, state, None)
+        except (_FastPathUnsupported, BashParseError):
+            self.env = _read_bash_dict(StringIO(data), self.vars_dict, None)[0]
+            self.data, self._parsed, self._assignments = data, None, None
+            return None
+        state.finish()
+        self.data, self.env = data, state.written
+        self._parsed, self._assignments = state, None
+        return state.reevaluated
+
+
+class _incremental_parse:
+    """Parsing state for :py:meth:`IncrementalBashDict.update`
+
+    This is passed as the env to :py:func:`_parse_assignments`, recording the
+    assignments parsed and skipping the lexer over old ones that can be reused.
+    Assignments are stored as parallel lists, keeping the shifting of positions
+    beyond the edit cheap.
+    """
+
+    __slots__ = (
+        "data",
+        "env",
+        "written",
+        "lexer",
+        "keys",
+        "values",
+        "starts",
+        "ends",
+        "deps",
+        "scan_ends",
+        "reevaluated",
+        "_old",
+        "_delta",
+        "_synced",
+        "_used",
+        "_region",
+        "_before",
+        "_diff",
+    )
+
+    def __init__(self, data, vars_dict, old):
+        self.data = data
+        self.written = {}
+        if vars_dict is not None:
+            self.env = ChainMap(self.written, vars_dict)
+        else:
+            self.env = self.written
+        self.reevaluated = []
+        self._old = old
+
+        # locate the edited region; beyond it the text is unchanged but shifted
+        old_data = old.data if old is not None else ""
+        prefix, suffix = _common_affixes(old_data, data)
+        self._delta = len(data) - len(old_data)
+        self._synced = len(old_data) - suffix
+
+        # assignments whose tokens were lexed entirely before the edit are kept
+        # (but at least the last is reparsed, since tokens may trail it).
+        i = 0
+        if old is not None and old.keys:
+            i = min(bisect_left(old.scan_ends, prefix), len(old.keys) - 1)
+        for attr in ("keys", "values", "starts", "ends", "deps", "scan_ends"):
+            setattr(self, attr, getattr(old, attr)[:i] if i else [])
+        self.written.update(zip(self.keys, self.values))
+        self._used = _recording_env(self.env)
+        self.lexer = _span_lexer(data, self._used, old.starts[i] if i else 0)
+        # Old assignments from _region on are being replaced by reparsed ones;
+        # _before holds the values of vars prior to being reassigned by those,
+        # and _diff the old values of vars that differed when the region began.
+        self._region = i
+        self._before = {}
+        self._diff = {}
+
+    def __setitem__(self, key, val):
+        lexer, data, env = self.lexer, self.data, self.env
+        read = lexer.read
+        # tokens other than the value may be lexed ahead of the preceding
+        # assignment being applied, thus must not be expanded.
+        for _, start, end in read[:-1] + lexer.lookahead:
+            if data.find("$", start, end) != -1:
+                raise _FastPathUnsupported(start)
+        deps = {k: env.get(k) for k in self._used.used}
+        self._used.used.clear()
+        start, end = read[0][1], read[-1][2]
+        read.clear()
+        if key not in self._before:
+            self._before[key] = env.get(key)
+        env[key] = val
+        self.keys.append(key)
+        self.values.append(val)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.deps.append(deps)
+        self.scan_ends.append(lexer.scan_end)
+        self.reevaluated.append(BashAssignment(key, val, start, end, deps))
+
+        pos = lexer.next_start - self._delta
+        if self._old is not None and pos >= self._synced:
+            j = bisect_left(self._old.starts, pos, lo=self._region)
+            if j < len(self._old.starts) and self._old.starts[j] == pos:
+                self._sync(j)
+
+    def _sync(self, j):
+        """Continue with the old assignments from j on, the lexer being at the
+        start of old assignment j beyond the edit"""
+        old, env = self._old, self.env
+        # Determine which vars differ from the old env at j: those reassigned
+        # by either the old or the reparsed assignments of the region, or that
+        # already differed.
+        region = dict(zip(old.keys[self._region : j], old.values[self._region : j]))
+        diff = {}
+        for key in region.keys() | self._before.keys() | self._diff.keys():
+            if key in region:
+                old_val = region[key]
+            elif key in self._diff:
+                old_val = self._diff[key]
+            else:
+                old_val = self._before[key]
+            if env.get(key) != old_val:
+                diff[key] = old_val
+
+        # old assignments not referencing differing vars evaluate the same
+        start, keys, deps, count = j, old.keys, old.deps, len(old.keys)
+        while diff and j < count:
+            diff_keys = diff.keys()
+            m = next(
+                (x for x in range(j, count) if not diff_keys.isdisjoint(deps[x])),
+                count,
+            )
+            # vars reassigned before that are equal again
+            for key in diff_keys & set(keys[j:m]):
+                del diff[key]
+            j = m
+            if j < count and not diff.keys().isdisjoint(deps[j]):
+                break
+        if not diff:
+            j = count
+
+        if j != start:
+            delta = self._delta
+            self.written.update(zip(keys[start:j], old.values[start:j]))
+            self.keys += keys[start:j]
+            self.values += old.values[start:j]
+            self.deps += deps[start:j]
+            for attr in ("starts", "ends", "scan_ends"):
+                positions = getattr(old, attr)[start:j]
+                if delta:
+                    positions = [x + delta for x in positions]
+                getattr(self, attr).extend(positions)
+            self.lexer.seek(old.starts[j] + delta if j < count else len(self.data))
+        self._region, self._before, self._diff = j, {}, diff
+
+    def finish(self):
+        """drop the state only needed while parsing"""
+        self.env = self.lexer = self._old = self._used = None
+        self._before = self._diff = None
+
+
+def _common_affixes(a, b, chunk=4096):
+    """:return: lengths of the common prefix and, beyond it, the common suffix"""
+    end = min(len(a), len(b))
+    # compare in chunks first to avoid character by character looping
+    prefix = 0
+    while prefix + chunk <= end and (
+        a[prefix : prefix + chunk] == b[prefix : prefix + chunk]
+    ):
+        prefix += chunk
+    while prefix < end and a[prefix] == b[prefix]:
+        prefix += 1
+    limit = end - prefix
+    a_end, b_end = len(a), len(b)
+    suffix = 0
+    while suffix + chunk <= limit and (
+        a[a_end - suffix - chunk : a_end - suffix]
+        == b[b_end - suffix - chunk : b_end - suffix]
+    ):
+        suffix += chunk
+    while suffix < limit and a[a_end - suffix - 1] == b[b_end - suffix - 1]:
+        suffix += 1
+    return prefix, suffix
 
 
 class BashParseError(Exception):
@@ -338,3 +1172,6 @@ class BashParseError(Exception):
                 "error parsing '%s' on or before line %i" % (filename, line)
             )
         self.file, self.line, self.errmsg = filename, line, errmsg
+
+    def __reduce__(self):
+        return (self.__class__, (self.file, self.line, self.errmsg))
@@ -40,15 +40,24 @@ __all__ = (
     "text_data_source",
     "bytes_data_source",
     "invokable_data_source",
+    "cached_invokable_data_source",
+    "prefetch",
 )
 
 import abc
+import codecs
 import errno
 import io
+import os
+import tempfile
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
+from itertools import islice
 
 from . import compression, fileutils, stringio
 from .currying import post_curry
+from .klass import GetAttrProxy
 
 
 def _mk_writable_cls(base, name):
@@ -99,6 +108,95 @@ text_wr_StringIO = _mk_writable_cls(io.StringIO, "text_wr_StringIO")
 bytes_wr_StringIO = _mk_writable_cls(io.BytesIO, "bytes_wr_StringIO")
 
 
+class _spooled_file(tempfile.SpooledTemporaryFile):
+    """SpooledTemporaryFile tracking whether its content was moved to disk"""
+
+    spilled = False
+
+    def rollover(self):
+        super().rollover()
+        self.spilled = True
+
+
+class _wr_spooled:
+    """
+    writable handle that buffers in memory, spilling to an anonymous temporary file
+
+    Unlike :py:class:`text_wr_StringIO` and :py:class:`bytes_wr_StringIO`, the content
+    isn't handed to the callback as a single value; upon close the callback is
+    invoked with a readable handle positioned at the start of the content.  Once
+    the content grows past `max_size` it's moved to disk (via O_TMPFILE where the
+    platform supports it), thus peak memory stays bounded regardless of how much
+    is written.
+    """
+
+    __slots__ = ("_callback", "_file")
+    exceptions = (MemoryError, EnvironmentError)
+    mode = None
+    newline = None
+    max_size = 1024 * 1024
+
+    def __init__(self, callback, data=None, max_size=None):
+        """
+        :param callback: functor invoked when this handle is closed; the functor
+            takes a single value, a readable handle for the full content.  The
+            handle is closed once the callback returns.
+        :param data: initial data for this instance
+        :param max_size: amount of data to hold in memory before spilling to disk
+        """
+        if not callable(callback):
+            raise TypeError("callback must be callable")
+        if max_size is None:
+            max_size = self.max_size
+        self._file = _spooled_file(
+            max_size=max_size, mode=self.mode, newline=self.newline
+        )
+        if data:
+            self._file.write(data)
+            self._file.seek(0)
+        self._callback = callback
+
+    __getattr__ = GetAttrProxy("_file")
+
+    @property
+    def spilled(self):
+        """whether the content has been moved to disk"""
+        return self._file.spilled
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if self._callback is None:
+            return
+        callback, self._callback = self._callback, None
+        try:
+            self._file.flush()
+            self._file.seek(0)
+            callback(self._file)
+        finally:
+            self._file.close()
+
+
+class text_wr_spooled(_wr_spooled):
+    __doc__ = _wr_spooled.__doc__
+    __slots__ = ()
+    mode = "w+"
+    newline = ""
+
+
+class bytes_wr_spooled(_wr_spooled):
+    __doc__ = _wr_spooled.__doc__
+    __slots__ = ()
+    mode = "w+b"
+
+
 class text_ro_StringIO(stringio.text_readonly):
     """
     readonly text mode StringIO usable as a filehandle for a data_source
@@ -143,6 +241,7 @@ class base(abc.ABC):
     __slots__ = ("weakref",)
 
     path = None
+    chunk_size = 32 * 1024
 
     @abc.abstractmethod
     def text_fileobj(self, writable=False):
@@ -162,6 +261,44 @@ class base(abc.ABC):
         :return: file handle like object
         """
 
+    def iter_chunks(self, size=None):
+        """iterate over the bytes content of this data source in chunks
+
+        Implementations avoid copying the data where possible; in memory sources
+        yield memoryview slices, on disk sources yield memoryview slices of an
+        mmap.  Each chunk is only guaranteed to be valid until the iterator is
+        advanced; consumers needing to hold onto the data must copy it via
+        ``bytes(chunk)``.
+
+        :param size: maximum length of each chunk; defaults to :py:attr:`chunk_size`
+        :return: iterable of bytes-like objects
+        """
+        size = self._get_chunk_size(size)
+        f = self.bytes_fileobj()
+        try:
+            while data := f.read(size):
+                yield data
+        finally:
+            f.close()
+
+    def iter_buffers(self):
+        """iterate over the bytes content of this data source in the largest buffers
+        available without copying
+
+        Each buffer is only guaranteed to be valid until the iterator is advanced;
+        consumers needing to hold onto the data must copy it via ``bytes(buf)``.
+
+        :return: iterable of bytes-like objects
+        """
+        return self.iter_chunks()
+
+    def _get_chunk_size(self, size):
+        if size is None:
+            return self.chunk_size
+        if size <= 0:
+            raise ValueError(f"chunk size must be positive: {size!r}")
+        return size
+
     def transfer_to_path(self, path):
         return self.transfer_to_data_source(
             local_source(path, mutable=True, encoding=None)
@@ -242,6 +379,34 @@ class local_source(base):
                 raise
             return open_file(self.path, "wb+", self.buffering_window)
 
+    def iter_chunks(self, size=None):
+        size = self._get_chunk_size(size)
+        m, f = fileutils.mmap_or_open_for_read(self.path)
+        if m is None:
+            # files stat'ing as empty can't be mmap'd, yet pseudo filesystems
+            # (/proc for example) report a zero size for files with content.
+            f.close()
+            yield from base.iter_chunks(self, size)
+            return
+        view = memoryview(m)
+        try:
+            for offset in range(0, len(view), size):
+                # release each chunk so the mmap can be closed afterwards
+                with view[offset : offset + size] as chunk:
+                    yield chunk
+        finally:
+            view.release()
+            m.close()
+
+    def iter_buffers(self):
+        m, f = fileutils.mmap_or_open_for_read(self.path)
+        if m is None:
+            f.close()
+            yield from base.iter_chunks(self)
+            return
+        with m:
+            yield m
+
 
 class bz2_source(base):
     """
@@ -262,28 +427,51 @@ class bz2_source(base):
         self.mutable = mutable
 
     def text_fileobj(self, writable=False):
-        data = compression.decompress_data(
-            "bzip2", fileutils.readfile_bytes(self.path)
-        ).decode()
         if writable:
             if not self.mutable:
                 raise TypeError(f"data source {self} is not mutable")
-            return text_wr_StringIO(self._set_data, data)
+            handle = text_wr_spooled(self._set_data)
+            decoder = codecs.getincrementaldecoder("utf8")()
+            for chunk in self.iter_chunks():
+                handle.write(decoder.decode(chunk))
+            handle.write(decoder.decode(b"", final=True))
+            handle.seek(0)
+            return handle
+        data = compression.decompress_data(
+            "bzip2", fileutils.readfile_bytes(self.path)
+        ).decode()
         return text_ro_StringIO(data)
 
     def bytes_fileobj(self, writable=False):
-        data = compression.decompress_data("bzip2", fileutils.readfile_bytes(self.path))
         if writable:
             if not self.mutable:
                 raise TypeError(f"data source {self} is not mutable")
-            return bytes_wr_StringIO(self._set_data, data)
+            handle = bytes_wr_spooled(self._set_data)
+            for chunk in self.iter_chunks():
+                handle.write(chunk)
+            handle.seek(0)
+            return handle
+        data = compression.decompress_data("bzip2", fileutils.readfile_bytes(self.path))
         return bytes_ro_StringIO(data)
 
-    def _set_data(self, data):
-        if isinstance(data, str):
-            data = data.encode()
-        with open(self.path, "wb") as f:
-            f.write(compression.compress_data("bzip2", data))
+    def iter_chunks(self, size=None):
+        size = self._get_chunk_size(size)
+        f = compression.decompress_handle("bzip2", os.fspath(self.path))
+        try:
+            while data := f.read(size):
+                yield data
+        finally:
+            f.close()
+
+    def _set_data(self, handle):
+        f = compression.compress_handle("bzip2", os.fspath(self.path))
+        try:
+            while data := handle.read(self.chunk_size):
+                if isinstance(data, str):
+                    data = data.encode()
+                f.write(data)
+        finally:
+            f.close()
 
 
 class data_source(base):
@@ -342,6 +530,16 @@ class data_source(base):
             return bytes_wr_StringIO(self._reset_data, self._convert_data("bytes"))
         return bytes_ro_StringIO(self._convert_data("bytes"))
 
+    def iter_chunks(self, size=None):
+        size = self._get_chunk_size(size)
+        view = memoryview(self._convert_data("bytes"))
+        for offset in range(0, len(view), size):
+            yield view[offset : offset + size]
+
+    def iter_buffers(self):
+        if data := self._convert_data("bytes"):
+            yield memoryview(data)
+
 
 class text_data_source(data_source):
     """Text data source.
@@ -400,6 +598,10 @@ class invokable_data_source(data_source):
         """
         data_source.__init__(self, data, mutable=False)
 
+    # the data is generated on request; fall back to reading the handle.
+    iter_chunks = base.iter_chunks
+    iter_buffers = base.iter_buffers
+
     def text_fileobj(self, writable=False):
         if writable:
             raise TypeError(f"data source {self} data is immutable")
@@ -412,7 +614,12 @@ class invokable_data_source(data_source):
 
     @classmethod
     def wrap_function(
-        cls, invokable, returns_text=True, returns_handle=False, encoding_hint=None
+        cls,
+        invokable,
+        returns_text=True,
+        returns_handle=False,
+        encoding_hint=None,
+        **kwds,
     ):
         """
         Helper function to automatically convert a function that returns text or bytes into appropriate
@@ -424,6 +631,7 @@ class invokable_data_source(data_source):
             still has meaning here- returns_text indicates what sort of data the handle returns from read
             invocations.
         :param encoding_hint: the preferred encoding to use for encoding
+        :param kwds: any further keyword arguments are passed to the class constructor
         :return: invokable_data_source instance
         """
         return cls(
@@ -433,7 +641,8 @@ class invokable_data_source(data_source):
                 encoding_hint,
                 returns_text,
                 returns_handle,
-            )
+            ),
+            **kwds,
         )
 
     @staticmethod
@@ -466,6 +675,180 @@ class invokable_data_source(data_source):
         return bytes_ro_StringIO(data)
 
 
+CacheInfo = namedtuple("CacheInfo", ("hits", "misses", "invalidations"))
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+class cached_invokable_data_source(invokable_data_source):
+    """
+    invokable_data_source that memoizes the generated content
+
+    The callable is invoked for bytes once; that result is cached and text
+    is decoded from it on first request.  Repeated requests for either form
+    don't reinvoke the callable until the cache is invalidated, either
+    explicitly via :py:meth:`invalidate` or due to the validity key changing.
+    """
+
+    __slots__ = (
+        "encoding",
+        "key_func",
+        "_key",
+        "_bytes",
+        "_text",
+        "_hits",
+        "_misses",
+        "_invalidations",
+    )
+
+    def __init__(self, data, key_func=None, stat_path=None, encoding="utf8"):
+        """
+        :param data: callable that accepts one argument- True if a text
+          file obj was requested, False if a bytes file obj is requested.
+        :param key_func: optional callable returning a validity key; if the key
+          differs from the one the cache was filled under, the cache is dropped.
+        :param stat_path: if given, a file whose (mtime, size, inode) is used as
+          the validity key.  Mutually exclusive with `key_func`.
+        :param encoding: encoding used to derive text from the cached bytes
+        """
+        if stat_path is not None:
+            if key_func is not None:
+                raise TypeError("key_func and stat_path are mutually exclusive")
+            key_func = partial(_stat_key, stat_path)
+        invokable_data_source.__init__(self, data)
+        self.encoding = encoding
+        self.key_func = key_func
+        self._key = None
+        self._bytes = self._text = None
+        self._hits = self._misses = self._invalidations = 0
+
+    iter_chunks = data_source.iter_chunks
+    iter_buffers = data_source.iter_buffers
+
+    @classmethod
+    def wrap_function(
+        cls,
+        invokable,
+        returns_text=True,
+        returns_handle=False,
+        encoding_hint=None,
+        **kwds,
+    ):
+        """
+        See :py:meth:`invokable_data_source.wrap_function`; the `encoding` used to
+        derive text from the cached bytes defaults to `encoding_hint`.
+        """
+        if encoding_hint is not None:
+            kwds.setdefault("encoding", encoding_hint)
+        return super().wrap_function(
+            invokable, returns_text, returns_handle, encoding_hint, **kwds
+        )
+
+    def text_fileobj(self, writable=False):
+        if writable:
+            raise TypeError(f"data source {self} data is immutable")
+        return text_ro_StringIO(self._convert_data("text"))
+
+    def bytes_fileobj(self, writable=False):
+        if writable:
+            raise TypeError(f"data source {self} data is immutable")
+        return bytes_ro_StringIO(self._convert_data("bytes"))
+
+    def _convert_data(self, mode):
+        if self.key_func is not None:
+            key = self.key_func()
+            if key != self._key:
+                self.invalidate()
+                self._key = key
+        if self._bytes is None:
+            self._misses += 1
+            handle = self.data(False)
+            try:
+                self._bytes = handle.read()
+            finally:
+                handle.close()
+        else:
+            self._hits += 1
+        if mode == "bytes":
+            return self._bytes
+        if self._text is None:
+            self._text = self._bytes.decode(self.encoding)
+        return self._text
+
+    def invalidate(self):
+        """drop the cached content; the next request reinvokes the callable"""
+        if self._bytes is not None:
+            self._invalidations += 1
+        self._bytes = self._text = None
+
+    def cache_info(self):
+        """return a :py:class:`CacheInfo` of the hits, misses, and invalidations"""
+        return CacheInfo(self._hits, self._misses, self._invalidations)
+
+
 def transfer_between_files(read_file, write_file, bufsize=(32 * 1024)):
     while data := read_file.read(bufsize):
         write_file.write(data)
+
+
+def _prefetch_path(path, readahead=False, bufsize=(1024 * 1024)):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except EnvironmentError:
+        # leave it to the consumer to hit the error
+        return
+    try:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        if readahead:
+            while os.read(fd, bufsize):
+                pass
+    except EnvironmentError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def prefetch(sources, window=32, workers=4, readahead=False):
+    """iterate over data sources, hinting the kernel to pull in the upcoming ones
+
+    While the caller consumes a source, the next `window` sources that have an on
+    disk path have ``posix_fadvise(POSIX_FADV_WILLNEED)`` issued from a small
+    thread pool; this overlaps the I/O latency with whatever work the caller does.
+    Sources without a path are passed through untouched.
+
+    :param sources: iterable of data sources
+    :param window: how many sources ahead of the current one to prefetch
+    :param workers: number of threads issuing the hints
+    :param readahead: if True, the worker threads additionally read the files
+        in full, forcing them into the page cache for filesystems that ignore
+        the advice
+    :return: iterator yielding the sources in their original order
+    """
+    if window <= 0:
+        raise ValueError(f"window must be positive: {window!r}")
+    sources = iter(sources)
+    pending = deque()
+    pool = ThreadPoolExecutor(max_workers=workers)
+
+    def queue(source):
+        pending.append(source)
+        if source.path is not None:
+            pool.submit(_prefetch_path, source.path, readahead)
+
+    try:
+        for source in islice(sources, window):
+            queue(source)
+        while pending:
+            source = pending.popleft()
+            if (upcoming := next(sources, None)) is not None:
+                queue(upcoming)
+            yield source
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -3,9 +3,14 @@ file related operations, mainly reading
 """
 
 import abc
+import errno
 import mmap
 import os
-from functools import partial
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial, partialmethod
+from itertools import islice
 
 from . import _fileutils, data_source
 from .compatibility import IGNORED_EXCEPTIONS
@@ -52,6 +57,14 @@ def mmap_or_open_for_read(path: str):
         raise
 
 
+def _fsync_dir(path: str):
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
 class AtomicWriteFile_mixin(abc.ABC):
     """File class that stores the changes in a tempfile.
 
@@ -67,9 +80,22 @@ class AtomicWriteFile_mixin(abc.ABC):
 
     If this object falls out of memory without ever being discarded nor
     closed, the contents are discarded and a warning is issued.
+
+    If durable, the data is flushed to disk before the target is replaced and the
+    parent directory is synced afterwards, thus the update survives a crash.  Where
+    the platform supports it, an anonymous O_TMPFILE is written and linked into
+    place, thus no temporary path is visible while writing.
     """
 
-    __slots__ = ("_is_finalized", "_computed_mode", "_original_fp", "_temp_fp")
+    __slots__ = (
+        "_is_finalized",
+        "_computed_mode",
+        "_original_fp",
+        "_temp_fp",
+        "_durable",
+        "_anonymous",
+        "_transaction",
+    )
 
     @abc.abstractmethod
     def _actual_init(self) -> None: ...
@@ -77,13 +103,25 @@ class AtomicWriteFile_mixin(abc.ABC):
     @abc.abstractmethod
     def _real_close(self) -> None: ...
 
-    def __init__(self, fp, binary=False, perms=None, uid=-1, gid=-1):
+    def __init__(
+        self,
+        fp,
+        binary=False,
+        perms=None,
+        uid=-1,
+        gid=-1,
+        durable=False,
+        transaction=None,
+    ):
         """
         :param fp: filepath to write to upon close
         :param binary: should we open the file in binary mode?
         :param perms: if specified, permissions we should force for the file.
         :param uid: if specified, the uid to force for the file.
         :param gid: if specified, the uid to force for the file.
+        :param durable: if True, sync the data and directory entry to disk on close.
+        :param transaction: if specified, the :py:class:`AtomicWriteTransaction`
+            that replaces the target upon its commit rather than on close.
         """
         self._is_finalized = True
         if binary:
@@ -96,6 +134,9 @@ class AtomicWriteFile_mixin(abc.ABC):
         self._temp_fp = os.path.join(
             os.path.dirname(fp), ".update." + os.path.basename(fp)
         )
+        self._durable = durable
+        self._anonymous = False
+        self._transaction = transaction
         old_umask = None
         if perms:
             # give it just write perms
@@ -106,17 +147,62 @@ class AtomicWriteFile_mixin(abc.ABC):
             if old_umask is not None:
                 os.umask(old_umask)
         self._is_finalized = False
+        target = self.fileno() if self._anonymous else self._temp_fp
         if perms:
-            os.chmod(self._temp_fp, perms)
+            os.chmod(target, perms)
         if (gid, uid) != (-1, -1):
-            os.chown(self._temp_fp, uid, gid)
+            os.chown(target, uid, gid)
+        if transaction is not None:
+            transaction._files.append(self)
+
+    def _open_anonymous(self, flags: int):
+        """open an unnamed file in the target directory, returning None if unsupported"""
+        if (
+            not self._durable
+            or self._transaction is not None
+            or not hasattr(os, "O_TMPFILE")
+            or not os.path.isdir("/proc/self/fd")
+        ):
+            return None
+        try:
+            fd = os.open(
+                os.path.dirname(self._original_fp), flags | os.O_TMPFILE, 0o666
+            )
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.EISDIR, errno.EINVAL):
+                raise
+            return None
+        self._anonymous = True
+        return fd
+
+    def _link_anonymous(self):
+        # linkat(AT_SYMLINK_FOLLOW) of the proc magic link; a dir fd is required
+        # otherwise python falls back to link(2) which won't follow it.
+        proc_fd = os.open("/proc/self/fd", os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            link = partial(os.link, str(self.fileno()), src_dir_fd=proc_fd)
+            try:
+                link(self._original_fp)
+                return
+            except FileExistsError:
+                pass
+            # links can't replace an existing file; link to the tempname and rename over.
+            try:
+                os.unlink(self._temp_fp)
+            except FileNotFoundError:
+                pass
+            link(self._temp_fp)
+        finally:
+            os.close(proc_fd)
+        os.rename(self._temp_fp, self._original_fp)
 
     def discard(self):
         """If we've not already flushed our changes to the target, discard them
         and close this file handle."""
         if not self._is_finalized:
             self._real_close()
-            os.unlink(self._temp_fp)
+            if not self._anonymous:
+                os.unlink(self._temp_fp)
             self._is_finalized = True
 
     def __enter__(self):
@@ -131,12 +217,26 @@ class AtomicWriteFile_mixin(abc.ABC):
     def close(self):
         """Close this file handle, atomically updating the target in the process.
 
-        Note that if we're already closed, this method does nothing
+        Note that if we're already closed, this method does nothing.  If this file
+        is part of a transaction, the target is updated when that is committed.
         """
-        if not self._is_finalized:
+        if self._is_finalized:
+            return
+        if self._transaction is not None:
+            self._real_close()
+            return
+        if self._durable:
+            self.flush()
+            os.fdatasync(self.fileno())
+        if self._anonymous:
+            self._link_anonymous()
+            self._real_close()
+        else:
             self._real_close()
             os.rename(self._temp_fp, self._original_fp)
-            self._is_finalized = True
+        self._is_finalized = True
+        if self._durable:
+            _fsync_dir(os.path.dirname(self._original_fp))
 
     def __del__(self):
         self.discard()
@@ -147,7 +247,10 @@ class AtomicWriteFile(AtomicWriteFile_mixin):
     __slots__ = ("raw",)
 
     def _actual_init(self):
-        self.raw = open(self._temp_fp, mode=self._computed_mode)
+        if (fd := self._open_anonymous(os.O_WRONLY)) is not None:
+            self.raw = open(fd, mode=self._computed_mode)
+        else:
+            self.raw = open(self._temp_fp, mode=self._computed_mode)
 
     def _real_close(self):
         if hasattr(self, "raw"):
@@ -157,6 +260,72 @@ class AtomicWriteFile(AtomicWriteFile_mixin):
     __getattr__ = GetAttrProxy("raw")
 
 
+class AtomicWriteTransaction:
+    """Commit many atomic file writes together.
+
+    Files opened via :py:meth:`open` update their targets only once the
+    transaction is committed.  For a durable transaction, the data of all files
+    is flushed to disk, then all targets are replaced, then each parent directory
+    is synced once; this avoids the sync per file (and per directory) that
+    committing each :py:class:`AtomicWriteFile` durably would cost.
+
+    Used as a context manager, the transaction is committed on exit or discarded
+    if an exception was raised.
+    """
+
+    __slots__ = ("durable", "_files")
+
+    def __init__(self, durable=True):
+        """
+        :param durable: if True, sync the data and directory entries to disk on commit.
+        """
+        self.durable = durable
+        self._files = []
+
+    def open(self, fp, binary=False, **kwargs) -> AtomicWriteFile:
+        """open an :py:class:`AtomicWriteFile` for `fp` as part of this transaction
+
+        See :py:class:`AtomicWriteFile` for the supported arguments.
+        """
+        return AtomicWriteFile(fp, binary=binary, transaction=self, **kwargs)
+
+    def commit(self):
+        """update the targets of all files opened in this transaction"""
+        files = [x for x in self._files if not x._is_finalized]
+        self._files = []
+        for f in files:
+            f._real_close()
+        if self.durable:
+            for f in files:
+                # fsync on linux flushes the inode's data regardless of the fd used.
+                fd = os.open(f._temp_fp, os.O_RDONLY)
+                try:
+                    os.fdatasync(fd)
+                finally:
+                    os.close(fd)
+        for f in files:
+            os.rename(f._temp_fp, f._original_fp)
+            f._is_finalized = True
+        if self.durable:
+            for path in sorted({os.path.dirname(x._original_fp) for x in files}):
+                _fsync_dir(path)
+
+    def discard(self):
+        """discard the changes of all files opened in this transaction"""
+        files, self._files = self._files, []
+        for f in files:
+            f.discard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.discard()
+        else:
+            self.commit()
+
+
 def _mk_pretty_derived_func(func, name_base: str, name: str, *args, **kwds):
     if name:
         name = "_" + name
@@ -171,6 +340,63 @@ readfile_utf8 = _mk_readfile("utf8", "r", encoding="utf8")
 readfile = readfile_utf8
 
 
+def readfiles(
+    paths,
+    mode: str = "r",
+    workers: int | None = None,
+    none_on_missing: bool = False,
+    encoding: str | None = None,
+    ordered: bool = True,
+):
+    """Read many files concurrently, yielding (path, contents) tuples.
+
+    Files are read from a thread pool; this keeps the disk queue busy which
+    on NVMe and network filesystems is far faster than reading them serially.
+
+    :param paths: iterable of fs paths to read
+    :param mode: mode to open the files in
+    :param workers: number of reader threads; defaults to cpu count + 4, max 32
+    :param none_on_missing: whether to yield None as the contents for missing
+        files, else the exception is raised
+    :param encoding: encoding for text modes; defaults to utf8
+    :param ordered: if True, results are yielded in the order of `paths`, else
+        in the order the reads finish
+    """
+    if encoding is None and "b" not in mode:
+        encoding = "utf8"
+    if workers is None:
+        workers = min(32, (os.cpu_count() or 1) + 4)
+    read = partial(
+        _fileutils.native_readfile,
+        mode,
+        none_on_missing=none_on_missing,
+        encoding=encoding,
+    )
+    paths = iter(paths)
+    pool = ThreadPoolExecutor(max_workers=workers)
+    # bound the reads in flight, thus the memory held if the consumer is slow.
+    window = workers * 2
+    try:
+        if ordered:
+            pending = deque((x, pool.submit(read, x)) for x in islice(paths, window))
+            while pending:
+                path, future = pending.popleft()
+                data = future.result()
+                for x in islice(paths, 1):
+                    pending.append((x, pool.submit(read, x)))
+                yield path, data
+        else:
+            pending = {pool.submit(read, x): x for x in islice(paths, window)}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for x in islice(paths, len(done)):
+                    pending[pool.submit(read, x)] = x
+                for future in done:
+                    yield pending.pop(future), future.result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
 _mk_readlines = partial(
     _mk_pretty_derived_func, _fileutils.native_readlines, "readlines"
 )
@@ -178,3 +404,205 @@ _mk_readlines = partial(
 readlines_ascii = _mk_readlines("ascii", "r", encoding="ascii")
 readlines_utf8 = _mk_readlines("utf8", "r", encoding="utf8")
 readlines = readlines_utf8
+
+
+class FileCache:
+    """Memoizing cache for reading files.
+
+    Content is cached keyed by path and the read arguments, and validated on each
+    access against the file's ``(st_mtime_ns, st_size, st_ino)``; if the file
+    changed, it's read again.  Total cached content is bounded by `max_bytes` with
+    the least recently used entries evicted first.
+
+    The readfile and readlines methods mirror the module level functions of the
+    same names, thus an instance is usable as a drop in for them:
+
+    >>> cache = FileCache()
+    >>> data = cache.readfile_utf8("/etc/hostname") # doctest: +SKIP
+    >>> lines = cache.readlines_utf8("/etc/hosts") # doctest: +SKIP
+
+    Note that the readlines results are suitable for feeding into
+    :py:func:`snakeoil.bash.read_bash` and friends.
+
+    If given a :py:class:`snakeoil.osutils.watch.Watcher`, entries are instead
+    invalidated by change notifications, thus cache hits cost no syscalls.  Their
+    stamps are released as entries are evicted or invalidated.
+    """
+
+    __slots__ = ("max_bytes", "trust_ms", "watcher", "_entries", "_by_path", "_size")
+
+    def __init__(
+        self, max_bytes: int = 32 * 1024 * 1024, trust_ms: int = 0, watcher=None
+    ):
+        """
+        :param max_bytes: maximum amount of file content to hold; measured in
+            on disk bytes.
+        :param trust_ms: if nonzero, an entry validated within that many
+            milliseconds is returned without stat'ing the file again.
+        :param watcher: optional :py:class:`snakeoil.osutils.watch.Watcher` used
+            to validate entries rather than stat.
+        """
+        self.max_bytes = max_bytes
+        self.trust_ms = trust_ms
+        self.watcher = watcher
+        # key -> [stat key, validation time, st_mtime, value, watcher stamp]
+        self._entries = OrderedDict()
+        self._by_path = {}
+        self._size = 0
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if (stamp := entry[4]) is not None:
+            if not stamp.valid:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+        if self.trust_ms:
+            now = time.monotonic()
+            if (now - entry[1]) * 1000 < self.trust_ms:
+                self._entries.move_to_end(key)
+                return entry
+        else:
+            now = None
+        try:
+            st = os.stat(key[0])
+        except FileNotFoundError:
+            self.invalidate(key[0])
+            return None
+        if entry[0] != (st.st_mtime_ns, st.st_size, st.st_ino):
+            self._remove(key)
+            return None
+        entry[1] = time.monotonic() if now is None else now
+        self._entries.move_to_end(key)
+        return entry
+
+    def _stamp(self, path):
+        if self.watcher is None:
+            return None
+        try:
+            return self.watcher.stamp(path)
+        except OSError:
+            return None
+
+    def _release(self, stamp):
+        if stamp is not None:
+            self.watcher.release(stamp)
+
+    def _store(self, key, st, value, stamp):
+        size = st.st_size
+        # pseudo filesystems (/proc for example) report a zero size and aren't
+        # reliably validated by stat; empty files aren't worth caching anyway.
+        if not size or size > self.max_bytes:
+            self._release(stamp)
+            return
+        self._remove(key)
+        while self._size + size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+        self._entries[key] = [
+            (st.st_mtime_ns, st.st_size, st.st_ino),
+            time.monotonic(),
+            st.st_mtime,
+            value,
+            stamp,
+        ]
+        self._by_path.setdefault(key[0], set()).add(key)
+        self._size += size
+
+    def _remove(self, key):
+        if (entry := self._entries.pop(key, None)) is None:
+            return
+        self._size -= entry[0][1]
+        self._release(entry[4])
+        keys = self._by_path[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._by_path[key[0]]
+
+    def invalidate(self, path):
+        """drop any cached content for the given path"""
+        for key in self._by_path.pop(os.fspath(path), ()):
+            entry = self._entries.pop(key)
+            self._size -= entry[0][1]
+            self._release(entry[4])
+
+    def clear(self):
+        """drop all cached content"""
+        for entry in self._entries.values():
+            self._release(entry[4])
+        self._entries.clear()
+        self._by_path.clear()
+        self._size = 0
+
+    def _readfile(self, mode, mypath, none_on_missing=False, encoding=None):
+        key = (os.fspath(mypath), "readfile", mode, encoding)
+        if (entry := self._lookup(key)) is not None:
+            return entry[3]
+        stamp = self._stamp(key[0])
+        try:
+            with open(key[0], mode, encoding=encoding) as f:
+                st = os.fstat(f.fileno())
+                data = f.read()
+        except BaseException as e:
+            self._release(stamp)
+            if (
+                none_on_missing
+                and isinstance(e, IOError)
+                and e.errno in (errno.ENOENT, errno.ENOTDIR)
+            ):
+                return None
+            raise
+        self._store(key, st, data, stamp)
+        return data
+
+    def _readlines(
+        self,
+        mode,
+        mypath,
+        strip_whitespace=True,
+        swallow_missing=False,
+        none_on_missing=False,
+        encoding=None,
+        batched=False,
+    ):
+        key = (os.fspath(mypath), "readlines", mode, encoding, strip_whitespace)
+        if (entry := self._lookup(key)) is not None:
+            return self._lines_iter(entry[3], entry[2], batched)
+        stamp = self._stamp(key[0])
+        try:
+            with open(key[0], mode, encoding=encoding) as f:
+                st = os.fstat(f.fileno())
+                if strip_whitespace:
+                    lines = tuple(line.strip() for line in f)
+                else:
+                    lines = tuple(f)
+        except BaseException as e:
+            self._release(stamp)
+            if (
+                not swallow_missing
+                or not isinstance(e, IOError)
+                or e.errno not in (errno.ENOTDIR, errno.ENOENT)
+            ):
+                raise
+            if none_on_missing:
+                return None
+            return _fileutils.readlines_iter(iter([]), None, close=False)
+        self._store(key, st, lines, stamp)
+        return self._lines_iter(lines, st.st_mtime, batched)
+
+    @staticmethod
+    def _lines_iter(lines, mtime, batched):
+        if batched:
+            lines = (list(lines),) if lines else ()
+        return _fileutils.readlines_iter(iter(lines), mtime, close=False)
+
+    readfile_ascii = partialmethod(_readfile, "rt")
+    readfile_bytes = partialmethod(_readfile, "rb")
+    readfile_utf8 = partialmethod(_readfile, "r", encoding="utf8")
+    readfile = readfile_utf8
+
+    readlines_ascii = partialmethod(_readlines, "r", encoding="ascii")
+    readlines_utf8 = partialmethod(_readlines, "r", encoding="utf8")
+    readlines = readlines_utf8
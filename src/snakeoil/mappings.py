@@ -4,6 +4,7 @@ Miscellaneous mapping related classes and functionality
 
 __all__ = (
     "AttrAccessible",
+    "CachedStackedDict",
     "DictMixin",
     "ImmutableDict",
     "IndeterminantDict",
@@ -19,8 +20,8 @@ __all__ = (
 import operator
 from collections import defaultdict
 from collections.abc import Mapping, MutableSet, Set
-from functools import partial, wraps
-from itertools import chain, filterfalse, islice
+from functools import lru_cache, partial, wraps
+from itertools import chain, count, filterfalse
 from typing import Any
 
 from .klass import contains, copy_docs, get, get_attrs_of, sentinel
@@ -292,13 +293,51 @@ class ProtectedDict(DictMixin):
         return key in self.new or (key not in self.blacklist and key in self.orig)
 
 
+@lru_cache(maxsize=1024)
+def _shared_key_table(keys):
+    table = {k: i for i, k in enumerate(keys)}
+    if len(table) != len(keys):
+        raise ValueError(f"duplicate keys: {keys!r}")
+    return table
+
+
+class _SharedKeysDict(Mapping):
+    """Read-only mapping storing its values against a shared key table."""
+
+    __slots__ = ("_keys", "_values")
+
+    def __init__(self, keys, values):
+        self._keys = keys
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._keys[key]]
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __reversed__(self):
+        return reversed(self._keys)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return repr(dict(zip(self._keys, self._values)))
+
+
 class ImmutableDict(Mapping):
     """Immutable dict, unchangeable after instantiating.
 
-    Because this is immutable, it's hashable.
+    Because this is immutable, it's hashable.  The hash is computed on first
+    use and cached; it doesn't depend on item order, so keys needn't be
+    orderable.
     """
 
-    __slots__ = ("__weakref__", "_dict")
+    __slots__ = ("__weakref__", "_dict", "_hash")
 
     def __init__(self, data=None):
         if isinstance(data, ImmutableDict):
@@ -315,6 +354,26 @@ class ImmutableDict(Mapping):
             except TypeError as exc:
                 raise TypeError(f"unsupported data format: {exc}")
         object.__setattr__(self, "_dict", mapping)
+        object.__setattr__(self, "_hash", None)
+
+    @classmethod
+    def from_shared_keys(cls, keys, values):
+        """Create an instance sharing its key table with others using the same keys.
+
+        Storing many mappings with identical key sets (e.g. parsed records)
+        this way costs a tuple of values per instance rather than a full dict.
+        Key tables are cached per keys tuple, iteration follows its order.
+
+        :param keys: tuple of keys
+        :param values: iterable of values, one per key
+        """
+        keys = tuple(keys)
+        values = tuple(values)
+        if len(keys) != len(values):
+            raise ValueError(
+                f"{len(values)} values given for {len(keys)} keys: {keys!r}"
+            )
+        return cls(_SharedKeysDict(_shared_key_table(keys), values))
 
     def __getitem__(self, key):
         # hack to avoid recursion exceptions for subclasses that use
@@ -323,6 +382,9 @@ class ImmutableDict(Mapping):
             return object.__getattribute__(self, "_dict")
         return self._dict[key]
 
+    def __contains__(self, key):
+        return key in self._dict
+
     def __iter__(self):
         return iter(self._dict)
 
@@ -339,19 +401,39 @@ class ImmutableDict(Mapping):
         return str(self._dict)
 
     def __hash__(self):
-        return hash(tuple(sorted(self._dict.items(), key=operator.itemgetter(0))))
+        if (h := self._hash) is None:
+            h = hash(frozenset(self._dict.items()))
+            object.__setattr__(self, "_hash", h)
+        return h
+
+    def __reduce__(self):
+        # the cached hash is only valid for the current process
+        return self.__class__, (self._dict,)
 
 
 class OrderedFrozenSet(Set):
-    """Ordered, immutable set using guaranteed insertion order dicts in py3.6 onwards."""
+    """Ordered, immutable set using guaranteed insertion order dicts in py3.6 onwards.
+
+    On first positional access the elements are copied into an array, with the
+    dict mapping them to their positions, making indexing and :py:meth:`index`
+    O(1) from then on.  Like sequences, negative indexes count from the end.
+    """
 
-    __slots__ = ("_dict",)
+    __slots__ = ("_dict", "_items")
 
     def __init__(self, iterable=()):
         try:
-            self._dict = ImmutableDict({x: None for x in iterable})
+            self._dict = dict.fromkeys(iterable)
         except TypeError as exc:
             raise TypeError("not iterable") from exc
+        self._items = None
+
+    def _indexed(self):
+        if (items := self._items) is None:
+            # the dict retains insertion order, so (re)build the array from it
+            self._items = items = list(self._dict)
+            self._dict.update(zip(items, count()))
+        return items
 
     def __contains__(self, key):
         return key in self._dict
@@ -362,12 +444,23 @@ class OrderedFrozenSet(Set):
     def __getitem__(self, key):
         if isinstance(key, int):
             try:
-                return next(islice(self._dict, key, None))
-            except StopIteration:
+                return self._indexed()[key]
+            except IndexError:
                 raise IndexError("index out of range")
 
         # handle keys using slice notation
-        return self.__class__(list(self._dict)[key])
+        return self.__class__(self._indexed()[key])
+
+    def index(self, value):
+        """Return the position of a given element.
+
+        :raises ValueError: if the element isn't in the set
+        """
+        self._indexed()
+        try:
+            return self._dict[value]
+        except KeyError:
+            raise ValueError(f"{value!r} is not in set") from None
 
     def __reversed__(self):
         return reversed(self._dict)
@@ -386,7 +479,11 @@ class OrderedFrozenSet(Set):
         return self.__str__()
 
     def __hash__(self):
-        return hash(self._dict)
+        return hash(frozenset(self._dict))
+
+    def __reduce__(self):
+        # the positional array is rebuilt on demand rather than serialized
+        return (self.__class__, (list(self._dict),))
 
     def intersection(self, other):
         return self.__class__(self._dict.keys() & other)
@@ -402,33 +499,148 @@ class OrderedFrozenSet(Set):
 
 
 class OrderedSet(OrderedFrozenSet, MutableSet):
-    """Ordered, mutable set using guaranteed insertion order dicts in py3.6 onwards."""
+    """Ordered, mutable set using guaranteed insertion order dicts in py3.6 onwards.
+
+    Once built, the array of elements used for positional access is kept up to
+    date by additions and removals.  Removed elements leave a tombstone behind
+    that's compacted away once tombstones outnumber the elements, thus removal
+    is amortized O(1).  While tombstones exist, positions are translated via a
+    Fenwick tree counting the elements, making indexing and :py:meth:`index`
+    O(log n).
+    """
 
-    __slots__ = ()
+    __slots__ = ("_tree",)
 
     def __init__(self, iterable=()):
-        try:
-            self._dict = {x: None for x in iterable}
-        except TypeError as exc:
-            raise TypeError("not iterable") from exc
+        super().__init__(iterable)
+        # built on demand once the array holds tombstones
+        self._tree = None
+
+    def __getitem__(self, key):
+        items = self._indexed()
+        if len(items) != len(self._dict):
+            if not isinstance(key, int):
+                # slicing is O(n) regardless
+                self._compact()
+            else:
+                if key < 0:
+                    key += len(self._dict)
+                if not 0 <= key < len(self._dict):
+                    raise IndexError("index out of range")
+                return items[self._physical(key)]
+        return super().__getitem__(key)
+
+    def index(self, value):
+        i = super().index(value)
+        if len(self._items) != len(self._dict):
+            return self._rank(i)
+        return i
+
+    def _fenwick(self):
+        if (tree := self._tree) is None:
+            # 1-based, tree[i] counts the elements within slots
+            # (i - (i & -i), i] of the array.
+            tree = [0]
+            tree.extend(int(x is not sentinel) for x in self._items)
+            n = len(tree)
+            for i in range(1, n):
+                if (j := i + (i & -i)) < n:
+                    tree[j] += tree[i]
+            self._tree = tree
+        return tree
+
+    def _physical(self, i):
+        # slot of the i'th element; descend the tree for the longest prefix of
+        # slots holding at most i elements, the element being the next slot.
+        tree = self._fenwick()
+        pos, remaining = 0, i + 1
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            if (j := pos + step) < len(tree) and tree[j] < remaining:
+                pos = j
+                remaining -= tree[j]
+            step >>= 1
+        return pos
+
+    def _rank(self, pos):
+        # number of elements preceding the given slot
+        tree = self._fenwick()
+        rank = 0
+        while pos:
+            rank += tree[pos]
+            pos &= pos - 1
+        return rank
+
+    def _compact(self):
+        self._items = items = [x for x in self._items if x is not sentinel]
+        self._dict.update(zip(items, count()))
+        self._tree = None
 
     def add(self, value):
-        self._dict[value] = None
+        d = self._dict
+        if value not in d:
+            if (items := self._items) is None:
+                d[value] = None
+            else:
+                d[value] = len(items)
+                items.append(value)
+                if self._tree is not None:
+                    self._grow()
+
+    def _grow(self):
+        # account for an element appended to the array
+        tree = self._tree
+        i = len(tree)
+        total, j, low = 1, i - 1, i - (i & -i)
+        while j > low:
+            total += tree[j]
+            j &= j - 1
+        tree.append(total)
+
+    def _drop(self, i):
+        items = self._items
+        if i == len(items) - 1:
+            items.pop()
+            while items and items[-1] is sentinel:
+                items.pop()
+            if (tree := self._tree) is not None:
+                # entries only cover preceding slots, thus stay valid
+                del tree[len(items) + 1 :]
+            return
+        items[i] = sentinel
+        if len(items) - len(self._dict) > len(self._dict):
+            self._compact()
+        elif (tree := self._tree) is not None:
+            i += 1
+            while i < len(tree):
+                tree[i] -= 1
+                i += i & -i
 
     def discard(self, value):
-        try:
-            del self._dict[value]
-        except KeyError:
-            pass
+        i = self._dict.pop(value, sentinel)
+        if i is not sentinel and self._items is not None:
+            self._drop(i)
 
     def remove(self, value):
-        del self._dict[value]
+        i = self._dict.pop(value)
+        if self._items is not None:
+            self._drop(i)
 
     def clear(self):
         self._dict = {}
+        self._items = self._tree = None
 
     def update(self, iterable):
-        self._dict.update((x, None) for x in iterable)
+        d = self._dict
+        if (items := self._items) is None:
+            d.update(dict.fromkeys(iterable))
+        else:
+            new = [x for x in dict.fromkeys(iterable) if x not in d]
+            d.update(zip(new, count(len(items))))
+            items.extend(new)
+            if self._tree is not None:
+                for _ in new:
+                    self._grow()
 
     def __hash__(self):
         raise TypeError(f"unhashable type: {self.__class__.__name__!r}")
@@ -521,6 +733,63 @@ class StackedDict(DictMixin):
     __delitem__ = clear = __setitem__  # pyright: ignore[reportAssignmentType]
 
 
+class CachedStackedDict(StackedDict):
+    """:py:class:`StackedDict` caching which dict each key resolves to
+
+    Lookups are a single probe of a merged index of key to owning dict rather
+    than probing each dict in turn, while len and iteration are over the index.
+    The index is built on first use; :py:meth:`invalidate` must be called after
+    keys are added to or removed from the underlying dicts.  Changing the value
+    of an existing key is fine.
+    """
+
+    __slots__ = ("_index",)
+
+    def __init__(self, *dicts):
+        super().__init__(*dicts)
+        self._index = None
+
+    def _get_index(self):
+        if (index := self._index) is None:
+            # ordered as StackedDict iterates, with the first dict holding a key
+            # winning since it's applied last.
+            index = dict.fromkeys(chain(*self._dicts))
+            for d in reversed(self._dicts):
+                index.update(dict.fromkeys(d, d))
+            self._index = index
+        return index
+
+    def invalidate(self):
+        """discard the index, forcing it to be rebuilt on next use"""
+        self._index = None
+
+    # lookups check the index inline, avoiding a method call per lookup
+
+    def __getitem__(self, key):
+        if (index := self._index) is None:
+            index = self._get_index()
+        return index[key][key]
+
+    def __contains__(self, key):
+        if (index := self._index) is None:
+            index = self._get_index()
+        return key in index
+
+    def keys(self):
+        return iter(self._get_index())
+
+    def values(self):
+        for key, d in self._get_index().items():
+            yield d[key]
+
+    def items(self):
+        for key, d in self._get_index().items():
+            yield key, d[key]
+
+    def __len__(self):
+        return len(self._get_index())
+
+
 class PreservingFoldingDict(DictMixin):
     """dict that uses a 'folder' function when looking up keys.
 
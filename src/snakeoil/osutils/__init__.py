@@ -4,25 +4,32 @@ OS related functionality
 
 __all__ = (
     "abspath",
+    "disk_usage",
+    "DiskUsage",
     "ensure_dirs",
+    "ensure_dirs_many",
+    "StatCache",
     "join",
     "pjoin",
     "listdir_files",
     "listdir_dirs",
     "listdir",
+    "scandir_dirs",
+    "scandir_files",
     "normpath",
     "unlink_if_exists",
     "supported_systems",
+    "walk_tree",
 )
 
 import errno
 import os
 import stat
 import sys
-from stat import (
-    S_ISDIR,
-    S_ISREG,
-)
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import ContextVar
 
 from snakeoil._internals import deprecated
 
@@ -83,7 +90,7 @@ def _safe_mkdir(path, mode):
         # if it exists already and is a dir, non issue.
         if e.errno != errno.EEXIST:
             return False
-        if not stat.S_ISDIR(os.stat(path).st_mode):
+        if not stat.S_ISDIR(_stat(path).st_mode):
             return False
     return True
 
@@ -106,10 +113,19 @@ def ensure_dirs(path, gid=-1, uid=-1, mode=0o777, minimal=True):
         permissions, False if not.
     """
 
+    return _ensure_dirs(path, gid, uid, mode, minimal, {})
+
+
+def _ensure_dirs(path, gid, uid, mode, minimal, known):
+    # known maps paths already stat'd to their stat results; this spares
+    # restating shared parents when ensuring many paths.
     join = os.path.join
-    try:
-        st = os.stat(path)
-    except OSError:
+    if (st := known.get(path)) is None:
+        try:
+            st = _stat(path)
+        except OSError:
+            pass
+    if st is None:
         base = os.path.sep
         try:
             um = os.umask(0)
@@ -122,7 +138,8 @@ def ensure_dirs(path, gid=-1, uid=-1, mode=0o777, minimal=True):
             for directory in apath.split(os.path.sep):
                 base = join(base, directory)
                 try:
-                    st = os.stat(base)
+                    if (st := known.get(base)) is None:
+                        st = known[base] = _stat(base)
                     if not stat.S_ISDIR(st.st_mode):
                         # one of the path components isn't a dir
                         return False
@@ -150,6 +167,7 @@ def ensure_dirs(path, gid=-1, uid=-1, mode=0o777, minimal=True):
 
             try:
                 for base, m in reversed(resets):
+                    _stat_invalidate(base)
                     os.chmod(base, m)
                     if gid != -1 or uid != -1:
                         os.chown(base, uid, gid)
@@ -166,17 +184,61 @@ def ensure_dirs(path, gid=-1, uid=-1, mode=0o777, minimal=True):
 
         try:
             if (gid != -1 and gid != st.st_gid) or (uid != -1 and uid != st.st_uid):
+                known.pop(path, None)
+                _stat_invalidate(path)
                 os.chown(path, uid, gid)
             if minimal:
                 if mode != (st.st_mode & mode):
+                    known.pop(path, None)
+                    _stat_invalidate(path)
                     os.chmod(path, st.st_mode | mode)
             elif mode != (st.st_mode & 0o7777):
+                known.pop(path, None)
+                _stat_invalidate(path)
                 os.chmod(path, mode)
         except OSError:
             return False
     return True
 
 
+_ensured_dirs = set()
+
+
+def ensure_dirs_many(paths, gid=-1, uid=-1, mode=0o777, minimal=True, cache=False):
+    """ensure many dirs exist, creating as needed with (optional) gid, uid, and mode.
+
+    This is equivalent to invoking :py:func:`ensure_dirs` for each path, but
+    each shared parent directory is only stat'd once rather than once per path.
+
+    :param paths: iterable of directories to ensure exist on disk
+    :param cache: if True, paths ensured with these gid, uid, mode, and minimal
+        settings are remembered for the life of the process, and skipped by
+        later calls.  Only use this if nothing else removes or modifies those
+        directories; :py:func:`ensure_dirs_many.cache_clear` forgets them.
+
+    See :py:func:`ensure_dirs` for the remaining arguments.
+
+    :return: True if all directories could be created/ensured to have those
+        permissions, False if not.
+    """
+    settings = (gid, uid, mode, minimal)
+    known = {}
+    result = True
+    # sorting orders parents before children, thus created parents are known.
+    for path in sorted({os.path.normpath(os.path.abspath(x)) for x in paths}):
+        if cache and (path, settings) in _ensured_dirs:
+            continue
+        if _ensure_dirs(path, gid, uid, mode, minimal, known):
+            if cache:
+                _ensured_dirs.add((path, settings))
+        else:
+            result = False
+    return result
+
+
+ensure_dirs_many.cache_clear = _ensured_dirs.clear
+
+
 def _abssymlink(path):
     """Return the absolute path of a symlink
 
@@ -286,25 +348,185 @@ def sizeof_fmt(size, binary=True):
     return f"{size:3.1f} {prefix}B"
 
 
+StatCacheInfo = namedtuple("StatCacheInfo", ("hits", "misses", "invalidations"))
+
+
+class StatCache:
+    """Short lived cache of stat results consulted by osutils helpers
+
+    While entered as a context manager, :py:func:`stat_mtime_long`,
+    :py:func:`lstat_mtime_long`, :py:func:`listdir_dirs`,
+    :py:func:`listdir_files`, :py:func:`ensure_dirs`, and anything built on
+    them reuse stat results rather than stat'ing the same path again.  The
+    cache is only active within the thread (or asyncio task) that entered it;
+    nesting caches activates the innermost.
+
+    Results are only as fresh as the first stat of a path; either keep the
+    scope short, pass a ttl, or :py:meth:`invalidate` paths known to have
+    changed.  Paths modified via :py:func:`ensure_dirs` are invalidated
+    automatically.  Failed stats aren't cached.
+
+    >>> from snakeoil.osutils import StatCache, stat_mtime_long
+    >>> with StatCache() as cache:
+    ...     mtime = stat_mtime_long("/")
+    ...     mtime == stat_mtime_long("/")
+    True
+    >>> cache.cache_info()
+    StatCacheInfo(hits=1, misses=1, invalidations=0)
+    """
+
+    __slots__ = ("ttl", "_entries", "_hits", "_misses", "_invalidations", "_depth")
+
+    def __init__(self, ttl=None):
+        """
+        :param ttl: seconds a stat result stays valid for; if None, results
+            are valid until invalidated or the cache is exited.
+        """
+        if ttl is not None and ttl <= 0:
+            raise ValueError(f"ttl must be positive: {ttl!r}")
+        self.ttl = ttl
+        self._entries = {}
+        self._hits = self._misses = self._invalidations = 0
+        self._depth = 0
+
+    def stat(self, path, follow_symlinks=True):
+        """cached :py:func:`os.stat`"""
+        key = (os.fspath(path), follow_symlinks)
+        if (entry := self._entries.get(key)) is not None:
+            st, expires = entry
+            if expires is None or expires > time.monotonic():
+                self._hits += 1
+                return st
+        self._misses += 1
+        st = os.stat(path, follow_symlinks=follow_symlinks)
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        self._entries[key] = (st, expires)
+        return st
+
+    def lstat(self, path):
+        """cached :py:func:`os.lstat`"""
+        return self.stat(path, follow_symlinks=False)
+
+    def invalidate(self, path=None):
+        """drop cached results for path, or everything if path is None"""
+        if path is None:
+            self._invalidations += len(self._entries)
+            self._entries.clear()
+            return
+        path = os.fspath(path)
+        for key in ((path, True), (path, False)):
+            if self._entries.pop(key, None) is not None:
+                self._invalidations += 1
+
+    def cache_info(self):
+        """return a :py:class:`StatCacheInfo` of the hits, misses, and invalidations"""
+        return StatCacheInfo(self._hits, self._misses, self._invalidations)
+
+    @property
+    def hit_rate(self):
+        """fraction of lookups served from the cache"""
+        total = self._hits + self._misses
+        return self._hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __enter__(self):
+        self._depth += 1
+        # the token is only valid within the context that set it, thus track it
+        # via the context itself rather than the (possibly shared) instance.
+        active = [self, None]
+        active[1] = _stat_cache.set(active)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _stat_cache.reset(_stat_cache.get()[1])
+        self._depth -= 1
+        if not self._depth:
+            self._entries.clear()
+
+
+# [active cache, token restoring the previous state] of the current context.
+_stat_cache = ContextVar("snakeoil.osutils.stat_cache", default=None)
+
+
+def _stat(path, follow_symlinks=True):
+    if (active := _stat_cache.get()) is None:
+        return os.stat(path, follow_symlinks=follow_symlinks)
+    return active[0].stat(path, follow_symlinks)
+
+
+def _stat_invalidate(path):
+    if (active := _stat_cache.get()) is not None:
+        active[0].invalidate(path)
+
+
 def stat_mtime_long(path, st=None):
-    return (os.stat(path) if st is None else st)[stat.ST_MTIME]
+    return (_stat(path) if st is None else st)[stat.ST_MTIME]
 
 
 def lstat_mtime_long(path, st=None):
-    return (os.lstat(path) if st is None else st)[stat.ST_MTIME]
+    return (_stat(path, False) if st is None else st)[stat.ST_MTIME]
 
 
 def fstat_mtime_long(fd, st=None):
     return (os.fstat(fd) if st is None else st)[stat.ST_MTIME]
 
 
-def _stat_swallow_enoent(path, check, default=False, stat=os.stat):
+def _scandir_filter(path, check, followSymlinks):
+    # DirEntry's type checks use d_type where the filesystem provides it; stat is
+    # only required for symlinks being followed, or unknown types.
+    with os.scandir(path) as it:
+        if (active := _stat_cache.get()) is None or not followSymlinks:
+            return [x for x in it if check(x, follow_symlinks=followSymlinks)]
+        return [x for x in it if _check_cached(active[0], x, check)]
+
+
+def _check_cached(cache, entry, check):
+    # resolve symlinks through the active stat cache so later stats of the
+    # target reuse the result.
+    if not entry.is_symlink():
+        return check(entry, follow_symlinks=False)
     try:
-        return check(stat(path).st_mode)
-    except OSError as oe:
-        if oe.errno == errno.ENOENT:
-            return default
-        raise
+        mode = cache.stat(entry.path).st_mode
+    except FileNotFoundError:
+        # dangling symlink
+        return False
+    if check is os.DirEntry.is_dir:
+        return stat.S_ISDIR(mode)
+    return stat.S_ISREG(mode)
+
+
+def scandir_dirs(path, followSymlinks=True):
+    """
+    Return a list of :py:class:`os.DirEntry` for all subdirectories within a directory
+
+    The entries cache any stat results fetched; reuse them rather than
+    stat'ing the returned paths again.
+
+    :param path: directory to scan
+    :param followSymlinks: this controls if symlinks are resolved.
+        If True and the symlink resolves to a directory, it is returned,
+        else if False it isn't returned.
+    :return: list of entries for directories within `path`
+    """
+    return _scandir_filter(path, os.DirEntry.is_dir, followSymlinks)
+
+
+def scandir_files(path, followSymlinks=True):
+    """
+    Return a list of :py:class:`os.DirEntry` for all files within a directory
+
+    The entries cache any stat results fetched; reuse them rather than
+    stat'ing the returned paths again.
+
+    :param path: directory to scan
+    :param followSymlinks: this controls if symlinks are resolved.
+        If True and the symlink resolves to a file, it is returned,
+        else if False it isn't returned.
+    :return: list of entries for files within `path`
+    """
+    return _scandir_filter(path, os.DirEntry.is_file, followSymlinks)
 
 
 def listdir_dirs(path, followSymlinks=True):
@@ -317,16 +539,7 @@ def listdir_dirs(path, followSymlinks=True):
         else if False it isn't returned.
     :return: list of directories within `path`
     """
-    scheck = S_ISDIR
-    lstat = os.lstat
-    if followSymlinks:
-        return [
-            x
-            for x in os.listdir(path)
-            if _stat_swallow_enoent(os.path.join(path, x), scheck)
-        ]
-    lstat = os.lstat
-    return [x for x in os.listdir(path) if scheck(lstat(os.path.join(path, x)).st_mode)]
+    return [x.name for x in scandir_dirs(path, followSymlinks)]
 
 
 def listdir_files(path, followSymlinks=True):
@@ -339,13 +552,201 @@ def listdir_files(path, followSymlinks=True):
         else if False it isn't returned.
     :return: list of files within `path`
     """
+    return [x.name for x in scandir_files(path, followSymlinks)]
+
 
-    scheck = S_ISREG
-    if followSymlinks:
-        return [
-            x
-            for x in os.listdir(path)
-            if _stat_swallow_enoent(os.path.join(path, x), scheck)
-        ]
-    lstat = os.lstat
-    return [x for x in os.listdir(path) if scheck(lstat(os.path.join(path, x)).st_mode)]
+def _scan_dir(path, follow_symlinks):
+    results = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                st = entry.stat(follow_symlinks=follow_symlinks)
+            except FileNotFoundError:
+                if not follow_symlinks:
+                    # removed since the directory was read
+                    continue
+                try:
+                    # dangling symlink
+                    st = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+            results.append((entry, st))
+    return results
+
+
+def walk_tree(
+    root,
+    workers=None,
+    follow_symlinks=False,
+    filter=None,
+    prune=None,
+    group=False,
+    onerror=None,
+):
+    """Recursively walk a directory tree, scanning directories concurrently
+
+    Directories are read and their entries stat'd from a thread pool; where per
+    directory latency dominates (network filesystems for example) this is far
+    faster than :py:func:`os.walk`.  Note the order directories are yielded in
+    is nondeterministic.
+
+    :param root: directory to walk
+    :param workers: number of scanning threads; defaults to cpu count + 4, max 32
+    :param follow_symlinks: whether to stat through, and descend into, symlinks.
+        Directories already visited are skipped to avoid symlink loops.
+    :param filter: optional callable taking the entry and its stat result;
+        only entries for which it returns True are yielded
+    :param prune: optional callable taking a directory entry and its stat result;
+        if it returns True the directory isn't descended into
+    :param group: if True, yield (directory path, list of (entry, stat result))
+        per directory, else yield the (entry, stat result) tuples directly
+    :param onerror: optional callable invoked with the OSError for directories
+        that couldn't be read; by default those are skipped
+    :return: iterator of (:py:class:`os.DirEntry`, :py:class:`os.stat_result`)
+        tuples, or per directory lists of those if `group` is True
+    """
+    if workers is None:
+        workers = min(32, (os.cpu_count() or 1) + 4)
+    root = os.fspath(root)
+    seen = set()
+    if follow_symlinks:
+        try:
+            st = os.stat(root)
+        except OSError as e:
+            if onerror is not None:
+                onerror(e)
+            return
+        seen.add((st.st_dev, st.st_ino))
+    todo = deque([root])
+    pending = {}
+    # bound the scanned but unconsumed directories, thus memory usage.
+    limit = workers * 4
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        while todo or pending:
+            while todo and len(pending) < limit:
+                path = todo.popleft()
+                pending[pool.submit(_scan_dir, path, follow_symlinks)] = path
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    results = future.result()
+                except OSError as e:
+                    if onerror is not None:
+                        onerror(e)
+                    continue
+                for entry, st in results:
+                    if not stat.S_ISDIR(st.st_mode):
+                        continue
+                    if prune is not None and prune(entry, st):
+                        continue
+                    if follow_symlinks:
+                        if (key := (st.st_dev, st.st_ino)) in seen:
+                            continue
+                        seen.add(key)
+                    todo.append(entry.path)
+                if filter is not None:
+                    results = [x for x in results if filter(*x)]
+                if group:
+                    yield path, results
+                else:
+                    yield from results
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+DiskUsage = namedtuple(
+    "DiskUsage", ("apparent", "allocated", "files", "dirs", "inodes")
+)
+DiskUsage.__doc__ = """disk usage totals for a tree
+
+:ivar apparent: sum of file sizes in bytes
+:ivar allocated: bytes of disk blocks allocated
+:ivar files: number of non-directory entries, counting each hardlink
+:ivar dirs: number of directories, including the tree's root
+:ivar inodes: number of distinct inodes; sizes are only counted once per inode
+"""
+
+
+def disk_usage(paths, workers=None, follow_symlinks=False, depth=0, onerror=None):
+    """Compute disk usage totals for trees, akin to du
+
+    Trees are scanned via :py:func:`walk_tree`, thus concurrently.  Like du,
+    files hardlinked multiple times, including across the given paths, only
+    have their size counted once; which subtree is credited with such a file is
+    nondeterministic.
+
+    :param paths: iterable of paths to compute totals for
+    :param workers: number of scanning threads, see :py:func:`walk_tree`
+    :param follow_symlinks: whether to stat through, and descend into, symlinks
+    :param depth: additionally compute totals for each subdirectory up to
+        this many levels below each path
+    :param onerror: optional callable invoked with the OSError for paths
+        that couldn't be read; by default those are skipped
+    :return: dict mapping each path, and subdirectories up to `depth`, to a
+        :py:class:`DiskUsage`
+    """
+    seen = set()
+    totals = {}
+
+    def account(st, targets):
+        key = (st.st_dev, st.st_ino)
+        new = key not in seen
+        seen.add(key)
+        is_dir = stat.S_ISDIR(st.st_mode)
+        for target in targets:
+            target[3 if is_dir else 2] += 1
+            if new:
+                target[0] += st.st_size
+                target[1] += st.st_blocks * 512
+                target[4] += 1
+
+    def prune(entry, st):
+        # directories already accounted for via another path
+        return (st.st_dev, st.st_ino) in seen
+
+    for root in paths:
+        root = os.fspath(root)
+        try:
+            st = os.stat(root, follow_symlinks=follow_symlinks)
+        except OSError as e:
+            if onerror is not None:
+                onerror(e)
+            continue
+        is_dir = stat.S_ISDIR(st.st_mode)
+        if is_dir and prune(None, st):
+            continue
+        account(st, [totals.setdefault(root, [0] * 5)])
+        if not is_dir:
+            continue
+
+        # directory path -> its totals and those of its ancestors up to depth.
+        chains = {root: ([totals[root]], 0)}
+        for path, results in walk_tree(
+            root,
+            workers=workers,
+            follow_symlinks=follow_symlinks,
+            prune=prune,
+            group=True,
+            onerror=onerror,
+        ):
+            # directories queued before an earlier one with the same inode was
+            # accounted for (bind mounts for example) are skipped here.
+            if (chain := chains.pop(path, None)) is None:
+                continue
+            targets, level = chain
+            for entry, st in results:
+                if stat.S_ISDIR(st.st_mode):
+                    if prune(entry, st):
+                        continue
+                    if level < depth:
+                        subtotals = totals.setdefault(entry.path, [0] * 5)
+                        chains[entry.path] = (targets + [subtotals], level + 1)
+                    else:
+                        chains[entry.path] = (targets, level)
+                    account(st, chains[entry.path][0])
+                else:
+                    account(st, targets)
+
+    return {k: DiskUsage(*v) for k, v in totals.items()}
@@ -1,10 +1,6 @@
 __all__ = ("mount", "umount")
 
-import ctypes
-import os
-from ctypes.util import find_library
-
-from . import supported_systems
+from . import supported_systems, syscalls
 
 # mount flags synced from sys/mount.h, see the mount(2) man page for details.
 MS_RDONLY = 1
@@ -43,25 +39,10 @@ UMOUNT_NOFOLLOW = 8
 @supported_systems("linux")
 def mount(source, target, fstype, flags, data=None):
     """Call mount(2); see the man page for details."""
-    libc = ctypes.CDLL(find_library("c"), use_errno=True)
-    source = source.encode() if isinstance(source, str) else source
-    target = target.encode() if isinstance(target, str) else target
-    fstype = fstype.encode() if isinstance(fstype, str) else fstype
-    if libc.mount(source, target, fstype, ctypes.c_ulong(flags), data) != 0:
-        e = ctypes.get_errno()
-        raise OSError(e, os.strerror(e))
+    syscalls.mount(source, target, fstype, flags, data)
 
 
 @supported_systems("linux")
 def umount(target, flags=None):
     """Call umount or umount2; see the umount(2) man page for details."""
-    libc = ctypes.CDLL(find_library("c"), use_errno=True)
-    target = target.encode() if isinstance(target, str) else target
-    args = []
-    func = libc.umount
-    if flags is not None:
-        args.append(ctypes.c_ulong(flags))
-        func = libc.umount2
-    if func(target, *args) != 0:
-        e = ctypes.get_errno()
-        raise OSError(e, os.strerror(e))
+    syscalls.umount2(target, 0 if flags is None else flags)
@@ -0,0 +1,329 @@
+"""
+cached libc bindings for Linux system calls
+
+libc is loaded once per process via :py:func:`libc`; prefer these wrappers over
+building a new :py:class:`ctypes.CDLL` per call, since locating libc via
+:py:func:`ctypes.util.find_library` may spawn ldconfig or compiler subprocesses.
+
+Where the stdlib already wraps a call (e.g. :py:func:`os.copy_file_range`), that
+implementation is exported as is.  Calls the running libc lacks raise
+:py:class:`OSError` with errno set to ENOSYS.
+"""
+
+__all__ = (
+    "Statx",
+    "StatxTimestamp",
+    "close_range",
+    "copy_file_range",
+    "fallocate",
+    "libc",
+    "mount",
+    "posix_fadvise",
+    "renameat2",
+    "statx",
+    "umount2",
+)
+
+import ctypes
+import errno
+import os
+from ctypes.util import find_library
+from functools import cache
+
+from . import supported_systems
+
+# *at() flags synced from fcntl.h.
+AT_FDCWD = -100
+AT_SYMLINK_NOFOLLOW = 0x100
+AT_NO_AUTOMOUNT = 0x800
+AT_EMPTY_PATH = 0x1000
+AT_STATX_SYNC_AS_STAT = 0x0000
+AT_STATX_FORCE_SYNC = 0x2000
+AT_STATX_DONT_SYNC = 0x4000
+
+# statx masks synced from linux/stat.h, see the statx(2) man page for details.
+STATX_TYPE = 0x0001
+STATX_MODE = 0x0002
+STATX_NLINK = 0x0004
+STATX_UID = 0x0008
+STATX_GID = 0x0010
+STATX_ATIME = 0x0020
+STATX_MTIME = 0x0040
+STATX_CTIME = 0x0080
+STATX_INO = 0x0100
+STATX_SIZE = 0x0200
+STATX_BLOCKS = 0x0400
+STATX_BASIC_STATS = 0x07FF
+STATX_BTIME = 0x0800
+STATX_MNT_ID = 0x1000
+STATX_DIOALIGN = 0x2000
+
+# fallocate modes synced from linux/falloc.h, see the fallocate(2) man page for details.
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+FALLOC_FL_COLLAPSE_RANGE = 0x08
+FALLOC_FL_ZERO_RANGE = 0x10
+FALLOC_FL_INSERT_RANGE = 0x20
+
+# renameat2 flags synced from linux/fs.h, see the rename(2) man page for details.
+RENAME_NOREPLACE = 1 << 0
+RENAME_EXCHANGE = 1 << 1
+RENAME_WHITEOUT = 1 << 2
+
+# close_range flags synced from linux/close_range.h.
+CLOSE_RANGE_UNSHARE = 1 << 1
+CLOSE_RANGE_CLOEXEC = 1 << 2
+
+
+@cache
+def libc():
+    """return the process's libc, loaded once"""
+    # symbols of libraries already loaded into the process resolve via the
+    # main program's handle, avoiding find_library's subprocesses.
+    lib = ctypes.CDLL(None, use_errno=True)
+    if not hasattr(lib, "getpid"):
+        lib = ctypes.CDLL(find_library("c"), use_errno=True)
+    return lib
+
+
+def _check(ret):
+    if ret < 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+    return ret
+
+
+@cache
+def _func(name, restype, *argtypes):
+    # prototyped libc function, or None if libc lacks it.
+    try:
+        func = getattr(libc(), name)
+    except AttributeError:
+        return None
+    func.restype = restype
+    func.argtypes = argtypes
+    return func
+
+
+def _require(name, *args):
+    if (func := _func(name, *args)) is None:
+        raise OSError(errno.ENOSYS, f"libc lacks {name}")
+    return func
+
+
+def _path(path):
+    return os.fsencode(path) if path is not None else None
+
+
+@supported_systems("linux")
+def mount(source, target, fstype, flags, data=None):
+    """Call mount(2); see the man page for details."""
+    ret = libc().mount(
+        _path(source), _path(target), _path(fstype), ctypes.c_ulong(flags), data
+    )
+    if ret != 0:
+        _check(-1)
+
+
+@supported_systems("linux")
+def umount2(target, flags=0):
+    """Call umount2(2); see the man page for details."""
+    if libc().umount2(_path(target), ctypes.c_int(flags)) != 0:
+        _check(-1)
+
+
+class StatxTimestamp(ctypes.Structure):
+    """struct statx_timestamp"""
+
+    _fields_ = (
+        ("tv_sec", ctypes.c_int64),
+        ("tv_nsec", ctypes.c_uint32),
+        ("_reserved", ctypes.c_int32),
+    )
+
+    @property
+    def ns(self):
+        """timestamp in nanoseconds"""
+        return self.tv_sec * 1_000_000_000 + self.tv_nsec
+
+
+class Statx(ctypes.Structure):
+    """struct statx; see the statx(2) man page for the fields
+
+    Only the fields flagged in ``stx_mask`` were filled in by the kernel.
+    """
+
+    _fields_ = (
+        ("stx_mask", ctypes.c_uint32),
+        ("stx_blksize", ctypes.c_uint32),
+        ("stx_attributes", ctypes.c_uint64),
+        ("stx_nlink", ctypes.c_uint32),
+        ("stx_uid", ctypes.c_uint32),
+        ("stx_gid", ctypes.c_uint32),
+        ("stx_mode", ctypes.c_uint16),
+        ("_spare0", ctypes.c_uint16),
+        ("stx_ino", ctypes.c_uint64),
+        ("stx_size", ctypes.c_uint64),
+        ("stx_blocks", ctypes.c_uint64),
+        ("stx_attributes_mask", ctypes.c_uint64),
+        ("stx_atime", StatxTimestamp),
+        ("stx_btime", StatxTimestamp),
+        ("stx_ctime", StatxTimestamp),
+        ("stx_mtime", StatxTimestamp),
+        ("stx_rdev_major", ctypes.c_uint32),
+        ("stx_rdev_minor", ctypes.c_uint32),
+        ("stx_dev_major", ctypes.c_uint32),
+        ("stx_dev_minor", ctypes.c_uint32),
+        ("stx_mnt_id", ctypes.c_uint64),
+        ("stx_dio_mem_align", ctypes.c_uint32),
+        ("stx_dio_offset_align", ctypes.c_uint32),
+        ("_spare3", ctypes.c_uint64 * 12),
+    )
+
+
+@supported_systems("linux")
+def statx(
+    path,
+    mask=STATX_BASIC_STATS | STATX_BTIME,
+    follow_symlinks=True,
+    flags=AT_STATX_SYNC_AS_STAT,
+    dir_fd=None,
+):
+    """Call statx(2); see the man page for details.
+
+    :param path: path to stat, relative to dir_fd if given; an open file
+        descriptor stats that file.
+    :param mask: STATX_* fields requested; check ``stx_mask`` of the result for
+        what the filesystem actually provided.
+    :return: :py:class:`Statx` instance
+    """
+    if isinstance(path, int):
+        dir_fd, path, flags = path, b"", flags | AT_EMPTY_PATH
+    if not follow_symlinks:
+        flags |= AT_SYMLINK_NOFOLLOW
+    func = _require(
+        "statx",
+        ctypes.c_int,
+        ctypes.c_int,
+        ctypes.c_char_p,
+        ctypes.c_int,
+        ctypes.c_uint,
+        ctypes.POINTER(Statx),
+    )
+    result = Statx()
+    _check(
+        func(
+            AT_FDCWD if dir_fd is None else dir_fd,
+            _path(path),
+            flags,
+            mask,
+            ctypes.byref(result),
+        )
+    )
+    return result
+
+
+if hasattr(os, "copy_file_range"):
+    copy_file_range = os.copy_file_range
+else:
+
+    @supported_systems("linux")
+    def copy_file_range(src, dst, count, offset_src=None, offset_dst=None):
+        """Call copy_file_range(2); mirrors :py:func:`os.copy_file_range`."""
+        loff_p = ctypes.POINTER(ctypes.c_int64)
+        func = _require(
+            "copy_file_range",
+            ctypes.c_ssize_t,
+            ctypes.c_int,
+            loff_p,
+            ctypes.c_int,
+            loff_p,
+            ctypes.c_size_t,
+            ctypes.c_uint,
+        )
+        offsets = [
+            None if x is None else ctypes.byref(ctypes.c_int64(x))
+            for x in (offset_src, offset_dst)
+        ]
+        return _check(func(src, offsets[0], dst, offsets[1], count, 0))
+
+
+if hasattr(os, "posix_fadvise"):
+    posix_fadvise = os.posix_fadvise
+else:
+
+    @supported_systems("linux")
+    def posix_fadvise(fd, offset, length, advice):
+        """Call posix_fadvise(2); mirrors :py:func:`os.posix_fadvise`."""
+        func = _require(
+            "posix_fadvise64",
+            ctypes.c_int,
+            ctypes.c_int,
+            ctypes.c_int64,
+            ctypes.c_int64,
+            ctypes.c_int,
+        )
+        # the error is returned rather than set in errno.
+        if e := func(fd, offset, length, advice):
+            raise OSError(e, os.strerror(e))
+
+
+@supported_systems("linux")
+def fallocate(fd, offset, length, mode=0):
+    """Call fallocate(2); see the man page for details.
+
+    :param mode: bitwise OR of FALLOC_FL_* flags, or 0 to allocate the range
+    """
+    args = (ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64)
+    if (func := _func("fallocate64", *args)) is None:
+        func = _require("fallocate", *args)
+    _check(func(fd, mode, offset, length))
+
+
+@supported_systems("linux")
+def renameat2(src, dst, flags=0, src_dir_fd=None, dst_dir_fd=None):
+    """Call renameat2(2); see the rename(2) man page for details.
+
+    :param flags: RENAME_NOREPLACE to fail with :py:class:`FileExistsError`
+        rather than replacing dst, or RENAME_EXCHANGE to atomically swap src
+        and dst.
+    """
+    func = _require(
+        "renameat2",
+        ctypes.c_int,
+        ctypes.c_int,
+        ctypes.c_char_p,
+        ctypes.c_int,
+        ctypes.c_char_p,
+        ctypes.c_uint,
+    )
+    _check(
+        func(
+            AT_FDCWD if src_dir_fd is None else src_dir_fd,
+            _path(src),
+            AT_FDCWD if dst_dir_fd is None else dst_dir_fd,
+            _path(dst),
+            flags,
+        )
+    )
+
+
+@supported_systems("linux")
+def close_range(first, last=None, flags=0):
+    """Call close_range(2); see the man page for details.
+
+    :param last: last fd of the range, inclusive; if None, all fds from first on.
+    :param flags: CLOSE_RANGE_CLOEXEC to mark the fds close-on-exec rather than
+        closing them.
+    """
+    if last is None:
+        last = 0xFFFFFFFF
+    func = _func(
+        "close_range", ctypes.c_int, ctypes.c_uint, ctypes.c_uint, ctypes.c_int
+    )
+    if func is None:
+        if flags:
+            raise OSError(errno.ENOSYS, "libc lacks close_range")
+        os.closerange(first, min(last, os.sysconf("SC_OPEN_MAX") - 1) + 1)
+        return
+    _check(func(first, last, flags))
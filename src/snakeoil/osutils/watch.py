@@ -0,0 +1,328 @@
+"""
+inotify based change notification
+
+A :py:class:`Watcher` lets caches learn of file changes from the kernel rather
+than revalidating via stat on each access.  Files are watched through their
+parent directory, thus replacing a file via rename is noticed as well as
+modifying it in place.
+
+>>> from snakeoil.osutils.watch import Watcher
+>>> watcher = Watcher() # doctest: +SKIP
+>>> stamp = watcher.stamp("/etc/make.conf") # doctest: +SKIP
+>>> data = open("/etc/make.conf").read() # doctest: +SKIP
+>>> stamp.valid # doctest: +SKIP
+True
+
+Note that events are delivered asynchronously by a background thread; a change
+is reflected once that thread has processed the event.  Changes made through
+other hardlinks of a file aren't noticed.
+"""
+
+__all__ = ("Stamp", "Watcher")
+
+import os
+import select
+import struct
+import threading
+import weakref
+
+from ..log import logger
+from . import supported_systems
+from .syscalls import _check, libc
+
+# inotify flags synced from sys/inotify.h, see the inotify(7) man page for details.
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_CLOEXEC = os.O_CLOEXEC
+IN_NONBLOCK = os.O_NONBLOCK
+
+_WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+_SELF_MASK = IN_DELETE_SELF | IN_MOVE_SELF | IN_UNMOUNT | IN_IGNORED
+
+_event = struct.Struct("iIII")
+
+
+class Stamp:
+    """validity token for a path
+
+    :ivar valid: True until a change to the path has been seen.
+    """
+
+    __slots__ = ("valid", "_key")
+
+    def __init__(self, key=None):
+        self.valid = True
+        self._key = key
+
+    def __bool__(self):
+        return self.valid
+
+
+class Watcher:
+    """inotify wrapper dispatching change events from a background thread
+
+    Paths are registered either via :py:meth:`stamp` for one shot validity
+    tokens, or via :py:meth:`subscribe` for callbacks on every change.  A
+    directory's watch is removed once nothing is registered within it anymore;
+    stamps no longer of interest should thus be dropped via :py:meth:`release`.
+    Everything is released upon :py:meth:`close`, or once the instance is
+    garbage collected.
+    """
+
+    @supported_systems("linux")
+    def __init__(self):
+        self._fd = _check(libc().inotify_init1(IN_CLOEXEC | IN_NONBLOCK))
+        self._wakeup_r, self._wakeup_w = os.pipe2(os.O_CLOEXEC)
+        self._lock = threading.Lock()
+        # directory -> watch descriptor, and the reverse; the kernel hands out
+        # the same descriptor for every path reaching a directory inode, so a
+        # descriptor maps to all of its aliases.
+        self._dirs = {}
+        self._wds = {}
+        # (directory, name) -> listeners; a name of None is the directory as a whole.
+        self._stamps = {}
+        self._subscriptions = {}
+        # directory -> keys with listeners within it.
+        self._keys = {}
+        # the thread only holds a weakref, so an unreferenced watcher is collected.
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(weakref.ref(self), self._fd, self._wakeup_r, self._wakeup_w),
+            name="snakeoil-inotify",
+            daemon=True,
+        )
+        self._thread.start()
+        self._finalizer = weakref.finalize(
+            self, _shutdown, self._thread, self._wakeup_w
+        )
+
+    @staticmethod
+    def _key(path):
+        path = os.path.abspath(os.fspath(path))
+        if os.path.isdir(path):
+            return path, None
+        return os.path.split(path)
+
+    def _watch(self, key):
+        # must be called with the lock held.
+        directory = key[0]
+        if directory not in self._dirs:
+            wd = _check(
+                libc().inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+            )
+            self._dirs[directory] = wd
+            self._wds.setdefault(wd, set()).add(directory)
+            self._keys[directory] = set()
+        self._keys[directory].add(key)
+
+    def _forget(self, key):
+        # must be called with the lock held; drops the directory's watch once
+        # nothing is registered within it anymore.
+        if key in self._stamps or key in self._subscriptions:
+            return
+        directory = key[0]
+        if (keys := self._keys.get(directory)) is None:
+            return
+        keys.discard(key)
+        if not keys:
+            del self._keys[directory]
+            wd = self._dirs.pop(directory)
+            aliases = self._wds[wd]
+            aliases.discard(directory)
+            if not aliases:
+                del self._wds[wd]
+                # the kernel already dropped the watch if the directory is gone.
+                libc().inotify_rm_watch(self._fd, wd)
+
+    def stamp(self, path) -> Stamp:
+        """return a :py:class:`Stamp` that's invalidated upon the next change to path
+
+        Create the stamp prior to reading the path so that changes made while
+        reading aren't missed.
+
+        :raises OSError: if the path's directory can't be watched
+        """
+        key = self._key(path)
+        stamp = Stamp(key)
+        with self._lock:
+            self._watch(key)
+            self._stamps.setdefault(key, []).append(stamp)
+        return stamp
+
+    def release(self, stamp):
+        """drop a stamp that's no longer of interest, invalidating it"""
+        stamp.valid = False
+        key = stamp._key
+        with self._lock:
+            if stamps := self._stamps.get(key):
+                try:
+                    stamps.remove(stamp)
+                except ValueError:
+                    return
+                if not stamps:
+                    del self._stamps[key]
+                    self._forget(key)
+
+    def subscribe(self, path, callback):
+        """invoke callback upon every change to path
+
+        For a directory, changes to any of its entries are reported.  The callback
+        is invoked from the watcher thread with the full path of what changed; for
+        the watched directory being removed or an event queue overflow, it's
+        invoked with the subscribed path.
+
+        :return: handle for :py:meth:`unsubscribe`
+        :raises OSError: if the path's directory can't be watched
+        """
+        key = self._key(path)
+        handle = (key, callback)
+        with self._lock:
+            self._watch(key)
+            self._subscriptions.setdefault(key, []).append(callback)
+        return handle
+
+    def unsubscribe(self, handle):
+        """stop invoking a callback registered via :py:meth:`subscribe`"""
+        key, callback = handle
+        with self._lock:
+            if callbacks := self._subscriptions.get(key):
+                try:
+                    callbacks.remove(callback)
+                except ValueError:
+                    pass
+                if not callbacks:
+                    del self._subscriptions[key]
+                    self._forget(key)
+
+    def _collect(self, keys, fired, path=None):
+        for key in keys:
+            if stamps := self._stamps.pop(key, None):
+                for stamp in stamps:
+                    stamp.valid = False
+                self._forget(key)
+            if callbacks := self._subscriptions.get(key):
+                if path is not None:
+                    changed = path
+                elif key[1] is None:
+                    changed = key[0]
+                else:
+                    changed = os.path.join(*key)
+                fired.extend((x, changed) for x in callbacks)
+
+    def _dispatch(self, events):
+        fired = []
+        with self._lock:
+            for wd, mask, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    self._collect(list(self._stamps), fired)
+                    self._collect(list(self._subscriptions), fired)
+                    continue
+                if (aliases := self._wds.get(wd)) is None:
+                    continue
+                if mask & _SELF_MASK:
+                    del self._wds[wd]
+                    if not mask & IN_IGNORED:
+                        # a moved directory keeps its watch; drop it explicitly.
+                        libc().inotify_rm_watch(self._fd, wd)
+                    for directory in aliases:
+                        del self._dirs[directory]
+                        keys = self._keys.pop(directory)
+                        self._collect(keys, fired)
+                        for key in keys:
+                            self._subscriptions.pop(key, None)
+                    continue
+                # collecting may forget an alias, thus iterate over a copy.
+                for directory in tuple(aliases):
+                    path = directory if name is None else os.path.join(directory, name)
+                    self._collect(((directory, name), (directory, None)), fired, path)
+        for callback, path in fired:
+            try:
+                callback(path)
+            except Exception:
+                logger.exception("inotify callback %r failed for %r", callback, path)
+
+    @staticmethod
+    def _run(ref, inotify_fd, wakeup_r, wakeup_w):
+        try:
+            Watcher._loop(ref, inotify_fd, wakeup_r)
+        finally:
+            for fd in (inotify_fd, wakeup_r, wakeup_w):
+                os.close(fd)
+
+    @staticmethod
+    def _loop(ref, inotify_fd, wakeup_fd):
+        poller = select.poll()
+        poller.register(inotify_fd, select.POLLIN)
+        poller.register(wakeup_fd, select.POLLIN)
+        while True:
+            ready = {fd for fd, _ in poller.poll()}
+            if wakeup_fd in ready:
+                break
+            try:
+                data = os.read(inotify_fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            events = []
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = _event.unpack_from(data, offset)
+                offset += _event.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                events.append((wd, mask, os.fsdecode(name) if name else None))
+            if (watcher := ref()) is not None:
+                watcher._dispatch(events)
+                del watcher
+
+    def close(self):
+        """stop the watcher thread and release all watches"""
+        if self._fd is None:
+            return
+        self._finalizer()
+        self._fd = None
+        with self._lock:
+            stamps = [x for stamps in self._stamps.values() for x in stamps]
+            self._stamps.clear()
+            self._subscriptions.clear()
+            self._keys.clear()
+            self._dirs.clear()
+            self._wds.clear()
+        # nothing tracks these paths anymore; thus they can't be trusted.
+        for stamp in stamps:
+            stamp.valid = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _shutdown(thread, wakeup_w):
+    os.write(wakeup_w, b"\0")
+    # when closed from a callback, or the last reference is dropped after
+    # dispatching, this runs in the watcher thread; it exits upon its next poll.
+    if thread is not threading.current_thread():
+        thread.join()
@@ -3,7 +3,6 @@
 """Support for Linux namespaces"""
 
 import ctypes
-import ctypes.util
 import errno
 import os
 import signal
@@ -21,6 +20,7 @@ from ..osutils.mount import (
     MS_SLAVE,
 )
 from ..osutils.mount import mount as _mount
+from ..osutils.syscalls import libc
 from . import exit_as_status
 
 CLONE_FS = 0x00000200
@@ -46,8 +46,7 @@ def setns(fd, nstype):
             fp = open(fd)
             fd = fp.fileno()
 
-        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
-        if libc.setns(ctypes.c_int(fd), ctypes.c_int(nstype)) != 0:
+        if libc().setns(ctypes.c_int(fd), ctypes.c_int(nstype)) != 0:
             e = ctypes.get_errno()
             raise OSError(e, os.strerror(e))
     finally:
@@ -61,8 +60,7 @@ def unshare(flags):
     :param flags: Namespaces to unshare; bitwise OR of CLONE_* flags.
     :raises OSError: if unshare failed.
     """
-    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
-    if libc.unshare(ctypes.c_int(flags)) != 0:
+    if libc().unshare(ctypes.c_int(flags)) != 0:
         e = ctypes.get_errno()
         raise OSError(e, os.strerror(e))
 
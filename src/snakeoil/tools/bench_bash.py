@@ -0,0 +1,225 @@
+"""Benchmark snakeoil.bash parsers against generated corpora
+
+Corpora mimic make.conf files, environment dumps, large package lists, and
+continuation heavy files.  Each parser mode reports lines parsed per second
+(best of the iterations) and the peak memory allocated while parsing.  Results
+can be saved as a baseline for later runs to be compared against.
+"""
+
+__all__ = ("main",)
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from snakeoil import bash
+from snakeoil.cli import arghparse
+from snakeoil.cli.tool import Tool
+
+_flags = ("X", "acl", "bindist", "doc", "gtk", "ipv6", "nls", "pam", "qt6", "ssl")
+
+
+def _flag(rng):
+    return rng.choice(("", "-")) + rng.choice(_flags) + str(rng.randrange(50))
+
+
+def _atom(rng):
+    return f"cat-{rng.randrange(200)}/pkg-{rng.randrange(10000)}"
+
+
+def _make_conf(rng, count):
+    lines = []
+    while len(lines) < count:
+        i, kind = len(lines), rng.randrange(10)
+        if kind < 2:
+            lines.append(f"# comment {i} describing the setting below")
+        elif kind == 2:
+            lines.append("")
+        elif kind == 3:
+            # quoted values spanning lines
+            lines.append(f'USE_{i}="' + " ".join(_flag(rng) for _ in range(8)))
+            lines.append("    " + " ".join(_flag(rng) for _ in range(8)) + '"')
+        elif kind == 4:
+            lines.append(f"export PATH_{i}='/usr/lib/{i}/bin'")
+        else:
+            ref = f"${{VAR_{rng.randrange(i)}}}" if i else ""
+            lines.append(f'VAR_{i}="{ref} -O2 -pipe -march=native {_flag(rng)}"')
+    return lines
+
+
+def _env_dump(rng, count):
+    return [
+        f"KEY_{i}='" + " ".join(_flag(rng) for _ in range(rng.randrange(1, 6))) + "'"
+        for i in range(count)
+    ]
+
+
+def _packages(rng, count):
+    lines = []
+    for i in range(count):
+        kind = rng.randrange(10)
+        if kind < 2:
+            lines.append(f"# {i}: packages needing extra flags")
+        elif kind == 2:
+            lines.append("")
+        else:
+            flags = " ".join(_flag(rng) for _ in range(rng.randrange(1, 6)))
+            comment = f" # bug {i}" if kind == 3 else ""
+            lines.append(f">={_atom(rng)}-{rng.randrange(9)}.{i} {flags}{comment}")
+    return lines
+
+
+def _continuations(rng, count):
+    lines = []
+    while len(lines) < count:
+        lines.append(f"{_atom(rng)} \\")
+        lines.extend(f"\t{_flag(rng)} \\" for _ in range(rng.randrange(1, 5)))
+        lines.append(f"\t{_flag(rng)}")
+    return lines
+
+
+def _dict(rng, count):
+    return [
+        f"key_{i} = {_flag(rng)}" if i % 4 else f'key_{i}="{_atom(rng)} {_flag(rng)}"'
+        for i in range(count)
+    ]
+
+
+corpora = {
+    "make.conf": _make_conf,
+    "env": _env_dump,
+    "packages": _packages,
+    "continuations": _continuations,
+    "dict": _dict,
+}
+
+
+def _lines(**kwargs):
+    return lambda path: list(bash.read_bash(path, **kwargs))
+
+
+def _batches(**kwargs):
+    return lambda path: list(bash.read_bash(path, batched=True, **kwargs))
+
+
+# mode: (corpus, parser)
+modes = {
+    "read_bash": ("packages", _lines()),
+    "read_bash-enum": ("packages", _lines(enum_line=True)),
+    "read_bash-batched": ("packages", _batches()),
+    "read_bash-cont": ("continuations", _lines(allow_line_cont=True)),
+    "read_bash-cont-batched": ("continuations", _batches(allow_line_cont=True)),
+    "read_dict": ("dict", bash.read_dict),
+    "read_bash_dict": ("make.conf", bash.read_bash_dict),
+    "read_bash_dict-env": ("env", bash.read_bash_dict),
+}
+
+
+parser = arghparse.ArgumentParser(
+    prog=__name__.rsplit(".", 1)[-1],
+    description=__doc__,
+)
+parser.add_argument(
+    "-m",
+    "--mode",
+    dest="modes",
+    action="append",
+    choices=modes,
+    help="parser mode to benchmark; defaults to all of them",
+)
+parser.add_argument(
+    "-n",
+    "--lines",
+    type=arghparse.positive_int,
+    default=20000,
+    help="number of lines in each corpus",
+)
+parser.add_argument(
+    "-i",
+    "--iterations",
+    type=arghparse.positive_int,
+    default=5,
+    help="number of timed parses of each corpus",
+)
+parser.add_argument(
+    "--save",
+    metavar="PATH",
+    help="save the results as a baseline to PATH",
+)
+parser.add_argument(
+    "--baseline",
+    metavar="PATH",
+    type=arghparse.existent_path,
+    help="compare the results against the baseline saved to PATH",
+)
+
+
+def benchmark(func, path, iterations):
+    """Benchmark parsing a file
+
+    :return: (best time in seconds, peak bytes allocated) tuple
+    """
+    best = None
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    # tracing slows allocations down considerably, thus a separate run
+    tracemalloc.start()
+    try:
+        func(path)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+@parser.bind_main_func
+def main(options, out, err) -> int:
+    baseline = {}
+    if options.baseline is not None:
+        with open(options.baseline) as f:
+            data = json.load(f)
+        if data["lines"] != options.lines:
+            err.write(
+                f"{options.prog}: warning: baseline corpora have {data['lines']} "
+                f"lines rather than {options.lines}"
+            )
+        baseline = data["results"]
+
+    results = {}
+    header = "mode\tcorpus\tlines/sec\tpeak KiB"
+    out.write(header + ("\tvs baseline" if options.baseline else ""))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = {}
+        for mode in options.modes or modes:
+            corpus, func = modes[mode]
+            if (path := paths.get(corpus)) is None:
+                rng = random.Random(corpus)
+                path = paths[corpus] = os.path.join(tmpdir, corpus)
+                with open(path, "w") as f:
+                    f.write("\n".join(corpora[corpus](rng, options.lines)) + "\n")
+            elapsed, peak = benchmark(func, path, options.iterations)
+            rate = options.lines / elapsed
+            results[mode] = {"lines_per_sec": rate, "peak": peak}
+            line = f"{mode}\t{corpus}\t{rate:.0f}\t{peak / 1024:.1f}"
+            if options.baseline:
+                if mode in baseline:
+                    line += f"\t{rate / baseline[mode]['lines_per_sec']:.2f}x"
+                else:
+                    line += "\t-"
+            out.write(line)
+
+    if options.save is not None:
+        with open(options.save, "w") as f:
+            json.dump({"lines": options.lines, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(Tool(parser)())
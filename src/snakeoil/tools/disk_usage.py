@@ -0,0 +1,107 @@
+"""Report disk usage of directory trees, scanning them concurrently"""
+
+__all__ = ("main",)
+
+import os
+import sys
+from functools import partial
+
+from snakeoil.cli import arghparse
+from snakeoil.cli.tool import Tool
+from snakeoil.osutils import disk_usage, sizeof_fmt
+
+parser = arghparse.ArgumentParser(
+    prog=__name__.rsplit(".", 1)[-1],
+    description=__doc__,
+)
+parser.add_argument("paths", nargs="+", help="paths to report usage for")
+parser.add_argument(
+    "-j",
+    "--jobs",
+    type=arghparse.positive_int,
+    default=None,
+    help="number of directory scanning threads",
+)
+parser.add_argument(
+    "-d",
+    "--max-depth",
+    type=partial(arghparse.bounded_int, lambda n: n >= 0, ">= 0"),
+    default=0,
+    help="also report subdirectories up to this many levels below each path",
+)
+parser.add_argument(
+    "-L",
+    "--dereference",
+    action="store_true",
+    help="follow symlinks",
+)
+parser.add_argument(
+    "-b",
+    "--bytes",
+    action="store_true",
+    help="output sizes in bytes rather than human readable units",
+)
+parser.add_argument(
+    "--si",
+    action="store_true",
+    help="use powers of 1000 rather than 1024 for human readable units",
+)
+parser.add_argument(
+    "-c",
+    "--total",
+    action="store_true",
+    help="output a grand total of all paths",
+)
+
+
+@parser.bind_main_func
+def main(options, out, err) -> int:
+    def fmt(size):
+        if options.bytes:
+            return str(size)
+        return sizeof_fmt(size, binary=not options.si)
+
+    failed = False
+
+    def onerror(e):
+        nonlocal failed
+        failed = True
+        err.write(f"{options.prog}: {e}")
+
+    results = disk_usage(
+        options.paths,
+        workers=options.jobs,
+        follow_symlinks=options.dereference,
+        depth=options.max_depth,
+        onerror=onerror,
+    )
+    out.write("allocated\tapparent\tfiles\tdirs\tpath")
+    for path, usage in sorted(results.items()):
+        out.write(
+            f"{fmt(usage.allocated)}\t{fmt(usage.apparent)}\t"
+            f"{usage.files}\t{usage.dirs}\t{path}"
+        )
+    if options.total:
+        # usage is deduplicated across paths, thus paths within an earlier
+        # path were skipped and the rest sum to the total.
+        roots = {}
+        prefixes = []
+        for path in dict.fromkeys(options.paths):
+            abspath = os.path.join(os.path.abspath(path), "")
+            if path in results and not any(map(abspath.startswith, prefixes)):
+                roots[abspath] = results[path]
+            prefixes.append(abspath)
+        total = [sum(x) for x in zip(*roots.values())] or [0] * 5
+        # files preceding a directory containing them were counted again while
+        # walking that directory, albeit without their size.
+        for abspath, usage in roots.items():
+            if not usage.dirs and any(
+                abspath.startswith(x) for x in roots if x != abspath
+            ):
+                total[2] -= usage.files
+        out.write(f"{fmt(total[1])}\t{fmt(total[0])}\t{total[2]}\t{total[3]}\ttotal")
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(Tool(parser)())
@@ -1,11 +1,22 @@
+import io
+import json
+import os
+import random
+from functools import partial
 from io import StringIO
+from unittest import mock
 
 import pytest
 
+from snakeoil import bash
 from snakeoil.bash import (
+    BashAssignment,
+    BashDictCache,
     BashParseError,
+    IncrementalBashDict,
     read_bash,
     read_bash_dict,
+    read_bash_dicts,
     read_dict,
 )
 
@@ -74,6 +85,57 @@ class TestBashCommentStripping:
         )
         assert list(output) == ["I am \\\\", "not a comment"]
 
+    @pytest.mark.parametrize("enum_line", (False, True))
+    @pytest.mark.parametrize("allow_line_cont", (False, True))
+    @pytest.mark.parametrize("allow_inline_comments", (False, True))
+    def test_read_bash_batched(
+        self, tmp_path, allow_inline_comments, allow_line_cont, enum_line
+    ):
+        data = (
+            "\n# comment\\\nA=1 # inline\r\n  B=2\\\n  C=3#x\\\n\\\n"
+            "\tD \\ \n#\\\nE=\xe9 \\\\\nF\\"
+        )
+        path = tmp_path / "file"
+        path.write_bytes(data.encode())
+        args = (allow_inline_comments, allow_line_cont, enum_line)
+        expected = list(read_bash(str(path), *args))
+        assert expected
+        for source in (str(path), data.encode(), StringIO(data)):
+            if isinstance(source, StringIO):
+                # file objects keep their newlines, thus are scanned as they are
+                expected = list(read_bash(StringIO(data), *args))
+            batches = list(read_bash(source, *args, batched=True))
+            assert all(batches)
+            assert [x for batch in batches for x in batch] == expected
+
+    def test_read_bash_batched_size(self):
+        data = b"".join(b"%i\n# comment\n\n" % i for i in range(2500))
+        batches = list(bash._read_bash_batched(data, True, False, True))
+        # lines are filtered a batch at a time
+        assert len(batches) == 8
+        assert all(len(x) <= 1024 for x in batches)
+        assert [x for batch in batches for x in batch] == [
+            (i * 3 + 1, str(i)) for i in range(2500)
+        ]
+        batches = list(bash._read_bash_batched(data, True, True, False))
+        assert [len(x) for x in batches] == [1024, 1024, 452]
+
+    def test_read_bash_batched_missing(self, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            list(read_bash(str(tmp_path / "missing"), batched=True))
+        (tmp_path / "empty").touch()
+        assert list(read_bash(str(tmp_path / "empty"), batched=True)) == []
+
+    @pytest.mark.skipif(
+        not os.path.exists("/proc/filesystems"), reason="requires procfs"
+    )
+    def test_read_bash_batched_broken_stats(self):
+        # procfs files stat as empty despite having content
+        path = "/proc/filesystems"
+        batches = list(read_bash(path, batched=True))
+        assert [x for batch in batches for x in batch] == list(read_bash(path))
+        assert batches
+
 
 class TestReadDictConfig:
     def test_read_dict(self):
@@ -234,3 +296,435 @@ class TestReadBashDict:
 
     def test_wordchards(self):
         assert self.invoke_and_close(StringIO("x=-*")) == {"x": "-*"}
+
+
+class TestVarExpand:
+    @pytest.mark.parametrize(
+        ("val", "expected"),
+        (
+            ("", ""),
+            ("plain", "plain"),
+            ("$a ${b}", "1 2"),
+            ("${a}${b}$a", "121"),
+            ("$unset-${unset}", "-"),
+            (r"\$a \${b}", "$a ${b}"),
+            (r"a\ b\\c", r"a b\c"),
+            ("trailing\\", "trailing\\"),
+            (r"$c", "x$a"),
+            (r"${c}y", "x$ay"),
+            (r"$d\y", r"\y"),
+        ),
+    )
+    def test_expand(self, val, expected):
+        env = {"a": "1", "b": "2", "c": r"x\$a", "d": "\\"}
+        assert bash._var_expand(val, env) == expected
+
+    def test_template_cache(self):
+        bash._compile_var_template.cache_clear()
+        for env in ({"a": "1"}, {"a": "2"}):
+            assert bash._var_expand("x${a}", env) == "x" + env["a"]
+        assert bash._compile_var_template.cache_info().hits == 1
+        # large values aren't cached, bounding the memory held by the cache
+        val = "x" * bash._VAR_TEMPLATE_CACHE_LEN + "${a}"
+        assert bash._var_expand(val, {"a": "1"}) == val[:-4] + "1"
+        assert bash._compile_var_template.cache_info().currsize == 1
+
+    def test_non_str(self):
+        with pytest.raises(ValueError):
+            bash._var_expand("$a", {"a": 1})
+
+
+class TestReadBashDictFastPath:
+    """The fast path must produce exactly what bash_parser does"""
+
+    env = {"B": "1", "C": "a b"}
+    # fragments chosen to hit quoting, expansion, and shlex's quirks
+    fragments = (
+        "A", "B", "x", "1", "=", " ", "\n", "\t", "\r\n", '"', "'", "$", "{", "}",
+        "#", "\\", "\\\n", ";", "-", "*", "ü", "ł", "export ", "B=", "$B", "${B}",
+        "source ",
+    )  # fmt: skip
+    values = (
+        "a", "$B", "${B}", "${C}", "$", "${", "}", "=", "-O2", "/usr/lib", "ü",
+        '"x $B y"', "'q $B'", '""', "''", '"a\\\nb"', "\\\n", "#c",
+    )  # fmt: skip
+
+    @staticmethod
+    def parse(lexer, data, env, sourcing_command=None):
+        d = bash._new_env(env)
+        if lexer is bash.bash_parser:
+            lexer = partial(bash.bash_parser, StringIO(data), env=d)
+        else:
+            lexer = partial(bash._fast_lexer, data, d)
+        try:
+            bash._parse_assignments(lexer(sourcing_command=sourcing_command), d, "x")
+        except bash._FastPathUnsupported:
+            return None
+        except BashParseError:
+            return BashParseError
+        return dict(d.new if env is not None else d)
+
+    def check(self, data, env=None, sourcing_command=None):
+        fast = self.parse(bash._fast_lexer, data, env, sourcing_command)
+        if fast is None or fast is BashParseError:
+            # the full parser is used for these
+            return False
+        assert fast == self.parse(bash.bash_parser, data, env, sourcing_command), data
+        return True
+
+    @pytest.mark.parametrize("seed", range(4))
+    def test_fuzz_fragments(self, seed):
+        rng = random.Random(seed)
+        for _ in range(2000):
+            data = "".join(rng.choices(self.fragments, k=rng.randint(0, 25)))
+            self.check(data, rng.choice((None, self.env)), rng.choice((None, "source")))
+
+    @pytest.mark.parametrize("seed", range(4))
+    def test_fuzz_assignments(self, seed):
+        rng = random.Random(seed)
+        handled = 0
+        for _ in range(2000):
+            data = []
+            for _ in range(rng.randint(1, 6)):
+                key = rng.choice(("A", "B", "C", "export A", "D_1"))
+                val = "".join(rng.choices(self.values, k=rng.randint(0, 4)))
+                sep = rng.choice(("\n", " ", "\n\n", "  # comment\n", ";"))
+                data.append(f"{key}={val}{sep}")
+            data = "".join(data)
+            if rng.random() < 0.3:
+                data = data.rstrip("\n")
+            handled += self.check(data, rng.choice((None, self.env)))
+        # most of these should be handled without falling back
+        assert handled > 500
+
+    @pytest.mark.parametrize(
+        "data",
+        (
+            "# comment\nA=b\n",
+            'export CFLAGS="-O2 -pipe"\nCXXFLAGS="${CFLAGS}"\n',
+            'USE="a b \\\n  c"  # trailing comment\n',
+            "A='$B literal' B=$C\n",
+            "A=\nB=\n",
+            "A=a=b\n",
+            "x$B'$B'x$B=1\n",
+            "A=$B",
+        ),
+    )
+    def test_handled(self, data):
+        assert self.check(data, self.env)
+
+    @pytest.mark.parametrize(
+        "data",
+        (
+            "A=foo\\ bar\n",
+            'A="\\$B"\n',
+            "A=\\\nB\n",
+            'A="unclosed\n',
+            "source foo\n",
+        ),
+    )
+    def test_fallback(self, data):
+        assert not self.check(data, self.env, "source")
+
+    def test_read_bash_dict(self):
+        with mock.patch("snakeoil.bash.bash_parser") as parser:
+            assert read_bash_dict(StringIO('A=1\nB="$A 2"\n')) == {"A": "1", "B": "1 2"}
+            parser.assert_not_called()
+        assert read_bash_dict(StringIO('A=1\nB="\\$A"\n')) == {"A": "1", "B": "$A"}
+        with pytest.raises(BashParseError):
+            read_bash_dict(StringIO("A=1\nB\n"))
+        with pytest.raises(BashParseError):
+            read_bash_dict(StringIO("A=$B\n"), {"B": 1})
+
+
+class TestBashDictCache:
+    def write(self, path, data):
+        # ensure the change is visible via mtime/size regardless of timestamp
+        # granularity
+        st = path.stat() if path.exists() else None
+        path.write_text(data)
+        if st is not None:
+            os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+    def test_caching(self, tmp_path):
+        path = tmp_path / "conf"
+        self.write(path, "A=1\nB=$A\n")
+        cache = BashDictCache()
+        for _ in range(3):
+            result = cache.read_bash_dict(str(path))
+            assert result == {"A": "1", "B": "1"}
+            # results are copies
+            result["C"] = "2"
+        assert (cache.hits, cache.misses) == (2, 1)
+
+        self.write(path, "A=2\n")
+        assert cache.read_bash_dict(str(path)) == {"A": "2"}
+        assert cache.misses == 2
+
+        # file objects aren't cached
+        with open(path) as f:
+            assert cache.read_bash_dict(f) == {"A": "2"}
+        assert (cache.hits, cache.misses) == (2, 2)
+
+    def test_env(self, tmp_path):
+        path = tmp_path / "conf"
+        self.write(path, "A=$X\n")
+        cache = BashDictCache()
+        assert cache.read_bash_dict(str(path), {"X": "1", "Y": "1"}) == {"A": "1"}
+        # keys the file doesn't consult don't matter
+        assert cache.read_bash_dict(str(path), {"X": "1", "Y": "2"}) == {"A": "1"}
+        assert cache.hits == 1
+        assert cache.read_bash_dict(str(path), {"X": "2"}) == {"A": "2"}
+        assert cache.read_bash_dict(str(path), {}) == {"A": ""}
+        assert cache.read_bash_dict(str(path)) == {"A": ""}
+        assert (cache.hits, cache.misses) == (1, 4)
+        assert cache.read_bash_dict(str(path), {"X": "2"}) == {"A": "2"}
+        assert cache.hits == 2
+
+    def test_sourcing(self, tmp_path):
+        sourced = tmp_path / "sourced"
+        self.write(sourced, "A=1\n")
+        path = tmp_path / "conf"
+        self.write(path, "source sourced\nB=$A\n")
+        cache = BashDictCache()
+        read = partial(cache.read_bash_dict, str(path), sourcing_command="source")
+        assert read() == {"A": "1", "B": "1"}
+        assert read() == {"A": "1", "B": "1"}
+        assert cache.hits == 1
+        self.write(sourced, "A=2\n")
+        assert read() == {"A": "2", "B": "2"}
+        assert cache.misses == 2
+        sourced.unlink()
+        with pytest.raises(BashParseError):
+            read()
+
+    def test_sourced_replaced_while_parsing(self, tmp_path):
+        sourced = tmp_path / "sourced"
+        self.write(sourced, "A=1\n")
+        path = tmp_path / "conf"
+        self.write(path, "source sourced\n")
+        cache = BashDictCache()
+        read = partial(cache.read_bash_dict, str(path), sourcing_command="source")
+        sourcehook = bash.bash_parser.sourcehook
+
+        def replace_after_opening(self, newfile):
+            result = sourcehook(self, newfile)
+            (tmp := tmp_path / "tmp").write_text("A=22\n")
+            tmp.replace(sourced)
+            return result
+
+        with mock.patch.object(bash.bash_parser, "sourcehook", replace_after_opening):
+            assert read() == {"A": "1"}
+        # the dependency was stat'd as read, thus the replacement is noticed
+        assert read() == {"A": "22"}
+        assert cache.misses == 2
+
+    def test_max_variants(self, tmp_path):
+        path = tmp_path / "conf"
+        self.write(path, "A=$X\n")
+        cache = BashDictCache()
+        for i in range(cache.max_variants):
+            cache.read_bash_dict(str(path), {"X": str(i)})
+        # refresh the oldest entry so the next one is evicted instead
+        cache.read_bash_dict(str(path), {"X": "0"})
+        cache.read_bash_dict(str(path), {"X": "new"})
+        assert len(cache._entries[(str(path), None)]) == cache.max_variants
+        cache.read_bash_dict(str(path), {"X": "0"})
+        assert cache.hits == 2
+        cache.read_bash_dict(str(path), {"X": "1"})
+        assert cache.misses == cache.max_variants + 2
+
+    def test_errors(self, tmp_path):
+        cache = BashDictCache()
+        path = tmp_path / "conf"
+        self.write(path, "A\n")
+        for _ in range(2):
+            with pytest.raises(BashParseError):
+                cache.read_bash_dict(str(path))
+        with pytest.raises(FileNotFoundError):
+            cache.read_bash_dict(str(tmp_path / "missing"))
+        assert cache.misses == 3
+
+    def test_invalidate(self, tmp_path):
+        path = tmp_path / "conf"
+        self.write(path, "A=1\n")
+        cache = BashDictCache()
+        cache.read_bash_dict(str(path))
+        cache.invalidate(str(path))
+        cache.read_bash_dict(str(path))
+        cache.invalidate()
+        cache.read_bash_dict(str(path))
+        assert cache.misses == 3
+
+    def test_persistence(self, tmp_path):
+        path = tmp_path / "conf"
+        self.write(path, "A=$X\n")
+        cache_path = tmp_path / "cache" / "bash.json"
+        with BashDictCache(cache_path) as cache:
+            assert cache.read_bash_dict(str(path), {"X": "1"}) == {"A": "1"}
+        assert cache_path.exists()
+
+        with BashDictCache(cache_path) as cache:
+            assert cache.read_bash_dict(str(path), {"X": "1"}) == {"A": "1"}
+            assert (cache.hits, cache.misses) == (1, 0)
+
+        self.write(path, "A=2\n")
+        cache = BashDictCache(cache_path)
+        assert cache.read_bash_dict(str(path), {"X": "1"}) == {"A": "2"}
+        assert cache.misses == 1
+
+        # corrupt caches are ignored
+        cache_path.write_text("{")
+        cache = BashDictCache(cache_path)
+        assert cache.read_bash_dict(str(path)) == {"A": "2"}
+        cache.save()
+        assert json.loads(cache_path.read_text())["version"] == 1
+
+
+class TestReadBashDicts:
+    @pytest.fixture
+    def files(self, tmp_path):
+        paths = []
+        for i in range(10):
+            path = tmp_path / f"file{i}"
+            path.write_text(f'A={i}\nB="${{A}}-{i}"\n')
+            paths.append(str(path))
+        (tmp_path / "file3").write_text('A="unterminated\n')
+        return paths
+
+    @pytest.mark.parametrize("workers", (1, 2))
+    def test_ordering_and_errors(self, files, workers):
+        results = list(
+            read_bash_dicts(files + ["/nonexistent"], workers=workers, chunksize=3)
+        )
+        assert [path for path, _ in results] == files + ["/nonexistent"]
+        for i, (path, result) in enumerate(results[:-1]):
+            if i == 3:
+                assert isinstance(result, BashParseError)
+                assert result.file == path
+            else:
+                assert result == {"A": str(i), "B": f"{i}-{i}"}
+        assert isinstance(results[-1][1], FileNotFoundError)
+
+    def test_vars_dict(self, tmp_path):
+        path = tmp_path / "file"
+        path.write_text("B=${A}\n")
+        results = dict(read_bash_dicts([str(path)], vars_dict={"A": "x"}, workers=2))
+        assert results == {str(path): {"B": "x"}}
+
+    def test_empty(self):
+        assert list(read_bash_dicts([], workers=2)) == []
+
+    def test_chunksize(self):
+        with pytest.raises(ValueError):
+            list(read_bash_dicts([], chunksize=0))
+
+
+class TestIncrementalBashDict:
+    data = 'A=1\n# comment\nB="$A x"\nexport C=${B}y\nD=2\n'
+
+    def test_parse(self):
+        inc = IncrementalBashDict(self.data)
+        assert inc.env == read_bash_dict(StringIO(self.data))
+        assert [self.data[x.start : x.end] for x in inc.assignments] == [
+            "A=1",
+            'B="$A x"',
+            "export C=${B}y",
+            "D=2",
+        ]
+        assert [x.deps for x in inc.assignments] == [
+            {},
+            {"A": "1"},
+            {"B": "1 x"},
+            {},
+        ]
+
+    def test_update(self):
+        inc = IncrementalBashDict(self.data)
+        old = inc.assignments
+        # dependents of a change are reevaluated, the rest is shifted
+        data = self.data.replace("A=1", "A=123")
+        assert [x.key for x in inc.update(data)] == ["A", "B", "C"]
+        assert inc.env == read_bash_dict(StringIO(data))
+        assert inc.assignments[-1] == old[-1]._replace(
+            start=old[-1].start + 2, end=old[-1].end + 2
+        )
+        assert inc.assignments == IncrementalBashDict(data).assignments
+
+        # edits not affecting later values reevaluate nothing beyond
+        data = data.replace("comment", "longer comment")
+        assert inc.update(data) == [BashAssignment("A", "123", 0, 5, {})]
+        assert inc.update(data) == []
+        data = data.replace("D=2", "D=3\nE=$D")
+        assert [x.key for x in inc.update(data)] == ["D", "E"]
+        assert inc.env == read_bash_dict(StringIO(data))
+        assert inc.assignments == IncrementalBashDict(data).assignments
+
+    def test_update_reassigned(self):
+        data = "A=1\nB=$A\nA=2\nC=$A\n"
+        inc = IncrementalBashDict(data)
+        # A differs until reassigned, after which C is unaffected
+        data = data.replace("A=1", "A=0")
+        assert [x.key for x in inc.update(data)] == ["A", "B"]
+        assert inc.env == {"A": "2", "B": "0", "C": "2"}
+
+    def test_vars_dict(self):
+        vars_dict = {"X": "x", "Y": "y"}
+        inc = IncrementalBashDict("A=$X\nB=$Y\n", vars_dict)
+        assert inc.env == {"A": "x", "B": "y"}
+        inc.update("X=z\nA=$X\nB=$Y\n")
+        assert inc.env == {"X": "z", "A": "z", "B": "y"}
+        assert vars_dict == {"X": "x", "Y": "y"}
+
+    @pytest.mark.parametrize("data", ("A=\\x\n", "X=B\n${X}=1\n"))
+    def test_untracked(self, data):
+        inc = IncrementalBashDict(data)
+        assert inc.assignments is None
+        assert inc.env == read_bash_dict(StringIO(data))
+        # positions are tracked again once supported
+        assert inc.update("A=1\n") == [BashAssignment("A", "1", 0, 3, {})]
+        assert inc.update(data) is None
+        assert inc.env == read_bash_dict(StringIO(data))
+
+    def test_parse_error(self):
+        inc = IncrementalBashDict(self.data)
+        with pytest.raises(BashParseError):
+            inc.update(self.data + 'E="\n')
+        assert inc.data == self.data
+        assert inc.env == read_bash_dict(StringIO(self.data))
+        assert len(inc.assignments) == 4
+
+
+class TestBenchBash:
+    def run(self, *args):
+        from snakeoil.formatters import PlainTextFormatter
+        from snakeoil.tools.bench_bash import parser
+
+        stream = io.BytesIO()
+        out = PlainTextFormatter(stream)
+        options = parser.parse_args(["-n", "50", "-i", "1", *args])
+        assert options.main_func(options, out, out) == 0
+        return [x.split("\t") for x in stream.getvalue().decode().splitlines()]
+
+    def test_modes(self, tmp_path):
+        from snakeoil.tools.bench_bash import modes
+
+        baseline = tmp_path / "baseline.json"
+        lines = self.run("--save", str(baseline))
+        assert lines[0] == ["mode", "corpus", "lines/sec", "peak KiB"]
+        assert [x[:2] for x in lines[1:]] == [[k, v[0]] for k, v in modes.items()]
+        assert set(json.loads(baseline.read_text())["results"]) == set(modes)
+
+        lines = self.run("-m", "read_dict", "--baseline", str(baseline))
+        assert lines[0][-1] == "vs baseline"
+        assert len(lines) == 2 and lines[1][-1].endswith("x")
+
+    @pytest.mark.parametrize("corpus", ("make.conf", "env", "dict"))
+    def test_corpora_parse(self, tmp_path, corpus):
+        from snakeoil.tools.bench_bash import corpora
+
+        path = tmp_path / corpus
+        lines = corpora[corpus](random.Random(0), 200)
+        path.write_text("\n".join(lines) + "\n")
+        func = bash.read_dict if corpus == "dict" else bash.read_bash_dict
+        assert len(func(str(path))) > 50
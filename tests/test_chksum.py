@@ -1,8 +1,9 @@
+import os
 import pickle
 
 import pytest
 
-from snakeoil import chksum
+from snakeoil import chksum, osutils
 
 
 class Test_funcs:
@@ -52,3 +53,12 @@ class TestLazilyHashedPath:
         obj = chksum.LazilyHashedPath("/dev/null", size=0, md5="deadbeef")
         new = pickle.loads(pickle.dumps(obj))
         assert (new.path, new.size, new.md5) == ("/dev/null", 0, "deadbeef")
+
+    def test_mtime_stat_cache(self, tmp_path):
+        path = tmp_path / "file"
+        path.touch()
+        with osutils.StatCache() as cache:
+            osutils.stat_mtime_long(path)
+            obj = chksum.LazilyHashedPath(str(path))
+            assert obj.mtime == int(os.stat(path).st_mtime)
+            assert cache.cache_info().hits == 1
@@ -1,3 +1,4 @@
+import os
 from functools import partial
 
 import pytest
@@ -80,6 +81,34 @@ class TestDataSource:
 
         self.assertContents(reader, writer)
 
+    def test_iter_chunks(self):
+        data = self._mk_data()
+        obj = self.get_obj(data=data)
+        chunks = [bytes(x) for x in obj.iter_chunks(4096)]
+        assert all(len(x) <= 4096 for x in chunks)
+        assert len(chunks) == -(-len(data) // 4096)
+        assert b"".join(chunks) == data.encode()
+        assert b"".join(map(bytes, obj.iter_chunks())) == data.encode()
+        with pytest.raises(ValueError):
+            list(obj.iter_chunks(0))
+
+    def test_iter_chunks_empty(self):
+        obj = self.get_obj(data="")
+        assert list(obj.iter_chunks()) == []
+        assert list(obj.iter_buffers()) == []
+
+    def test_iter_chunks_partial(self):
+        data = self._mk_data()
+        obj = self.get_obj(data=data)
+        chunks = obj.iter_chunks(16)
+        assert bytes(next(chunks)) == data.encode()[:16]
+        chunks.close()
+
+    def test_iter_buffers(self):
+        data = self._mk_data()
+        obj = self.get_obj(data=data)
+        assert b"".join(bytes(x) for x in obj.iter_buffers()) == data.encode()
+
     def test_transfer_data_between_files(self):
         data = self._mk_data()
         reader = self.get_obj(data=data)
@@ -114,6 +143,18 @@ class TestLocalSource(TestDataSource):
         with obj.bytes_fileobj() as f:
             assert f.read() == data
 
+    @pytest.mark.parametrize("path", ("/proc/cpuinfo", "/proc/self/status"))
+    def test_iter_chunks_broken_stats(self, path):
+        # pseudo filesystems report a zero size for files with content
+        if not os.path.exists(path):
+            pytest.skip(f"{path} doesn't exist")
+        obj = data_source.local_source(path)
+        with obj.bytes_fileobj() as f:
+            data = f.read()
+        assert data
+        assert b"".join(map(bytes, obj.iter_chunks(64)))[:64] == data[:64]
+        assert b"".join(map(bytes, obj.iter_buffers()))[:64] == data[:64]
+
     def test_bytes_fileobj_create(self):
         data = b"foonani\xf2"
         obj = self.get_obj(test_creation=True, mutable=True)
@@ -142,6 +183,15 @@ class TestBz2Source(TestDataSource):
         with obj.bytes_fileobj() as f:
             assert f.read() == data
 
+    def test_spilled_write(self):
+        data = b"0123456789" * (data_source.bytes_wr_spooled.max_size // 5)
+        obj = self.get_obj(data=b"", mutable=True)
+        with obj.bytes_fileobj(True) as f:
+            f.write(data)
+            assert f.spilled
+        with obj.bytes_fileobj() as f:
+            assert f.read() == data
+
 
 class Test_invokable_data_source(TestDataSource):
     supports_mutable = False
@@ -179,3 +229,165 @@ class Test_invokable_data_source_wrapper_text(Test_invokable_data_source):
 
 class Test_invokable_data_source_wrapper_bytes(Test_invokable_data_source_wrapper_text):
     text_mode = False
+
+
+class Test_cached_invokable_data_source(Test_invokable_data_source_wrapper_bytes):
+    def get_obj(self, mutable=False, data="foonani", **kwds):
+        self.calls = 0
+        return data_source.cached_invokable_data_source.wrap_function(
+            partial(self._get_data, data), self.text_mode, **kwds
+        )
+
+    def _get_data(self, data="foonani"):
+        self.calls += 1
+        return super()._get_data(data)
+
+    def test_caching(self):
+        obj = self.get_obj()
+        for _ in range(3):
+            with obj.bytes_fileobj() as f:
+                assert f.read() == b"foonani"
+            with obj.text_fileobj() as f:
+                assert f.read() == "foonani"
+        assert self.calls == 1
+        assert obj.cache_info() == (5, 1, 0)
+
+        obj.invalidate()
+        with obj.text_fileobj() as f:
+            assert f.read() == "foonani"
+        assert self.calls == 2
+        assert obj.cache_info() == (5, 2, 1)
+
+    def test_key_func(self):
+        key = [0]
+        obj = self.get_obj(key_func=lambda: key[0])
+        assert b"".join(obj.iter_chunks()) == b"foonani"
+        assert b"".join(obj.iter_chunks()) == b"foonani"
+        assert self.calls == 1
+        key[0] += 1
+        assert b"".join(obj.iter_chunks()) == b"foonani"
+        assert self.calls == 2
+        assert obj.cache_info() == (1, 2, 1)
+
+    def test_encoding_hint(self):
+        obj = data_source.cached_invokable_data_source.wrap_function(
+            lambda: "foö", encoding_hint="latin1"
+        )
+        assert obj.encoding == "latin1"
+        with obj.bytes_fileobj() as f:
+            assert f.read() == "foö".encode("latin1")
+        with obj.text_fileobj() as f:
+            assert f.read() == "foö"
+        # an explicit encoding wins
+        obj = data_source.cached_invokable_data_source.wrap_function(
+            lambda: "foo", encoding_hint="latin1", encoding="ascii"
+        )
+        assert obj.encoding == "ascii"
+
+    def test_stat_path(self, tmp_path):
+        path = tmp_path / "file"
+        obj = data_source.cached_invokable_data_source.wrap_function(
+            path.read_bytes, False, stat_path=path
+        )
+        path.write_bytes(b"foo")
+        with obj.bytes_fileobj() as f:
+            assert f.read() == b"foo"
+        path.write_bytes(b"blah")
+        with obj.text_fileobj() as f:
+            assert f.read() == "blah"
+        assert obj.cache_info().invalidations == 1
+
+        with pytest.raises(TypeError):
+            data_source.cached_invokable_data_source(
+                path.read_bytes, key_func=len, stat_path=path
+            )
+
+
+class TestWrSpooled:
+    def test_callback_required(self):
+        with pytest.raises(TypeError):
+            data_source.bytes_wr_spooled(None)
+
+    @pytest.mark.parametrize(
+        ("kls", "converter"),
+        (
+            (data_source.text_wr_spooled, str),
+            (data_source.bytes_wr_spooled, str.encode),
+        ),
+    )
+    def test_callback(self, kls, converter):
+        results = []
+
+        def callback(f):
+            results.append((f.read(), f.closed))
+
+        with kls(callback, converter("foonani")) as f:
+            assert f.read() == converter("foonani")
+            f.seek(0)
+            f.write(converter("dar"))
+            assert not f.spilled
+        assert results == [(converter("darnani"), False)]
+        assert f.closed
+        # closing again doesn't reinvoke the callback
+        f.close()
+        assert len(results) == 1
+
+    def test_spill(self):
+        data = b"x" * 1000
+        results = []
+
+        def callback(f):
+            assert f.fileno() >= 0
+            results.append(f.read())
+
+        with data_source.bytes_wr_spooled(callback, max_size=100) as f:
+            f.write(data[:50])
+            assert not f.spilled
+            f.write(data[50:])
+            assert f.spilled
+        assert results == [data]
+
+    def test_spill_text(self):
+        data = "foö\r\n" * 1000
+        results = []
+
+        def callback(f):
+            results.append(f.read())
+
+        with data_source.text_wr_spooled(callback, max_size=100) as f:
+            f.write(data)
+            assert f.spilled
+        assert results == [data]
+
+
+class TestPrefetch:
+    def test_window(self):
+        with pytest.raises(ValueError):
+            list(data_source.prefetch([], window=0))
+
+    @pytest.mark.parametrize("readahead", (False, True))
+    def test_order(self, tmp_path, readahead):
+        sources = []
+        for x in range(20):
+            path = tmp_path / str(x)
+            path.write_text(str(x))
+            sources.append(data_source.local_source(path))
+            sources.append(data_source.data_source(str(x)))
+        # missing files are left for the consumer to deal with
+        sources.append(data_source.local_source(tmp_path / "missing"))
+        results = list(data_source.prefetch(sources, window=3, readahead=readahead))
+        assert results == sources
+
+    def test_lazy(self):
+        consumed = []
+
+        def gen():
+            for x in range(10):
+                consumed.append(x)
+                yield data_source.data_source(str(x))
+
+        it = data_source.prefetch(gen(), window=3)
+        assert next(it).data == "0"
+        assert consumed == [0, 1, 2, 3]
+        it.close()
+        assert consumed == [0, 1, 2, 3]
@@ -2,13 +2,16 @@ import errno
 import gc
 import mmap
 import os
+import sys
 import time
+from functools import partial
 from unittest import mock
 
 import pytest
 
 from snakeoil import _fileutils, fileutils
 from snakeoil.fileutils import AtomicWriteFile
+from snakeoil.osutils.watch import Watcher
 from snakeoil.test import random_str
 
 
@@ -111,6 +114,75 @@ class TestAtomicWriteFile:
         af.close()
 
 
+class TestDurableAtomicWriteFile(TestAtomicWriteFile):
+    kls = staticmethod(partial(AtomicWriteFile, durable=True))
+
+    def test_no_tempfile(self, tmp_path):
+        (fp := tmp_path / "target").write_text("me")
+        af = self.kls(fp)
+        af.write("dar")
+        if af._anonymous:
+            assert os.listdir(tmp_path) == ["target"]
+        with mock.patch("os.fdatasync") as fdatasync, mock.patch("os.fsync") as fsync:
+            af.close()
+        fdatasync.assert_called_once()
+        fsync.assert_called_once()
+        assert fileutils.readfile_ascii(fp) == "dar"
+        assert os.listdir(tmp_path) == ["target"]
+
+    def test_new_target(self, tmp_path):
+        fp = tmp_path / "target"
+        with self.kls(fp, binary=True, perms=0o600) as af:
+            af.write(b"dar")
+        assert fileutils.readfile_bytes(fp) == b"dar"
+        assert os.stat(fp).st_mode & 0o4777 == 0o600
+        assert os.listdir(tmp_path) == ["target"]
+
+
+class TestAtomicWriteTransaction:
+    def test_commit(self, tmp_path):
+        (tmp_path / "sub").mkdir()
+        paths = [tmp_path / str(x) for x in range(5)]
+        paths += [tmp_path / "sub" / str(x) for x in range(5)]
+        paths[0].write_text("me")
+        with mock.patch("os.fsync", wraps=os.fsync) as fsync:
+            with fileutils.AtomicWriteTransaction() as t:
+                for path in paths:
+                    with t.open(path) as f:
+                        f.write(path.name)
+                    assert f._is_finalized is False
+                assert fileutils.readfile_ascii(paths[0]) == "me"
+                assert not paths[1].exists()
+        # one sync per parent directory
+        assert fsync.call_count == 2
+        for path in paths:
+            assert fileutils.readfile_ascii(path) == path.name
+        assert sorted(os.listdir(tmp_path)) == sorted(
+            ["sub"] + [str(x) for x in range(5)]
+        )
+
+    def test_discard(self, tmp_path):
+        (fp := tmp_path / "target").write_text("me")
+        with pytest.raises(RuntimeError):
+            with fileutils.AtomicWriteTransaction() as t:
+                f = t.open(fp)
+                f.write("dar")
+                discarded = t.open(tmp_path / "discarded")
+                discarded.discard()
+                raise RuntimeError()
+        assert fileutils.readfile_ascii(fp) == "me"
+        assert os.listdir(tmp_path) == ["target"]
+
+    def test_discarded_file(self, tmp_path):
+        t = fileutils.AtomicWriteTransaction(durable=False)
+        with t.open(tmp_path / "kept") as f:
+            f.write("kept")
+        f = t.open(tmp_path / "discarded")
+        f.discard()
+        t.commit()
+        assert os.listdir(tmp_path) == ["kept"]
+
+
 class Test_readfile:
     func = staticmethod(fileutils.readfile)
 
@@ -228,8 +300,26 @@ class readlines_mixin:
             expected = tuple(x.encode("ascii") for x in expected)
         assert results == expected
 
-
-def mk_readlines_test(scope, mode):
+    @pytest.mark.parametrize("strip", (True, False))
+    def test_batched(self, tmp_path, strip):
+        fp = tmp_path / "data"
+        data = "".join(
+            f" line{x} \n" if x % 3 else f"line{x}\r\n" for x in range(100000)
+        )
+        fp.write_bytes(self.convert_data(data + " tail ", "ascii"))
+        expected = list(self.func(fp, strip))
+        lines = self.func(fp, strip, batched=True)
+        assert lines.mtime == os.stat(fp).st_mtime
+        batches = list(lines)
+        assert all(isinstance(x, list) for x in batches)
+        assert [x for batch in batches for x in batch] == expected
+
+        fp.write_bytes(b"")
+        assert not list(self.func(fp, strip, batched=True))
+        assert not list(self.func(tmp_path / "missing", strip, True, batched=True))
+
+
+def mk_readlines_test(mode):
     func_name = "readlines_%s" % mode
     base = globals()["Test_readfile_%s" % mode]
 
@@ -238,12 +328,170 @@ def mk_readlines_test(scope, mode):
         encoding_mode = mode
 
     kls.__name__ = "Test_%s" % func_name
-    scope["Test_%s" % func_name] = kls
+    return kls
 
 
-for case in ("ascii", "utf8"):
-    name = "readlines_%s" % case
-    mk_readlines_test(locals(), case)
+Test_readlines_ascii = mk_readlines_test("ascii")
+Test_readlines_utf8 = mk_readlines_test("utf8")
+
+
+class TestFileCacheReadfile(Test_readfile_utf8):
+    func = staticmethod(fileutils.FileCache().readfile_utf8)
+
+
+class TestFileCacheReadfileAscii(Test_readfile_ascii):
+    func = staticmethod(fileutils.FileCache().readfile_ascii)
+
+
+class TestFileCacheReadlines(Test_readlines_utf8):
+    func = staticmethod(fileutils.FileCache().readlines_utf8)
+
+
+class TestFileCache:
+    def test_caching(self, tmp_path):
+        (fp := tmp_path / "file").write_text("foo\nbar\n")
+        cache = fileutils.FileCache()
+        with mock.patch("builtins.open", wraps=open) as opener:
+            for _ in range(3):
+                assert cache.readfile_utf8(fp) == "foo\nbar\n"
+                assert cache.readfile_bytes(fp) == b"foo\nbar\n"
+                lines = cache.readlines_utf8(fp)
+                assert lines.mtime == os.stat(fp).st_mtime
+                assert list(lines) == ["foo", "bar"]
+                assert list(cache.readlines_utf8(fp, False)) == ["foo\n", "bar\n"]
+        assert opener.call_count == 4
+
+        fp.write_text("foo\n")
+        assert cache.readfile_utf8(fp) == "foo\n"
+        assert list(cache.readlines_utf8(fp)) == ["foo"]
+
+        fp.unlink()
+        with pytest.raises(FileNotFoundError):
+            cache.readfile_utf8(fp)
+        assert cache.readfile_utf8(fp, True) is None
+
+    def test_max_bytes(self, tmp_path):
+        cache = fileutils.FileCache(max_bytes=10)
+        paths = []
+        for x in range(3):
+            (fp := tmp_path / str(x)).write_text("1234")
+            paths.append(fp)
+        cache.readfile(paths[0])
+        cache.readfile(paths[1])
+        # refresh 0, thus 1 is the least recently used
+        cache.readfile(paths[0])
+        cache.readfile(paths[2])
+        assert {x[0] for x in cache._entries} == {str(paths[0]), str(paths[2])}
+        assert cache._size == 8
+
+        # larger than the budget isn't cached at all
+        (big := tmp_path / "big").write_text("x" * 11)
+        assert cache.readfile(big) == "x" * 11
+        assert cache._size == 8
+
+    def test_trust_ms(self, tmp_path):
+        (fp := tmp_path / "file").write_text("foo")
+        cache = fileutils.FileCache(trust_ms=60 * 1000)
+        assert cache.readfile(fp) == "foo"
+        fp.write_text("blah")
+        with mock.patch("os.stat") as stat:
+            assert cache.readfile(fp) == "foo"
+        stat.assert_not_called()
+        cache.invalidate(fp)
+        assert cache.readfile(fp) == "blah"
+        cache.clear()
+        assert cache._size == 0
+        assert not cache._entries
+
+    @pytest.mark.skipif(
+        not sys.platform.startswith("linux"), reason="supported on Linux only"
+    )
+    def test_watcher(self, tmp_path):
+        (fp := tmp_path / "file").write_text("foo")
+        with Watcher() as watcher:
+            cache = fileutils.FileCache(watcher=watcher)
+            assert cache.readfile(fp) == "foo"
+            with mock.patch("os.stat") as stat:
+                assert cache.readfile(fp) == "foo"
+            stat.assert_not_called()
+            stamp = cache._entries[(str(fp), "readfile", "r", "utf8")][4]
+            fp.write_text("blah")
+            deadline = time.monotonic() + 5
+            while stamp.valid and time.monotonic() < deadline:
+                time.sleep(0.01)
+            assert cache.readfile(fp) == "blah"
+
+    @pytest.mark.skipif(
+        not sys.platform.startswith("linux"), reason="supported on Linux only"
+    )
+    def test_watcher_release(self, tmp_path):
+        paths = []
+        for x in range(3):
+            (fp := tmp_path / str(x)).write_text("1234")
+            paths.append(fp)
+        with Watcher() as watcher:
+            cache = fileutils.FileCache(max_bytes=10, watcher=watcher)
+            for fp in paths:
+                cache.readfile(fp)
+            # the first entry was evicted, thus its stamp released
+            assert len(cache._entries) == 2
+            assert len(watcher._stamps) == 2
+            cache.invalidate(paths[1])
+            assert len(watcher._stamps) == 1
+            assert cache.readfile(tmp_path / "missing", True) is None
+            assert len(watcher._stamps) == 1
+            cache.clear()
+            assert not watcher._stamps
+            assert not watcher._dirs
+
+
+class TestIterLineBatches:
+    data = "a\r\nb \rc\n\n\x0bd\u2028e\r\r\n\u00e9\u20ac\r"
+
+    @pytest.mark.parametrize("chunk_size", (1, 2, 3, 7, 1024))
+    @pytest.mark.parametrize("strip", (True, False))
+    @pytest.mark.parametrize("mode", ("r", "rb"))
+    def test_chunk_boundaries(self, tmp_path, chunk_size, strip, mode):
+        fp = tmp_path / "data"
+        fp.write_bytes(self.data.encode("utf8"))
+        encoding = None if "b" in mode else "utf8"
+        expected = list(_fileutils.native_readlines(mode, fp, strip, encoding=encoding))
+        with open(fp, mode, encoding=encoding) as f:
+            batches = _fileutils._iter_line_batches(f, strip, chunk_size)
+            assert [x for batch in batches for x in batch] == expected
+
+
+class TestReadfiles:
+    @pytest.fixture
+    def paths(self, tmp_path):
+        paths = []
+        for x in range(100):
+            (fp := tmp_path / str(x)).write_text(f"{x}\u00e9")
+            paths.append(fp)
+        return paths
+
+    def test_ordered(self, paths):
+        results = list(fileutils.readfiles(paths, workers=4))
+        assert results == [(x, f"{x.name}\u00e9") for x in paths]
+
+    def test_unordered(self, paths):
+        results = list(fileutils.readfiles(iter(paths), ordered=False))
+        assert sorted(results) == sorted((x, f"{x.name}\u00e9") for x in paths)
+
+    def test_bytes(self, paths):
+        results = dict(fileutils.readfiles(paths, "rb"))
+        assert results[paths[0]] == "0\u00e9".encode()
+
+    @pytest.mark.parametrize("ordered", (True, False))
+    def test_missing(self, paths, tmp_path, ordered):
+        paths.append(missing := tmp_path / "missing")
+        with pytest.raises(FileNotFoundError):
+            list(fileutils.readfiles(paths, ordered=ordered))
+        results = dict(
+            fileutils.readfiles(paths, none_on_missing=True, ordered=ordered)
+        )
+        assert results[missing] is None
+        assert len(results) == len(paths)
 
 
 class TestBrokenStats:
@@ -1,5 +1,7 @@
+import copy
 import operator
-from itertools import chain
+import pickle
+from itertools import chain, count
 
 import pytest
 
@@ -289,6 +291,63 @@ class TestImmutableDict:
 
         assert initial_hash == hash(d)
 
+    def test_hash(self):
+        d = mappings.ImmutableDict({1: -1, "a": None, (2,): "b"})
+        # unorderable keys are supported and order doesn't matter
+        assert hash(d) == hash(mappings.ImmutableDict(list(d.items())[::-1]))
+        assert hash(d) != hash(mappings.ImmutableDict({1: -1}))
+        assert {d: 1}[mappings.ImmutableDict(d)] == 1
+        with pytest.raises(TypeError):
+            hash(mappings.ImmutableDict({1: []}))
+
+    def test_hash_cached(self):
+        class Key:
+            calls = 0
+
+            def __hash__(self):
+                self.calls += 1
+                return 1
+
+        key = Key()
+        d = mappings.ImmutableDict({key: 1})
+        calls = key.calls
+        assert hash(d) == hash(d)
+        assert key.calls == calls + 1
+
+    def test_pickle(self):
+        d = mappings.ImmutableDict({1: -1, 2: -2})
+        hash(d)
+        e = pickle.loads(pickle.dumps(d))
+        assert e == d
+        assert e._hash is None
+        assert hash(e) == hash(d)
+
+    def test_from_shared_keys(self):
+        keys = ("b", "a", "c")
+        d = mappings.ImmutableDict.from_shared_keys(keys, (1, 2, 3))
+        e = mappings.ImmutableDict.from_shared_keys(list(keys), iter((4, 5, 6)))
+        assert isinstance(d, mappings.ImmutableDict)
+        assert d == {"b": 1, "a": 2, "c": 3}
+        assert list(d) == list(e) == list(keys)
+        assert list(reversed(d)) == ["c", "a", "b"]
+        assert list(e.values()) == [4, 5, 6]
+        assert len(d) == 3
+        assert "a" in d and "d" not in d
+        with pytest.raises(KeyError):
+            d["d"]
+        assert repr(d) == str(d) == repr({"b": 1, "a": 2, "c": 3})
+        # the key table is shared
+        assert d._dict._keys is e._dict._keys
+        assert hash(d) == hash(mappings.ImmutableDict(dict(d)))
+        assert mappings.ImmutableDict(d) == d
+        assert pickle.loads(pickle.dumps(d)) == d
+
+    def test_from_shared_keys_invalid(self):
+        with pytest.raises(ValueError):
+            mappings.ImmutableDict.from_shared_keys(("a", "b"), (1,))
+        with pytest.raises(ValueError):
+            mappings.ImmutableDict.from_shared_keys(("a", "a"), (1, 2))
+
 
 class TestOrderedFrozenSet:
     def test_magic_methods(self):
@@ -309,6 +368,25 @@ class TestOrderedFrozenSet:
         assert repr(s) == str(s)
         assert hash(s)
 
+    def test_index(self):
+        s = mappings.OrderedFrozenSet("setordered")
+        for i, x in enumerate("setord"):
+            assert s[i] == x
+            assert s.index(x) == i
+        # negative indexes count from the end
+        assert s[-1] == "d"
+        assert s[-6] == "s"
+        with pytest.raises(IndexError):
+            s[-7]
+        assert list(s[::-2]) == ["d", "o", "e"]
+        with pytest.raises(ValueError, match="'x' is not in set"):
+            s.index("x")
+
+    def test_hash(self):
+        assert hash(mappings.OrderedFrozenSet("set")) == hash(
+            mappings.OrderedFrozenSet("tes")
+        )
+
     def test_ordering(self):
         s = mappings.OrderedFrozenSet("set")
         assert "set" == "".join(s)
@@ -402,6 +480,73 @@ class TestOrderedSet(TestOrderedFrozenSet):
         s.update(range(9))
         assert len(s) == 9
 
+    def test_index_mutations(self):
+        s = mappings.OrderedSet(range(10))
+        assert s[5] == 5
+        s.update([11, 3, 10])
+        s.add(12)
+        assert s.index(12) == 12
+        s.discard(0)
+        s.remove(12)
+        assert list(s) == [1, 2, 3, 4, 5, 6, 7, 8, 9, 11, 10]
+        assert [s[i] for i in range(len(s))] == list(s)
+        assert [s.index(x) for x in s] == list(range(11))
+        assert list(s[2:5]) == [3, 4, 5]
+        with pytest.raises(KeyError):
+            s.remove(0)
+        with pytest.raises(ValueError):
+            s.index(0)
+        # removing most of the elements
+        for x in range(1, 10):
+            s.discard(x)
+        assert list(s) == [11, 10]
+        assert s[1] == 10
+        assert s.index(11) == 0
+        s.clear()
+        s.add("a")
+        assert s[0] == "a"
+
+    def test_remove_last(self):
+        s = mappings.OrderedSet(range(5))
+        assert s[4] == 4
+        s.remove(4)
+        s.discard(3)
+        # the array is kept up to date rather than rebuilt
+        assert s._items == [0, 1, 2]
+        assert s[-1] == 2
+
+    def test_remove_index(self):
+        s = mappings.OrderedSet(range(100))
+        ref = list(s)
+        added = count(100)
+        while s:
+            assert s[0] == ref[0]
+            assert s[len(s) // 2] == ref[len(ref) // 2]
+            assert s.index(ref[-1]) == len(ref) - 1
+            s.remove(s[0])
+            del ref[0]
+            if len(s) % 3 == 0 and (value := next(added)) < 130:
+                # additions past tombstones stay addressable
+                s.add(value)
+                ref.append(value)
+            # tombstones are compacted once they outnumber elements
+            assert len(s._items) <= 2 * len(s) + 1
+            assert list(s[1:3]) == ref[1:3]
+            if s:
+                assert s[-1] == ref[-1]
+        with pytest.raises(IndexError):
+            s[0]
+
+    def test_copy(self):
+        s = mappings.OrderedSet(range(5))
+        assert s[0] == 0
+        s.remove(2)
+        for other in (copy.copy(s), pickle.loads(pickle.dumps(s))):
+            assert list(other) == [0, 1, 3, 4]
+            assert other[2] == 3
+            other.add(5)
+            assert 5 not in s
+
 
 class TestStackedDict:
     orig_dict = dict.fromkeys(range(100))
@@ -453,6 +598,44 @@ class TestStackedDict:
         )
 
 
+class TestCachedStackedDict:
+    def test_precedence(self):
+        first, second = {1: "a", 2: "b"}, {2: "c", 3: "d"}
+        std = mappings.CachedStackedDict(first, second)
+        assert std[2] == "b"
+        assert list(std) == list(mappings.StackedDict(first, second)) == [1, 2, 3]
+        assert list(std.items()) == [(1, "a"), (2, "b"), (3, "d")]
+        assert list(std.values()) == ["a", "b", "d"]
+        assert len(std) == 3
+        assert 3 in std and 4 not in std
+        with pytest.raises(KeyError):
+            std[4]
+        assert std.get(4) is None
+
+    def test_invalidate(self):
+        first, second = {1: "a"}, {1: "b", 2: "c"}
+        std = mappings.CachedStackedDict(first, second)
+        assert std[1] == "a"
+        # value changes are visible as is, while key changes need invalidation
+        first[1] = "x"
+        assert std[1] == "x"
+        del first[1]
+        second[3] = "d"
+        assert 3 not in std and len(std) == 2
+        std.invalidate()
+        assert std[1] == "b"
+        assert std[3] == "d"
+        assert len(std) == 3
+
+    def test_immutable(self):
+        std = mappings.CachedStackedDict({1: 2})
+        for func in (std.__setitem__, std.__delitem__):
+            with pytest.raises(TypeError):
+                func(1, 2)
+        with pytest.raises(TypeError):
+            std.clear()
+
+
 class TestIndeterminantDict:
     def test_disabled_methods(self):
         d = mappings.IndeterminantDict(lambda *a: None)
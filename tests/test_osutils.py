@@ -1,18 +1,30 @@
 # -*- coding: utf-8 -*-
 
 import errno
+import gc
 import grp
+import io
 import os
 import stat
 import sys
+import threading
+import time
+import weakref
 from unittest import mock
 
 import pytest
 
 from snakeoil import osutils
 from snakeoil._internals import deprecated
-from snakeoil.osutils import listdir_dirs, listdir_files, sizeof_fmt, supported_systems
+from snakeoil.osutils import (
+    listdir_dirs,
+    listdir_files,
+    sizeof_fmt,
+    supported_systems,
+    syscalls,
+)
 from snakeoil.osutils.mount import MS_BIND, mount, umount
+from snakeoil.osutils.watch import Watcher
 
 
 class ReaddirCommon:
@@ -50,6 +62,24 @@ class TestNativeListDir(ReaddirCommon):
         (tmp_path / "monkeys").symlink_to("foon")
         assert listdir_files(tmp_path) == ["file"]
 
+    def test_symlinks(self, tmp_path, subdir):
+        (tmp_path / "dirlink").symlink_to("dir")
+        (tmp_path / "filelink").symlink_to("file")
+        assert sorted(listdir_dirs(tmp_path)) == ["dir", "dirlink"]
+        assert sorted(listdir_files(tmp_path)) == ["file", "filelink"]
+        assert listdir_dirs(tmp_path, followSymlinks=False) == ["dir"]
+        assert listdir_files(tmp_path, followSymlinks=False) == ["file"]
+
+    def test_scandir(self, tmp_path, subdir):
+        (tmp_path / "dirlink").symlink_to("dir")
+        entries = osutils.scandir_dirs(tmp_path)
+        assert all(isinstance(x, os.DirEntry) for x in entries)
+        assert sorted(x.name for x in entries) == ["dir", "dirlink"]
+        assert [x.name for x in osutils.scandir_dirs(tmp_path, False)] == ["dir"]
+        (entry,) = osutils.scandir_files(tmp_path)
+        assert entry.path == str(tmp_path / "file")
+        assert entry.stat().st_ino == (tmp_path / "file").stat().st_ino
+
 
 class TestEnsureDirs:
     def check_dir(self, path, uid, gid, mode):
@@ -177,6 +207,55 @@ class TestEnsureDirs:
         assert osutils.ensure_dirs(path, gid=os.getegid())
         self.check_dir(path, os.geteuid(), os.getegid(), 0o777)
 
+    def test_ensure_dirs_many(self, tmp_path):
+        paths = [
+            tmp_path / "foo" / "bar",
+            tmp_path / "foo",
+            tmp_path / "foo" / "bar" / "baz",
+            str(tmp_path / "foo" / ".." / "foo" / "blah"),
+            tmp_path / "foo" / "bar",
+        ]
+        with (
+            mock.patch("snakeoil.osutils.os.stat", wraps=os.stat) as stat_mock,
+            mock.patch("snakeoil.osutils.os.mkdir", wraps=os.mkdir) as mkdir_mock,
+        ):
+            assert osutils.ensure_dirs_many(paths, mode=0o750)
+        for path in ("foo", "foo/bar", "foo/bar/baz", "foo/blah"):
+            self.check_dir(tmp_path / path, os.geteuid(), os.getegid(), 0o750)
+        # each missing component is created once, and preexisting parents
+        # are only stat'd once
+        assert mkdir_mock.call_count == 4
+        stat_paths = [x.args[0] for x in stat_mock.call_args_list]
+        assert stat_paths.count(str(tmp_path)) == 1
+
+        # permissions are enforced for existing dirs as well
+        assert osutils.ensure_dirs_many(paths[:1], mode=0o700, minimal=False)
+        self.check_dir(paths[0], os.geteuid(), os.getegid(), 0o700)
+
+    def test_ensure_dirs_many_failures(self, tmp_path):
+        (tmp_path / "file").touch()
+        paths = [tmp_path / "file" / "foo", tmp_path / "foo"]
+        assert not osutils.ensure_dirs_many(paths)
+        # failures don't stop the remaining paths from being created
+        assert (tmp_path / "foo").is_dir()
+
+    def test_ensure_dirs_many_cache(self, tmp_path):
+        path = tmp_path / "foo"
+        try:
+            assert osutils.ensure_dirs_many([path], cache=True)
+            path.rmdir()
+            assert osutils.ensure_dirs_many([path], cache=True)
+            assert not path.exists()
+            # different settings aren't cached
+            assert osutils.ensure_dirs_many([path], mode=0o755, cache=True)
+            assert path.is_dir()
+            path.rmdir()
+            osutils.ensure_dirs_many.cache_clear()
+            assert osutils.ensure_dirs_many([path], cache=True)
+            assert path.is_dir()
+        finally:
+            osutils.ensure_dirs_many.cache_clear()
+
 
 class TestAbsSymlink:
     @deprecated.suppress_deprecations()
@@ -303,12 +382,11 @@ class TestMount:
             (b"source", b"target", b"fstype"),
             ("source", "target", "fstype"),
         ):
-            with mock.patch("snakeoil.osutils.mount.ctypes") as mock_ctypes:
+            with mock.patch("snakeoil.osutils.syscalls.libc") as mock_libc:
+                mock_libc.return_value.mount.return_value = -1
                 with pytest.raises(OSError):
                     mount(str(source), str(target), fstype, MS_BIND)
-                mount_call = next(
-                    x for x in mock_ctypes.mock_calls if x[0] == "CDLL().mount"
-                )
+                mount_call = next(x for x in mock_libc.mock_calls if x[0] == "().mount")
                 for arg in mount_call[1][0:3]:
                     assert isinstance(arg, bytes)
 
@@ -333,6 +411,518 @@ class TestMount:
     def test_lazy_unmount(self): ...
 
 
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="supported on Linux only"
+)
+class TestSyscalls:
+    def test_libc(self):
+        assert syscalls.libc() is syscalls.libc()
+
+    def test_statx(self, tmp_path):
+        path = tmp_path / "file"
+        path.write_bytes(b"foo")
+        try:
+            result = syscalls.statx(path)
+        except OSError as e:
+            if e.errno != errno.ENOSYS:
+                raise
+            pytest.skip("statx unsupported")
+        st = os.stat(path)
+        assert result.stx_mask & syscalls.STATX_BASIC_STATS
+        assert (result.stx_ino, result.stx_size) == (st.st_ino, 3)
+        assert result.stx_mode == st.st_mode
+        assert result.stx_mtime.ns == st.st_mtime_ns
+        with open(path) as f:
+            assert syscalls.statx(f.fileno()).stx_ino == st.st_ino
+        (tmp_path / "link").symlink_to("file")
+        result = syscalls.statx(tmp_path / "link", follow_symlinks=False)
+        assert stat.S_ISLNK(result.stx_mode)
+        with pytest.raises(FileNotFoundError):
+            syscalls.statx(tmp_path / "missing")
+
+    def test_fallocate(self, tmp_path):
+        path = tmp_path / "file"
+        with open(path, "wb") as f:
+            try:
+                syscalls.fallocate(f.fileno(), 0, 4096)
+            except OSError as e:
+                if e.errno not in (errno.ENOSYS, errno.EOPNOTSUPP):
+                    raise
+                pytest.skip("fallocate unsupported")
+            assert os.fstat(f.fileno()).st_size == 4096
+            syscalls.fallocate(f.fileno(), 4096, 4096, syscalls.FALLOC_FL_KEEP_SIZE)
+            assert os.fstat(f.fileno()).st_size == 4096
+
+    def test_renameat2(self, tmp_path):
+        (src := tmp_path / "src").write_text("src")
+        (dst := tmp_path / "dst").write_text("dst")
+        try:
+            syscalls.renameat2(src, dst, syscalls.RENAME_EXCHANGE)
+        except OSError as e:
+            if e.errno not in (errno.ENOSYS, errno.EINVAL):
+                raise
+            pytest.skip("renameat2 unsupported")
+        assert (src.read_text(), dst.read_text()) == ("dst", "src")
+        with pytest.raises(FileExistsError):
+            syscalls.renameat2(src, dst, syscalls.RENAME_NOREPLACE)
+        dst.unlink()
+        syscalls.renameat2(src, dst, syscalls.RENAME_NOREPLACE)
+        assert not src.exists()
+        assert dst.read_text() == "dst"
+
+    def test_close_range(self):
+        fds = [os.open(os.devnull, os.O_RDONLY) for _ in range(3)]
+        fds.sort()
+        try:
+            syscalls.close_range(fds[0], fds[1])
+            for fd in fds[:2]:
+                with pytest.raises(OSError):
+                    os.fstat(fd)
+            os.fstat(fds[2])
+        finally:
+            for fd in fds:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+
+    def test_copy_file_range(self, tmp_path):
+        (src := tmp_path / "src").write_bytes(b"foonani")
+        with open(src, "rb") as fsrc, open(tmp_path / "dst", "wb") as fdst:
+            try:
+                copied = syscalls.copy_file_range(fsrc.fileno(), fdst.fileno(), 7)
+            except OSError as e:
+                if e.errno not in (errno.ENOSYS, errno.EXDEV, errno.EOPNOTSUPP):
+                    raise
+                pytest.skip("copy_file_range unsupported")
+        assert copied == 7
+        assert (tmp_path / "dst").read_bytes() == b"foonani"
+
+
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="supported on Linux only"
+)
+class TestWatcher:
+    @pytest.fixture
+    def watcher(self):
+        with Watcher() as watcher:
+            yield watcher
+
+    def test_stamp_modify(self, watcher, tmp_path):
+        (fp := tmp_path / "file").write_text("foo")
+        (other := tmp_path / "other").write_text("foo")
+        stamp = watcher.stamp(fp)
+        other_stamp = watcher.stamp(other)
+        assert stamp.valid and stamp
+        fp.write_text("bar")
+        assert wait_for(lambda: not stamp.valid)
+        assert other_stamp.valid
+
+    def test_stamp_replace(self, watcher, tmp_path):
+        (fp := tmp_path / "file").write_text("foo")
+        (new := tmp_path / "new").write_text("bar")
+        stamp = watcher.stamp(fp)
+        os.rename(new, fp)
+        assert wait_for(lambda: not stamp.valid)
+
+    def test_stamp_create(self, watcher, tmp_path):
+        stamp = watcher.stamp(fp := tmp_path / "file")
+        fp.touch()
+        assert wait_for(lambda: not stamp.valid)
+
+    def test_stamp_missing_dir(self, watcher, tmp_path):
+        with pytest.raises(OSError):
+            watcher.stamp(tmp_path / "missing" / "file")
+
+    def test_subscribe(self, watcher, tmp_path):
+        (subdir := tmp_path / "dir").mkdir()
+        events = []
+        handle = watcher.subscribe(subdir, events.append)
+        (subdir / "file").touch()
+        assert wait_for(lambda: str(subdir / "file") in events)
+        watcher.unsubscribe(handle)
+        # unsubscribing twice is fine
+        watcher.unsubscribe(handle)
+        events.clear()
+        (subdir / "file2").touch()
+        stamp = watcher.stamp(subdir / "file2")
+        (subdir / "file2").write_text("foo")
+        assert wait_for(lambda: not stamp.valid)
+        assert not events
+
+    def test_dir_removal(self, watcher, tmp_path):
+        (subdir := tmp_path / "dir").mkdir()
+        (subdir / "file").touch()
+        events = []
+        watcher.subscribe(subdir, events.append)
+        stamp = watcher.stamp(subdir / "file")
+        (subdir / "file").unlink()
+        subdir.rmdir()
+        assert wait_for(lambda: str(subdir) in events)
+        assert not stamp.valid
+
+    def test_release(self, watcher, tmp_path):
+        (subdir := tmp_path / "dir").mkdir()
+        stamps = [watcher.stamp(subdir / "file") for _ in range(2)]
+        watcher.stamp(tmp_path / "file")
+        watcher.release(stamps[0])
+        assert not stamps[0].valid
+        assert str(subdir) in watcher._dirs
+        watcher.release(stamps[1])
+        # releasing twice is fine
+        watcher.release(stamps[1])
+        assert str(subdir) not in watcher._dirs
+        assert str(tmp_path) in watcher._dirs
+
+    def test_fired_stamp_unwatched(self, watcher, tmp_path):
+        stamp = watcher.stamp(fp := tmp_path / "file")
+        fp.touch()
+        assert wait_for(lambda: not stamp.valid)
+        assert wait_for(lambda: not watcher._dirs)
+
+    def test_aliases(self, watcher, tmp_path):
+        (real := tmp_path / "real").mkdir()
+        (alias := tmp_path / "alias").symlink_to(real)
+        stamp = watcher.stamp(real / "file")
+        released = watcher.stamp(alias / "file")
+        alias_stamp = watcher.stamp(alias / "file")
+        assert len(watcher._wds) == 1
+        # the watch is shared, so releasing an alias must keep it.
+        watcher.release(released)
+        (real / "file").touch()
+        assert wait_for(lambda: not stamp.valid)
+        assert wait_for(lambda: not alias_stamp.valid)
+        assert wait_for(lambda: not watcher._wds)
+
+    def test_dir_moved(self, watcher, tmp_path):
+        (subdir := tmp_path / "dir").mkdir()
+        stamp = watcher.stamp(subdir)
+        subdir.rename(tmp_path / "moved")
+        assert wait_for(lambda: not stamp.valid)
+        assert not watcher._dirs
+        assert not watcher._wds
+        # the kernel keeps watching a moved directory unless told otherwise.
+        with open(f"/proc/self/fdinfo/{watcher._fd}") as f:
+            assert "inotify wd:" not in f.read()
+
+    def test_collected(self, tmp_path):
+        watcher = Watcher()
+        watcher.stamp(tmp_path)
+        thread = watcher._thread
+        ref = weakref.ref(watcher)
+        del watcher
+        gc.collect()
+        assert ref() is None
+        thread.join(5)
+        assert not thread.is_alive()
+
+    def test_close(self, tmp_path):
+        watcher = Watcher()
+        stamp = watcher.stamp(tmp_path)
+        watcher.close()
+        watcher.close()
+        assert not stamp.valid
+
+
+class TestWalkTree:
+    @pytest.fixture
+    def tree(self, tmp_path):
+        for d in ("a", "a/b", "a/b/c", "d", "d/e"):
+            (tmp_path / d).mkdir()
+        for f in ("f1", "a/f2", "a/b/f3", "a/b/c/f4", "d/f5"):
+            (tmp_path / f).write_text(f)
+        return tmp_path
+
+    @staticmethod
+    def relpaths(root, results):
+        return sorted(os.path.relpath(entry.path, root) for entry, _ in results)
+
+    def test_walk(self, tree):
+        expected = sorted(
+            os.path.relpath(os.path.join(dirpath, x), tree)
+            for dirpath, dirs, files in os.walk(tree)
+            for x in dirs + files
+        )
+        results = list(osutils.walk_tree(tree, workers=3))
+        assert self.relpaths(tree, results) == expected
+        for entry, st in results:
+            assert st == os.lstat(entry.path)
+
+    def test_filter_and_prune(self, tree):
+        results = osutils.walk_tree(
+            tree,
+            filter=lambda entry, st: stat.S_ISREG(st.st_mode),
+            prune=lambda entry, st: entry.name == "b",
+        )
+        assert self.relpaths(tree, results) == ["a/f2", "d/f5", "f1"]
+
+    def test_group(self, tree):
+        results = dict(osutils.walk_tree(tree, group=True))
+        assert sorted(os.path.relpath(x, tree) for x in results) == [
+            ".",
+            "a",
+            "a/b",
+            "a/b/c",
+            "d",
+            "d/e",
+        ]
+        assert results[str(tree / "d" / "e")] == []
+        assert sorted(x.name for x, _ in results[str(tree / "a")]) == ["b", "f2"]
+
+    def test_symlinks(self, tree):
+        (tree / "d" / "loop").symlink_to(tree)
+        (tree / "dangling").symlink_to("missing")
+        results = list(osutils.walk_tree(tree))
+        loop = next(st for entry, st in results if entry.name == "loop")
+        assert stat.S_ISLNK(loop.st_mode)
+        # the loop is detected, thus every real entry is only seen once.
+        results = self.relpaths(tree, osutils.walk_tree(tree, follow_symlinks=True))
+        assert len(results) == len(set(results))
+        assert "d/loop" in results
+        assert "d/loop/a" not in results
+        assert "dangling" in results
+
+    def test_errors(self, tmp_path):
+        errors = []
+        assert not list(osutils.walk_tree(tmp_path / "missing", onerror=errors.append))
+        assert isinstance(errors[0], FileNotFoundError)
+        assert not list(osutils.walk_tree(tmp_path / "missing", follow_symlinks=True))
+
+
+class TestStatCache:
+    def test_ttl(self):
+        with pytest.raises(ValueError):
+            osutils.StatCache(ttl=0)
+
+    def test_caching(self, tmp_path):
+        path = tmp_path / "file"
+        path.touch()
+        mtime = int(os.stat(path).st_mtime)
+        with osutils.StatCache() as cache:
+            assert osutils.stat_mtime_long(path) == mtime
+            os.utime(path, (mtime + 10, mtime + 10))
+            assert osutils.stat_mtime_long(path) == mtime
+            assert osutils.lstat_mtime_long(path) == mtime + 10
+            assert cache.cache_info() == (1, 2, 0)
+            assert cache.hit_rate == 1 / 3
+            cache.invalidate(path)
+            assert cache.cache_info().invalidations == 2
+            assert osutils.stat_mtime_long(path) == mtime + 10
+            cache.invalidate()
+            assert len(cache) == 0
+        # inactive outside of the context
+        os.utime(path, (mtime, mtime))
+        assert osutils.stat_mtime_long(path) == mtime
+        assert len(cache) == 0
+
+    def test_expiry(self, tmp_path):
+        path = tmp_path / "file"
+        path.touch()
+        with (
+            osutils.StatCache(ttl=60) as cache,
+            mock.patch("snakeoil.osutils.time.monotonic") as monotonic,
+        ):
+            monotonic.return_value = 0
+            cache.stat(path)
+            monotonic.return_value = 59
+            cache.stat(path)
+            monotonic.return_value = 60
+            cache.stat(path)
+            assert cache.cache_info() == (1, 2, 0)
+
+    def test_nesting(self, tmp_path):
+        with osutils.StatCache() as outer:
+            with osutils.StatCache() as inner:
+                osutils.stat_mtime_long(tmp_path)
+            osutils.stat_mtime_long(tmp_path)
+        assert inner.cache_info().misses == 1
+        assert outer.cache_info().misses == 1
+
+    def test_threads(self, tmp_path):
+        entered, exited = threading.Event(), threading.Event()
+        cache = osutils.StatCache()
+
+        def worker():
+            with cache:
+                entered.set()
+                exited.wait(5)
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        assert entered.wait(5)
+        # the cache entered by the other thread isn't active within this one
+        with osutils.StatCache() as local:
+            osutils.stat_mtime_long(tmp_path)
+            exited.set()
+            thread.join()
+            # nor does the other thread exiting affect the one active here
+            osutils.stat_mtime_long(tmp_path)
+        osutils.stat_mtime_long(tmp_path)
+        assert cache.cache_info().misses == 0
+        assert local.cache_info() == (1, 1, 0)
+
+    def test_missing(self, tmp_path):
+        with osutils.StatCache() as cache:
+            with pytest.raises(FileNotFoundError):
+                osutils.stat_mtime_long(tmp_path / "missing")
+            assert len(cache) == 0
+
+    def test_listdir(self, tmp_path):
+        (tmp_path / "dir").mkdir()
+        (tmp_path / "file").touch()
+        (tmp_path / "dirlink").symlink_to("dir")
+        (tmp_path / "filelink").symlink_to("file")
+        (tmp_path / "dangling").symlink_to("missing")
+        with osutils.StatCache() as cache:
+            assert sorted(listdir_dirs(tmp_path)) == ["dir", "dirlink"]
+            assert sorted(listdir_files(tmp_path)) == ["file", "filelink"]
+            assert listdir_dirs(tmp_path, followSymlinks=False) == ["dir"]
+            # resolved symlinks are reused by later stats
+            assert cache.cache_info().hits == 2
+            osutils.stat_mtime_long(tmp_path / "dirlink")
+            assert cache.cache_info().hits == 3
+
+    def test_listdir_symlink_loop(self, tmp_path):
+        (tmp_path / "loop").symlink_to("loop")
+        # only dangling symlinks are skipped, matching the uncached behavior
+        with pytest.raises(OSError):
+            listdir_dirs(tmp_path)
+        with osutils.StatCache(), pytest.raises(OSError):
+            listdir_dirs(tmp_path)
+
+    def test_ensure_dirs(self, tmp_path):
+        path = tmp_path / "dir"
+        path.mkdir(mode=0o700)
+        with osutils.StatCache() as cache:
+            assert osutils.ensure_dirs(path, mode=0o755, minimal=False)
+            assert stat.S_IMODE(cache.stat(path).st_mode) == 0o755
+            assert osutils.ensure_dirs(path / "sub")
+            assert cache.cache_info().hits == 1
+
+
+class TestDiskUsage:
+    @pytest.fixture
+    def tree(self, tmp_path):
+        (tmp_path / "a" / "b").mkdir(parents=True)
+        (tmp_path / "a" / "file").write_bytes(b"x" * 10)
+        (tmp_path / "a" / "b" / "file").write_bytes(b"x" * 100)
+        os.link(tmp_path / "a" / "file", tmp_path / "a" / "b" / "link")
+        (tmp_path / "c").mkdir()
+        (tmp_path / "c" / "file").write_bytes(b"x" * 1000)
+        return tmp_path
+
+    @staticmethod
+    def du(*paths):
+        return sum(os.lstat(x).st_size for x in paths)
+
+    def test_totals(self, tree):
+        usage = osutils.disk_usage([tree])
+        assert list(usage) == [str(tree)]
+        usage = usage[str(tree)]
+        assert usage.files == 4
+        assert usage.dirs == 4
+        # the hardlink is only counted once
+        assert usage.inodes == 7
+        dirs = [tree, tree / "a", tree / "a" / "b", tree / "c"]
+        assert usage.apparent == self.du(*dirs) + 1110
+        files = [tree / "a" / "file", tree / "a" / "b" / "file", tree / "c" / "file"]
+        assert usage.allocated == sum(os.lstat(x).st_blocks * 512 for x in dirs + files)
+
+    def test_depth(self, tree):
+        usage = osutils.disk_usage([tree], depth=1, workers=2)
+        assert sorted(usage) == sorted(map(str, (tree, tree / "a", tree / "c")))
+        assert usage[str(tree / "c")].apparent == self.du(tree / "c") + 1000
+        assert usage[str(tree / "a")].files == 3
+        assert usage[str(tree / "a")].dirs == 2
+        total = usage[str(tree)]
+        assert total.apparent == self.du(tree) + sum(
+            usage[str(tree / x)].apparent for x in "ac"
+        )
+
+    def test_overlapping(self, tree):
+        paths = [tree / "a", tree, tree / "a", tree / "c" / "file"]
+        usage = osutils.disk_usage(paths)
+        assert sorted(usage) == sorted(map(str, set(paths)))
+        assert usage[str(tree / "a")].inodes == 4
+        # already accounted for paths are skipped
+        assert usage[str(tree)].inodes == 3
+        assert usage[str(tree / "c" / "file")].inodes == 0
+
+    def test_same_dir_inode(self, tmp_path):
+        # emulate bind mounting a directory to another path within the tree
+        for x in ("x", "y"):
+            (tmp_path / x / "sub").mkdir(parents=True)
+            (tmp_path / x / "file").write_bytes(b"x" * 10)
+        scan_dir = osutils._scan_dir
+        x_st = os.stat(tmp_path / "x")
+        y_st = os.stat(tmp_path / "y")
+
+        def _scan_dir(path, follow_symlinks):
+            results = scan_dir(path, follow_symlinks)
+            return [(entry, x_st if st == y_st else st) for entry, st in results]
+
+        with mock.patch("snakeoil.osutils._scan_dir", _scan_dir):
+            usage = osutils.disk_usage([tmp_path], depth=1, workers=1)
+        # only one of the directories was accounted for and descended into
+        assert len(usage) == 2
+        sub = next(v for k, v in usage.items() if k != str(tmp_path))
+        assert (sub.files, sub.dirs) == (1, 2)
+        assert usage[str(tmp_path)].files == 1
+        assert usage[str(tmp_path)].dirs == 3
+
+    def test_errors(self, tmp_path):
+        errors = []
+        assert osutils.disk_usage([tmp_path / "missing"], onerror=errors.append) == {}
+        assert isinstance(errors[0], FileNotFoundError)
+
+    def test_cli(self, tree):
+        from snakeoil.formatters import PlainTextFormatter
+        from snakeoil.tools.disk_usage import parser
+
+        stream = io.BytesIO()
+        out = PlainTextFormatter(stream)
+        options = parser.parse_args(["-b", "-c", "-d1", str(tree / "a"), str(tree)])
+        assert options.main_func(options, out, out) == 0
+        lines = [x.split("\t") for x in stream.getvalue().decode().splitlines()]
+        assert lines[0] == ["allocated", "apparent", "files", "dirs", "path"]
+        usage = osutils.disk_usage([tree])[str(tree)]
+        assert lines[-1] == [
+            str(usage.allocated),
+            str(usage.apparent),
+            str(usage.files),
+            str(usage.dirs),
+            "total",
+        ]
+
+    def test_cli_total_file_first(self, tree):
+        from snakeoil.formatters import PlainTextFormatter
+        from snakeoil.tools.disk_usage import parser
+
+        stream = io.BytesIO()
+        out = PlainTextFormatter(stream)
+        paths = [str(tree / "c" / "file"), str(tree / "a"), str(tree)]
+        options = parser.parse_args(["-b", "-c", *paths])
+        assert options.main_func(options, out, out) == 0
+        lines = [x.split("\t") for x in stream.getvalue().decode().splitlines()]
+        usage = osutils.disk_usage([tree])[str(tree)]
+        assert lines[-1] == [
+            str(usage.allocated),
+            str(usage.apparent),
+            str(usage.files),
+            str(usage.dirs),
+            "total",
+        ]
+
+
 class TestSizeofFmt:
     expected = {
         0: ("0.0 B", "0.0 B"),